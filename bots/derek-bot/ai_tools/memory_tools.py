@@ -3,9 +3,10 @@ import logging
 from discord import Member
 
 class MemoryTools:
-    def __init__(self, db_manager, memory_table_name):
+    def __init__(self, db_manager, memory_table_name, on_memories_changed=None):
         self.db_manager = db_manager
         self.memory_table_name = memory_table_name
+        self.on_memories_changed = on_memories_changed
 
     async def save_memory(self, memory_string: str, username: str):
         """
@@ -24,6 +25,8 @@ class MemoryTools:
         )
         if successfully_added:
             logging.info(f"User {username} saved memory: {memory_string}")
+            if self.on_memories_changed:
+                self.on_memories_changed()
             return "Memory successfully saved.", None
         else:
             return "Failed to save memory.", None
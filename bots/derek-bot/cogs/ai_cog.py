@@ -36,6 +36,7 @@ class AICog(commands.Cog):
 
             if successfully_added:
                 logging.info(f"User {interaction.user.name} saved memory: {memory}")
+                self.bot.llm_manager.refresh_static_prompts()
                 await interaction.followup.send("Memory successfully saved")
             else:
                 logging.error(f"Failed to save memory for user {interaction.user.name}: {memory}")
@@ -95,6 +96,7 @@ class AICog(commands.Cog):
 
             if successfully_removed:
                 logging.info(f"User {interaction.user.name} removed memory: {memory_text}")
+                self.bot.llm_manager.refresh_static_prompts()
                 await interaction.followup.send("Removed **" + memory_text + "** from Derek's memory")
             else:
                 logging.error(f"Failed to remove memory for user {interaction.user.name}: {memory_text}")
@@ -3,7 +3,6 @@ import os
 import logging
 import re
 import time
-import io
 from distutils.util import strtobool
 import json
 
@@ -19,9 +18,12 @@ from datetime import datetime, timezone
 import pytz
 from shared.numeric_helpers import get_suffix
 from shared.TTSManager import TTSManager
+from shared.tts_engines import get_default_local_engine
+from shared.tts_text_normalizer import TTSTextNormalizer
 from shared.VCAudioManager import VCAudioManager
 from shared.cred_utils import save_google_service_file
 from shared.ChatLLMManager import ChatLLMManager, ConversationCache
+from shared.streaming_reply import StreamingReply
 from ai_tools.memory_tools import MemoryTools
 from ai_tools.color_tools import generate_color_swatch
 from ai_tools.tool_configs import tool_definitions
@@ -96,7 +98,7 @@ save_google_service_file()
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'google-services.json'
 
 # Setting up the TTS manager and VC Audio Manager
-tts_manager = TTSManager(os.path.join("tts_files"))
+tts_manager = TTSManager(os.path.join("tts_files"), local_engine=get_default_local_engine())
 audio_manager = VCAudioManager(tts_manager)
 
 # Getting the discord bot info
@@ -104,7 +106,7 @@ DISCORD_TOKEN = os.environ.get('MAIN_DISCORD_TOKEN')
 OPEN_AI_KEY = os.environ.get('OPEN_AI_KEY')
 
 # Conversation cache for message caching
-conversation_cache = ConversationCache()
+conversation_cache = ConversationCache(store_path=os.path.join("conversation_cache", "messages.jsonl"))
 
 # Getting GPT config info
 gpt_system_prompt = db_manager.get_item_by_key(
@@ -134,6 +136,7 @@ llm_manager = ChatLLMManager(
     tool_definitions=tool_definitions,
     get_memories=memory_tools.get_memories
 )
+memory_tools.on_memories_changed = llm_manager.refresh_static_prompts
 
 
 # Setting up intents for permissions
@@ -168,6 +171,7 @@ class DerekBot(commands.Bot):
         self.audio_manager = audio_manager
         self.conversation_cache = conversation_cache
         self.llm_manager = llm_manager
+        self.tts_text_normalizer = TTSTextNormalizer()
 
         self.guild = None
         self.guild_id = None
@@ -205,6 +209,16 @@ class DerekBot(commands.Bot):
         await self.tree.sync()
         logging.info("Synced commands and added all cogs")
 
+        # Opening the TTS connection early so the first vc-text message isn't slowed down
+        await self.tts_manager.warm_up()
+
+    async def close(self):
+        """
+        Called by discord.py on shutdown. Closes the GPT client's connections before the bot closes.
+        """
+        await self.llm_manager.close()
+        await super().close()
+
     def set_config_data_from_db_manager(self):
         """
         Updates variables for Discord IDs and other config data from the database.
@@ -497,10 +511,15 @@ class DerekBot(commands.Bot):
         else:
             logging.warning(f"Joins/leaves channel '{self.joins_leaves_channel_name}' not found in guild '{member.guild.name}', cannot announce member leave.")
 
-    @staticmethod
-    def replace_emoji_tags(text):
-        emoji_tag_pattern = re.compile(r"<a?:([a-zA-Z0-9_]+):\d+>")
-        return emoji_tag_pattern.sub(lambda m: f"{m.group(1)}", text)
+    async def on_member_update(self, before: Member, after: Member):
+        """
+        Called when a member's profile changes. Drops their rendered TTS name clips if their display name changed.
+
+        :param before: The member before the update
+        :param after: The member after the update
+        """
+        if before.display_name != after.display_name:
+            self.tts_manager.invalidate_name_clips(after.id)
 
     async def on_message(self, message):
         """
@@ -535,34 +554,32 @@ class DerekBot(commands.Bot):
                 await self.conversation_cache.add_message(message)
                 message_chain = self.conversation_cache.get_message_chain(message)
 
-                # Executing the model
-                gpt_message, images = await self.llm_manager.process_with_history(message_chain)
-
-                # Converting images to discord files
-                discord_file_images = []
-                for idx, image in enumerate(images):
-                    buffer = io.BytesIO()
-                    image.save(buffer, format="PNG")
-                    buffer.seek(0)
-                    discord_file_images.append(
-                        discord.File(buffer, filename=f"image_{idx}.png")
-                    )
-
-                # Sending the message
-                reply_message = await message.reply(
-                    content=gpt_message.content[:2000],
-                    files=discord_file_images[:10]
-                )
-                logging.info(f"AI response sent to {message.author.name} in channel {message.channel.name}")
-                await self.conversation_cache.add_message(reply_message)
-
-        # Beginning TTS processing. Check for messages containing URLs, return so we don't say them
-        if "https://" in message.content:
-            logging.warning("Skipping TTS for message that contained an HTTPS url")
-            return
+                # Executing the model, streaming its response into a reply as it's written
+                reply = StreamingReply(message)
+                gpt_message, images = await self.llm_manager.process_with_history(message_chain, on_text=reply.write)
+                reply_messages = await reply.finish(images)
+
+                # Caching the reply if things are valid
+                if reply_messages:
+                    if not (gpt_message and gpt_message.content):
+                        logging.warning("GPT response was cut off, keeping the part that was already sent.")
+                    logging.info(f"AI response sent to {message.author.name} in channel {message.channel.name}")
+                    for reply_message in reply_messages:
+                        await self.conversation_cache.add_message(reply_message)
+                else:
+                    logging.error("GPT message was None or missing content. Sending fallback error message.")
+                    await message.reply("`Sorry, something went wrong with your request. Please try again later.`")
 
         # Checking if tts is enabled and that messages are in the tts channel
         if self.tts_enabled and message.channel.id == self.vc_text_channel_id:
+            # Resolving mentions and emoji and stripping markdown. Return for URLs so we don't say them
+            normalized_message = self.tts_text_normalizer.normalize_message(message)
+            if normalized_message.contains_url:
+                logging.warning("Skipping TTS for message that contained a url")
+                return
+            if not normalized_message.text:
+                return
+
             # Making sure that they are in a voice channel
             if message.author.voice and message.author.voice.channel:
                 # Getting the user
@@ -577,29 +594,21 @@ class DerekBot(commands.Bot):
                     self.last_tts_user_id != message.author.id
                     and (db_user and db_user.get("vc_text_announce_name"))
                 )
-                if announce_name:
-                    final_tts_message = f"{message.author.display_name} says: {message.content}"
-                else:
-                    final_tts_message = message.content
-                
                 self.last_tts_user_id = message.author.id
 
-                # Removing emoji ids from TTS messages
-                final_tts_message = self.replace_emoji_tags(final_tts_message)
-
-                # Replacing mentions with user display name 
-                for user in message.mentions:
-                    final_tts_message = re.sub(f"<@!?{user.id}>", f"@ {user.display_name}", final_tts_message)
-
                 # Get tts_language from db_user if available
                 tts_language = db_user.get("tts_language") if db_user else None
 
-                # Generating the audio file and adding it to the queue for VC
-                file_path = self.tts_manager.process(final_tts_message, tts_language)
-                if file_path:
-                    await self.audio_manager.add_to_queue(file_path, message.author.voice.channel)
-                else:
-                    logging.error(f"TTS processing failed for message by {message.author.name}")
+                # Adding the message to the VC queue, the audio is synthesized in the background
+                await self.audio_manager.add_tts_to_queue(
+                    normalized_message.text,
+                    message.author.voice.channel,
+                    voice_key=tts_language,
+                    audio_name="TTS message",
+                    added_by=message.author.name,
+                    speaker_id=message.author.id,
+                    speaker_name=message.author.display_name if announce_name else None
+                )
             else:
                 # If Derek hasn't warned a user of not being in the VC within the past 3 minutes, warn them
                 if time.time() - self.last_vc_text_warning_time >= 180:
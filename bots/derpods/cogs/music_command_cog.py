@@ -288,7 +288,10 @@ class MusicCommandCog(commands.Cog):
             Returns the duration of the currently playing audio item.
             """
             current_audio_item = self.music_service.audio_manager.current_audio_item
-            return format_duration(current_audio_item.duration) if current_audio_item else "??:??"
+            if not current_audio_item:
+                return "??:??"
+            position = self.music_service.audio_manager.get_current_position()
+            return f"{format_duration(position)} / {format_duration(current_audio_item.duration)}"
 
         def get_current_audio_state():
             """
@@ -346,6 +349,46 @@ class MusicCommandCog(commands.Cog):
             view=discord_list.create_view()
         )
 
+    @group.command(name="seek", description="Seek the current song to a position")
+    @app_commands.describe(
+        minutes="Minutes into the song",
+        seconds="Seconds into the song"
+    )
+    async def seek(self, interaction: Interaction, minutes: int = 0, seconds: int = 0):
+        """
+        Seeks the currently playing song to the given position.
+
+        :param interaction: The Discord interaction object
+        :param minutes: The minutes component of the position
+        :param seconds: The seconds component of the position
+        """
+        position = minutes * 60 + seconds
+        successfully_seeked = self.music_service.audio_manager.seek_current(position)
+        if successfully_seeked:
+            logging.info(f"User {interaction.user.name} seeked current song to {position}s")
+            await interaction.response.send_message(f"Seeked to **{position // 60:02d}:{position % 60:02d}**.")
+        else:
+            logging.warning(f"User {interaction.user.name} failed to seek current song to {position}s")
+            await interaction.response.send_message(
+                "`Failed to seek. Is a song playing and is the position within its duration?`",
+                ephemeral=True
+            )
+
+    @group.command(name="replay", description="Restart the current song from the beginning")
+    async def replay(self, interaction: Interaction):
+        """
+        Restarts the currently playing song from the beginning.
+
+        :param interaction: The Discord interaction object
+        """
+        successfully_replayed = self.music_service.audio_manager.replay_current()
+        if successfully_replayed:
+            logging.info(f"User {interaction.user.name} replayed the current song")
+            await interaction.response.send_message("Restarted the current song.")
+        else:
+            logging.warning(f"User {interaction.user.name} failed to replay the current song")
+            await interaction.response.send_message("`No song is currently playing.`", ephemeral=True)
+
     @group.command(name="skipall", description="Skip all songs in the queue and stop playback")
     async def skip_all(self, interaction: Interaction):
         """
@@ -1,17 +1,24 @@
+import asyncio
 import json
-import random
-from typing import List
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
 
+import discord
 from discord import Message
 import openai
+from openai.types.chat import ChatCompletionMessage
+from shared.conversation_store import ConversationStore
 from shared.discord_utils import get_message_history
+from shared.token_counter import TokenCounter
 import logging
 from PIL import Image
 from datetime import datetime
 import pytz
 
 class CachedMessage:
-    def __init__(self, message_id, author, content, image_url):
+    def __init__(self, message_id, author, content, image_url, parent_id=None):
         """
         Object for storing information about a CachedMessage
 
@@ -19,11 +26,13 @@ class CachedMessage:
         :param author: The discord message author's name
         :param content: The content of the discord message
         :param image_url: The url of the image attached to the message
+        :param parent_id: The id of the message this one replied to, None if it didn't reply to anything
         """
         self.message_id = message_id  # Need this incase we have a middle of cache lookup
         self.author = author
         self.message = content
         self.image_url = image_url
+        self.parent_id = parent_id
 
     def __str__(self):
         """
@@ -34,24 +43,99 @@ class CachedMessage:
         return (f"('message_id': {self.message_id}, "
                 f"'author': {self.author}, "
                 f"'message': {self.message}, "
-                f"'image_url': {self.image_url})")
+                f"'image_url': {self.image_url}, "
+                f"'parent_id': {self.parent_id})")
+
+    def to_dict(self) -> dict:
+        """
+        Converts the message to a dictionary for storing
+
+        :return: The message as a dictionary
+        """
+        return {
+            "message_id": self.message_id,
+            "author": self.author,
+            "message": self.message,
+            "image_url": self.image_url,
+            "parent_id": self.parent_id
+        }
+
+    @staticmethod
+    def from_dict(message_dict: dict):
+        """
+        Creates a CachedMessage from a dictionary made by to_dict
+
+        :param message_dict: The message as a dictionary
+        :return: The CachedMessage
+        """
+        return CachedMessage(
+            message_id=message_dict["message_id"],
+            author=message_dict.get("author"),
+            content=message_dict.get("message"),
+            image_url=message_dict.get("image_url"),
+            parent_id=message_dict.get("parent_id")
+        )
 
 
 class ConversationCache:
-    def __init__(self):
+    def __init__(self, max_messages=5000, max_conversations=500, max_bytes=8 * 1024 * 1024,
+                 conversation_ttl=24 * 60 * 60, store_path=None, max_history_depth=50):
         """
         Handles the caching of discord messages
 
-        message_chains: stores each chain, with all conversation info
-        message_to_chain: stores each individual message and the chain it is found in
+        Messages are stored as a tree, each message pointing to the message it replied to. A message's chain is
+        found by walking up to the root, so adding a message (or replying mid-thread, forking the conversation)
+        never copies a chain, and every message is only cached once however many chains it's part of.
+
+        The cache is bounded. Whole conversations (every message under the same first message) are evicted at once,
+        least recently used first, so a cached chain never has a gap in it. The conversation in use is never evicted,
+        so one very long conversation can take the cache over its limits.
+
+        If a store path is given, every cached message is also appended to a ConversationStore on disk. Replies to
+        messages that aren't in memory (evicted, or from before a restart) are loaded from the store before falling
+        back to downloading the history from Discord.
+
+        messages: stores each individual message by its id
         Authors listed as None are the bot and are system messages
         Bot user id is the id of the bot so we can identify which messages are from the bot
 
+        :param max_messages: The max number of messages to keep
+        :param max_conversations: The max number of conversations to keep
+        :param max_bytes: The max (approximate) memory the cached messages can use
+        :param conversation_ttl: How long (in seconds) a conversation is kept after it was last added to or read
+        :param store_path: The path of the on-disk store file, None to only keep messages in memory
+        :param max_history_depth: The max number of messages to download above a message. If a download fails
+                                  partway, the rest of the chain is retried the next time the chain is added to
         """
-        self.message_chains = {}
-        self.message_to_chain = {}
+        self.messages: Dict[int, CachedMessage] = {}
         self.bot_user_id = None
 
+        self.max_messages = max_messages
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.conversation_ttl = conversation_ttl
+        self.max_history_depth = max_history_depth
+
+        # The first message of each message's conversation, and each conversation's message ids by first message,
+        # least recently used first
+        self._message_roots: Dict[int, int] = {}
+        self._conversations: "OrderedDict[int, Set[int]]" = OrderedDict()
+        self._conversation_last_used: Dict[int, float] = {}
+        self._bytes = 0
+
+        self.store = ConversationStore(store_path) if store_path else None
+        self._unsaved_messages: List[CachedMessage] = []
+
+        # Ids of messages that were deleted, so gaps above them aren't retried
+        self._missing_message_ids: Set[int] = set()
+
+        # Counters for monitoring
+        self.lru_evictions = 0
+        self.ttl_evictions = 0
+        self.evicted_messages = 0
+        self.store_hits = 0
+        self.history_downloads = 0
+
     def update_bot_user_id(self, user_id):
         """
         Sets the bot user id for determining who the bot is in the conversation
@@ -61,16 +145,6 @@ class ConversationCache:
         """
         self.bot_user_id = user_id
 
-    async def _new_chain_id(self):
-        """
-        Gets a random chain id that is not already in use
-
-        :return: Returns a random unused chain id
-        """
-        current_ids = self.message_chains.keys()
-        available_ids = set(range(1, 999999)) - current_ids
-        return random.choice(tuple(available_ids))
-
     def convert_messages_to_cache_chain(self, message_list: [Message]):
         """
         Converts a list of discord.Messages to a list of CachedMessage
@@ -82,7 +156,8 @@ class ConversationCache:
             CachedMessage(message_id=msg.id,
                           author=self.remove_author_name_if_bot(msg),
                           content=msg.content,
-                          image_url=self.get_image_from_message(msg))
+                          image_url=self.get_image_from_message(msg),
+                          parent_id=msg.reference.message_id if msg.reference else None)
             for msg in message_list
         ]
 
@@ -112,103 +187,276 @@ class ConversationCache:
         The user method of adding a message to the cache using discord.Message
 
         :param message: a discord.Message object to add to the cache
-        :return: The chain id of the chain the message was added to
         """
         # Checking if a message is already cached
-        if message.id in self.message_to_chain:
-            return None
+        if message.id in self.messages:
+            return
+
+        # Getting the message's history if we haven't seen the message it replied to, from the store if we can
+        if message.reference:
+            parent_id = message.reference.message_id
+            if parent_id in self.messages or await self._load_from_store(parent_id):
+                await self._fill_history_gap(message)
+            else:
+                await self._download_message_history(message)
 
-        # Getting the chain, making a new one if it doesn't exist
-        chain_id = await self._find_message_chain_id(message)
-        if chain_id:
-            chain = self.message_chains[chain_id]
+        # Adding the message to the cache, under the message it replied to
+        cached_message = self.convert_messages_to_cache_chain([message])[0]
+        self._insert_message(cached_message)
+        self._touch_conversation(self._message_roots[cached_message.message_id])
+        self._evict()
+        await self._save_new_messages()
 
-            # Getting the current list of message ids in the chain
-            chain_message_ids = [chain_msg.message_id for chain_msg in chain]
+    async def _load_from_store(self, message_id):
+        """
+        Loads a message and the messages above it in its reply chain from the store
 
-            # If the parent message is not at the end of the cache, create a new chain id/chain
-            if message.reference.message_id in chain_message_ids[:-1]:
-                chain = chain[:chain_message_ids.index(message.reference.message_id) + 1]
-                chain_id = await self._new_chain_id()
-                self.message_chains[chain_id] = chain
-        else:
-            # Making the new chain
-            chain_id = await self._new_chain_id()
-            chain = self.message_chains.setdefault(chain_id, [])
-
-        # Checking to see if we have a bot message, treating it as such if we do, otherwise just add the name
-        author_name = self.remove_author_name_if_bot(message)
-
-        # Adding the message to the cache
-        self.message_chains[chain_id].append(
-            CachedMessage(message_id=message.id,
-                          author=author_name,
-                          content=message.content,
-                          image_url=self.get_image_from_message(message))
-        )
-        self.message_to_chain[message.id] = chain_id
+        :param message_id: The id of the message to load
+        :return: True if the message was found in the store
+        """
+        if not self.store:
+            return False
+
+        records = await asyncio.to_thread(self.store.get_chain, message_id)
+        for record in reversed(records):
+            if record["message_id"] not in self.messages:
+                self._insert_message(CachedMessage.from_dict(record), save=False)
+
+        if records:
+            self.store_hits += 1
+            logging.info(f"Loaded {len(records)} messages for message {message_id} from the conversation store")
+        return bool(records)
 
-    async def _find_message_chain_id(self, child_message: Message):
+    async def _save_new_messages(self):
         """
-        Gets the chain id the message is found in
+        Appends the messages cached since the last save to the store
+        """
+        if not (self.store and self._unsaved_messages):
+            return
+
+        records = [cached_message.to_dict() for cached_message in self._unsaved_messages]
+        self._unsaved_messages.clear()
+        await asyncio.to_thread(self.store.append, records)
+
+    async def _download_message_history(self, child_message: Message):
+        """
+        Downloads the chain of messages the message replied to, and adds them to the cache
         For internal use only, more friendly functions should be available for getting chain without list interactions
 
-        :param child_message: The child message to find the chain id for
-        :return: id of the chain associated with the message, none if one isn't found
+        :param child_message: The child message to download the history for
+        """
+        self.history_downloads += 1
+        message_chain: [Message] = await get_message_history(
+            child_message,
+            max_depth=self.max_history_depth,
+            known_message_ids=self.messages
+        )
+        cached_chain = self.convert_messages_to_cache_chain(message_chain)
+
+        # The top of the downloaded chain may be a reply to a message we have stored
+        if cached_chain and cached_chain[0].parent_id and cached_chain[0].parent_id not in self.messages:
+            await self._load_from_store(cached_chain[0].parent_id)
+
+        for chain_msg in cached_chain:
+            if chain_msg.message_id not in self.messages:
+                self._insert_message(chain_msg)
+
+    async def _fill_history_gap(self, message: Message):
+        """
+        Retries the top of a message's chain if an earlier download stopped partway, leaving the chain's first message
+        replying to one that isn't cached or stored. Chains that reached the max history depth are left as they are.
+        The retried messages are stored, so the gap isn't kept in the store for good.
+
+        :param message: The new message, whose parent is cached
         """
-        if child_message.reference:
-            # Get the reference from the cache, if not there, then we need to download it from discord
-            if child_message.reference.message_id in self.message_to_chain.keys():
-                chain_id = self.message_to_chain[child_message.reference.message_id]
-                return chain_id
+        # Walking up to the first cached message of the chain
+        chain_length = 1
+        top_message = self.messages.get(message.reference.message_id)
+        while top_message and top_message.parent_id in self.messages and chain_length < self.max_history_depth:
+            top_message = self.messages[top_message.parent_id]
+            chain_length += 1
+
+        gap_id = top_message.parent_id if top_message else None
+        if chain_length >= self.max_history_depth or gap_id is None or gap_id in self.messages:
+            return
+        if gap_id in self._missing_message_ids:
+            return
+
+        if not await self._load_from_store(gap_id):
+            self.history_downloads += 1
+            try:
+                gap_message = await message.channel.fetch_message(gap_id)
+            except discord.NotFound:
+                logging.info(f"Message {gap_id} in a conversation's history was deleted, not retrying it")
+                self._missing_message_ids.add(gap_id)
+                return
+            except discord.HTTPException as e:
+                logging.error(f"Failed to download message history gap at message {gap_id}: {e}")
+                return
+
+            message_chain = await get_message_history(
+                gap_message,
+                max_depth=self.max_history_depth - chain_length - 1,
+                known_message_ids=self.messages
+            )
+            for chain_msg in self.convert_messages_to_cache_chain(message_chain + [gap_message]):
+                if chain_msg.message_id not in self.messages:
+                    self._insert_message(chain_msg)
+            logging.info(f"Filled a gap of {len(message_chain) + 1} messages in a conversation's history")
+
+        # The conversation now starts further up, so it's joined onto the conversation above it
+        root_id = self._message_roots[top_message.message_id]
+        if gap_id in self._message_roots and self._message_roots[gap_id] != root_id:
+            self._merge_conversations(root_id, self._message_roots[gap_id])
+
+    def _merge_conversations(self, root_id, new_root_id):
+        """
+        Moves every message of a conversation into another one, once they're found to be the same conversation.
+
+        :param root_id: The id of the first message of the conversation to move
+        :param new_root_id: The id of the first message of the conversation to move it into
+        """
+        message_ids = self._conversations.pop(root_id)
+        for message_id in message_ids:
+            self._message_roots[message_id] = new_root_id
+        self._conversations[new_root_id] |= message_ids
+        self._conversation_last_used[new_root_id] = max(
+            self._conversation_last_used.pop(root_id), self._conversation_last_used[new_root_id]
+        )
+
+    def _insert_message(self, cached_message: CachedMessage, save=True):
+        """
+        Stores a message, adding it to the conversation of the message it replied to (or starting a new one).
+
+        :param cached_message: The message to store
+        :param save: Whether to save the message to the store, False if it came from the store
+        """
+        root_id = self._message_roots.get(cached_message.parent_id, cached_message.message_id)
+        self.messages[cached_message.message_id] = cached_message
+        self._message_roots[cached_message.message_id] = root_id
+        self._conversations.setdefault(root_id, set()).add(cached_message.message_id)
+        self._conversation_last_used.setdefault(root_id, time.monotonic())
+        self._bytes += self._get_message_size(cached_message)
+        if save and self.store:
+            self._unsaved_messages.append(cached_message)
+
+    @staticmethod
+    def _get_message_size(cached_message: CachedMessage):
+        """
+        Estimates the memory a cached message uses.
+
+        :param cached_message: The cached message
+        :return: The size in bytes
+        """
+        return (
+            sys.getsizeof(cached_message)
+            + sys.getsizeof(cached_message.message)
+            + sys.getsizeof(cached_message.author)
+            + sys.getsizeof(cached_message.image_url)
+        )
+
+    def _touch_conversation(self, root_id):
+        """
+        Marks a conversation as the most recently used.
+
+        :param root_id: The id of the conversation's first message
+        """
+        self._conversations.move_to_end(root_id)
+        self._conversation_last_used[root_id] = time.monotonic()
+
+    def _evict(self):
+        """
+        Evicts expired conversations, then the least recently used conversations until the cache is within its
+        limits. The most recently used conversation is always kept.
+        """
+        now = time.monotonic()
+        while len(self._conversations) > 1:
+            root_id = next(iter(self._conversations))
+            if now - self._conversation_last_used[root_id] > self.conversation_ttl:
+                self.ttl_evictions += 1
+            elif (len(self.messages) > self.max_messages or len(self._conversations) > self.max_conversations
+                  or self._bytes > self.max_bytes):
+                self.lru_evictions += 1
             else:
-                message_chain: [Message] = await get_message_history(child_message)
-                chain = self.convert_messages_to_cache_chain(message_chain)
-
-                # Assuming we got some messages from the history, add everything back to the cache
-                if chain:
-                    chain_id = await self._new_chain_id()
-                    for chain_msg in chain:
-                        self.message_to_chain[chain_msg.message_id] = chain_id
-
-                    self.message_chains[chain_id] = chain
-                    return chain_id
-                else:
-                    # Defaulting to none if for whatever reason an empty list is returned
-                    return None
-        else:
-            return None
+                break
+            self._remove_conversation(root_id)
+
+    def _remove_conversation(self, root_id):
+        """
+        Removes every message in a conversation from the cache.
+
+        :param root_id: The id of the conversation's first message
+        """
+        message_ids = self._conversations.pop(root_id)
+        del self._conversation_last_used[root_id]
+        for message_id in message_ids:
+            self._bytes -= self._get_message_size(self.messages.pop(message_id))
+            del self._message_roots[message_id]
+        self.evicted_messages += len(message_ids)
 
     def get_message_chain(self, message: Message) -> list:
         """
         The user method of getting a message chain for the given message if one exists
 
         :param message: The message to find a chain for
-        :return: Returns the message chain for that message, otherwise returns an empty list
+        :return: Returns the message chain for that message, from the first message to the given message,
+                 otherwise returns an empty list
         """
-        # Getting the chain id/chain if one is available
-        if message.id in self.message_to_chain.keys():
-            chain_id = self.message_to_chain[message.id]
-            return self.message_chains[chain_id]
-        else:
+        if message.id not in self.messages:
             logging.warning(f"Failed to find message with id {message.id} in cache")
             return []
+        self._touch_conversation(self._message_roots[message.id])
+
+        # Walking up the replies until we reach the first message, or one that isn't cached
+        chain = []
+        message_id = message.id
+        while message_id in self.messages:
+            cached_message = self.messages[message_id]
+            chain.append(cached_message)
+            message_id = cached_message.parent_id
+
+        chain.reverse()
+        return chain
+
+    def get_stats(self) -> dict:
+        """
+        Gets the cache counters and sizes for monitoring.
+
+        :return: A dictionary of cache stats
+        """
+        return {
+            "messages": len(self.messages),
+            "conversations": len(self._conversations),
+            "bytes": self._bytes,
+            "lru_evictions": self.lru_evictions,
+            "ttl_evictions": self.ttl_evictions,
+            "evicted_messages": self.evicted_messages,
+            "store_hits": self.store_hits,
+            "history_downloads": self.history_downloads
+        }
 
     def clear_cache(self):
         """
-        Removes all items from the cache
+        Removes all items from the cache. The on-disk store is kept
         """
-        self.message_to_chain.clear()
-        self.message_chains.clear()
+        self.messages.clear()
+        self._message_roots.clear()
+        self._conversations.clear()
+        self._conversation_last_used.clear()
+        self._bytes = 0
 
 
 class ChatLLMManager:
     def __init__(self, api_key: str, system_prompt: str, model_name: str = "gpt-4o-mini",
                  temperature: float = 0.04, tool_function_references: dict = None,
                  tool_definitions: List[dict] = None, get_memories=None, get_metadata=None,
-                 image_persistence_length=10):
+                 image_persistence_length=10, request_timeout=60.0, response_timeout=120.0, max_retries=2,
+                 max_concurrent_requests=8, max_tool_rounds=3, tool_timeout=20.0, context_token_budget=8000,
+                 summary_model_name=None, summary_max_tokens=400, summary_block_size=20, max_cached_summaries=500):
         """
         Handles API interactions with GPT, runs tools as needed.
+        Requests are made with the async client, so the event loop (and TTS, music and other mentions) keeps running
+        while the model responds. The client's connection pool is shared by every request.
 
         :param api_key: The api key for authorization
         :param system_prompt: The system prompt for the model to use
@@ -216,11 +464,28 @@ class ChatLLMManager:
         :param temperature: The creativity of the model. Higher numbers closer to 1 are more creative
         :param tool_function_references: Dictionary of tools and how they relate to called functions
         :param tool_definitions: list of tools that can be called by the ML model
-        :param get_memories: Function to get a string of memories for the model
+        :param get_memories: Function to get a string of memories for the model. Called when the system prompts
+                             are refreshed, not for every request
         :param image_persistence_length: The number of messages before images are no longer sent to the model
+        :param request_timeout: The max time (in seconds) to wait on a single API request
+        :param response_timeout: The max time (in seconds) to spend on a response, including every tool call and
+                                 retry. The response is cancelled after this
+        :param max_retries: The number of times the client retries a failed request
+        :param max_concurrent_requests: The max number of API requests to have in flight at once
+        :param max_tool_rounds: The max number of rounds of tool calls the model can make for one response
+        :param tool_timeout: The max time (in seconds) a single tool call can take
+        :param context_token_budget: The max number of tokens of prompt to send for a message chain. The newest
+                                     messages are sent as they are, older ones are replaced by a summary
+        :param summary_model_name: The name of the model that summarizes older messages, defaults to the model
+        :param summary_max_tokens: The max length of a summary in tokens, reserved out of the context budget
+        :param summary_block_size: The number of messages summaries grow by. A chain's summary only changes once
+                                   every block, and each block is summarized in one request
+        :param max_cached_summaries: The max number of summaries to keep, least recently used are dropped first
         """
         # Updating the api_key, Defining the client
-        self.client = openai.OpenAI(api_key=api_key)
+        self.client = openai.AsyncOpenAI(api_key=api_key, timeout=request_timeout, max_retries=max_retries)
+        self.response_timeout = response_timeout
+        self.request_semaphore = asyncio.Semaphore(max_concurrent_requests)
 
         # Model settings
         self.system_prompt = system_prompt
@@ -231,25 +496,67 @@ class ChatLLMManager:
         self.get_memories = get_memories
         self.get_metadata = get_metadata
         self.image_persistence_length = image_persistence_length
-
-    def get_system_prompts(self) -> List[dict]:
+        self.max_tool_rounds = max_tool_rounds
+        self.tool_timeout = tool_timeout
+
+        # Context budget settings
+        self.token_counter = TokenCounter(model_name)
+        self.context_token_budget = context_token_budget
+        self.summary_model_name = summary_model_name or model_name
+        self.summary_max_tokens = summary_max_tokens
+        self.summary_block_size = max(summary_block_size, 1)
+        self.max_cached_summaries = max_cached_summaries
+
+        # Rolling summaries of the start of a chain, keyed by the id of the last message they cover.
+        # A message's chain is the same every time, so a summary can be reused by every later message below it.
+        # Only one summary task runs per conversation, keyed by the id of its first message
+        self.summaries: "OrderedDict[int, str]" = OrderedDict()
+        self._summary_tasks: Dict[int, asyncio.Task] = {}
+
+        # The system prompt and memories, built once and reused so every request starts with the same prefix
+        self._static_prompts: Optional[List[dict]] = None
+
+        # Prompt caching counters, from the token usage the API reports
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+
+    def refresh_static_prompts(self):
         """
-        Loads the system prompt and memories into a memory list to be given to a chat completion model
-
-        :return: Memory list to be fed into chat completion model
+        Rebuilds the system prompt and memories sent at the start of every request.
+        Called when the system prompt or memories change, instead of rebuilding them for every request.
         """
-        system_prompts = [
+        static_prompts = [
             {"role": "system", "content": self.system_prompt}
         ]
 
         # Loading the memories
         if self.get_memories:
             memories = self.get_memories()
-            system_prompts.append({
+            static_prompts.append({
                 "role": "system",
                 "content": f"Memories:\n{memories}"
             })
 
+        self._static_prompts = static_prompts
+
+    def get_system_prompts(self) -> List[dict]:
+        """
+        Gets the system prompt and memories to start the message list given to a chat completion model.
+        They only change when refreshed, so requests share a prefix the API can cache.
+
+        :return: Memory list to be fed into chat completion model
+        """
+        if self._static_prompts is None:
+            self.refresh_static_prompts()
+        return list(self._static_prompts)
+
+    def get_metadata_prompt(self) -> dict:
+        """
+        Builds the metadata message with the date, time, and any extra metadata.
+        It changes every minute, so it goes at the end of the message list to keep the prefix cacheable.
+
+        :return: The metadata message
+        """
         # Loading the metadata dates
         date = datetime.now(pytz.timezone('US/Eastern'))
         date_str = date.strftime("%m-%d-%Y")
@@ -266,119 +573,427 @@ class ChatLLMManager:
         if self.get_metadata:
             metadata_lines.append(self.get_metadata())
 
-        # Adding the metadata to our system_prompts
-        system_prompts.append({
+        return {
             "role": "system",
             "content": "\n".join(metadata_lines)
-        })
+        }
+
+    def format_cached_message(self, msg: CachedMessage, include_image=False) -> dict:
+        """
+        Converts a cached message to one ready for GPT consumption. Includes name information to the model.
 
-        return system_prompts
+        :param msg: The cached message to convert
+        :param include_image: Whether to send the message's image
+        :return: The message for use by chatgpt
+        """
+        content = [{
+            "type": "text",
+            "text": msg.message if msg.author is None else f"{msg.author}: {msg.message}"
+        }]
+
+        if msg.image_url and include_image:
+            content.append({
+                "type": "image_url",
+                "image_url": {"url": msg.image_url, "detail": "low"},
+            })
+
+        return {
+            "role": "assistant" if msg.author is None else "user",
+            "content": content
+        }
 
     def generate_gpt_messages_list(self, message_chain: List[CachedMessage]):
         """
-        Converts cached messages to those ready for GPT consumption. Includes name information to the model.
-        Also includes the system prompt as needed.
+        Converts cached messages to those ready for GPT consumption, keeping the prompt within the context budget.
+        The newest messages are sent as they are, for as many as fit. Older messages are replaced by a rolling
+        summary, which is made in the background a block of messages at a time so it never holds up a response.
+        Until the summary catches up, the latest one ready is used and the messages after it are sent as they are,
+        for as many as fit in the whole budget.
+        Starts with the system prompt and memories, and ends with the metadata so the start stays cacheable.
 
         :param message_chain: The cached messages to convert
         :return: A list of messages for use by chatgpt
         """
         message_list = self.get_system_prompts()
+        metadata_prompt = self.get_metadata_prompt()
         message_chain_length = len(message_chain)
+        available_tokens = self.context_token_budget - sum(
+            self.token_counter.count_message(system_message) for system_message in message_list + [metadata_prompt]
+        )
 
-        for idx, msg in enumerate(message_chain):
-            content = [{
-                "type": "text",
-                "text": msg.message if msg.author is None else f"{msg.author}: {msg.message}"
-            }]
+        # Working back from the newest message, which is always sent, until the whole budget is used.
+        # Tracking the tokens from each message to the end of the chain
+        gpt_messages = {}
+        tokens_to_end = {message_chain_length: 0}
+        first_fitting_idx = message_chain_length
+        for idx in range(message_chain_length - 1, -1, -1):
+            include_image = idx > (message_chain_length - self.image_persistence_length - 1)
+            gpt_message = self.format_cached_message(message_chain[idx], include_image)
+            tokens = tokens_to_end[idx + 1] + self.token_counter.count_message(gpt_message)
+            if gpt_messages and tokens > available_tokens:
+                break
+
+            gpt_messages[idx] = gpt_message
+            tokens_to_end[idx] = tokens
+            first_fitting_idx = idx
+
+        def get_first_fitting_idx(spare_tokens):
+            return next(
+                (idx for idx in range(first_fitting_idx, message_chain_length - 1)
+                 if tokens_to_end[idx] <= spare_tokens),
+                message_chain_length - 1
+            )
+
+        start_idx = first_fitting_idx
+        if first_fitting_idx > 0:
+            # The summary should cover everything that doesn't fit next to a full length summary
+            summarized_count, summary = self.get_summary(
+                message_chain, get_first_fitting_idx(available_tokens - self.summary_max_tokens)
+            )
+            start_idx = summarized_count
+            if summary:
+                summary_prompt = {
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{summary}"
+                }
+                message_list.append(summary_prompt)
+                available_tokens -= self.token_counter.count_message(summary_prompt)
+
+            # Messages the summary hasn't caught up to yet are only left out if they don't fit at all
+            start_idx = max(start_idx, get_first_fitting_idx(available_tokens))
+
+        message_list.extend(gpt_messages[idx] for idx in range(start_idx, message_chain_length))
+        message_list.append(metadata_prompt)
+        return message_list
 
-            if msg.image_url and (idx > (message_chain_length - self.image_persistence_length - 1)):
-                content.append({
-                    "type": "image_url",
-                    "image_url": {"url": msg.image_url, "detail": "low"},
-                })
+    def get_summary(self, message_chain: List[CachedMessage], unsent_count):
+        """
+        Gets the summary of the start of a chain. Summaries end on block boundaries, so they only change once every
+        block of messages. If the one needed isn't ready, it's started in the background, building on the latest
+        summary made for the chain, and that summary is used meanwhile.
+
+        :param message_chain: The full message chain
+        :param unsent_count: The number of messages at the start of the chain that can't be sent as they are
+        :return: The number of messages at the start of the chain the summary covers, and the summary.
+                 0 and None if there isn't one
+        """
+        block_size = self.summary_block_size
+
+        # Rounding up to the next block boundary, leaving at least the newest message out of the summary
+        max_count = (len(message_chain) - 1) // block_size * block_size
+        target_count = min(-(-unsent_count // block_size) * block_size, max_count)
+        if not target_count:
+            return 0, None
+
+        summarized_count, summary = self._find_summary(message_chain, target_count)
+
+        # Summarizing a block ahead too, so the summary is usually ready by the time the chain grows into it
+        root_id = message_chain[0].message_id
+        prefetch_count = min(target_count + block_size, max_count)
+        if root_id not in self._summary_tasks:
+            if summarized_count < target_count:
+                ahead_count, ahead_summary = summarized_count, summary
+            else:
+                ahead_count, ahead_summary = self._find_summary(message_chain, prefetch_count)
+            if ahead_count < prefetch_count:
+                self._start_summary(root_id, ahead_summary, message_chain[ahead_count:prefetch_count])
 
-            message_list.append({
-                "role": "assistant" if msg.author is None else "user",
-                "content": content
-            })
+        return summarized_count, summary
 
-        return message_list
+    def _find_summary(self, message_chain: List[CachedMessage], max_count):
+        """
+        Finds the latest summary made for the start of a chain.
+
+        :param message_chain: The full message chain
+        :param max_count: The most messages the summary can cover
+        :return: The number of messages the summary covers, and the summary. 0 and None if there isn't one
+        """
+        for count in range(max_count // self.summary_block_size * self.summary_block_size, 0,
+                           -self.summary_block_size):
+            message_id = message_chain[count - 1].message_id
+            if message_id in self.summaries:
+                self.summaries.move_to_end(message_id)
+                return count, self.summaries[message_id]
+        return 0, None
+
+    def _start_summary(self, root_id, summary, messages: List[CachedMessage]):
+        """
+        Starts summarizing messages in the background, one task at a time per conversation.
 
-    async def run_model(self, message_list: []) -> openai.ChatCompletion.Message:
+        :param root_id: The id of the first message of the conversation
+        :param summary: The summary of the messages before these, None if there aren't any
+        :param messages: The messages to add to the summary, starting on a block boundary
+        """
+        try:
+            task = asyncio.get_running_loop().create_task(self._summarize(summary, messages))
+        except RuntimeError:
+            logging.warning("Can't summarize older messages without a running event loop")
+            return
+        self._summary_tasks[root_id] = task
+        task.add_done_callback(lambda _: self._summary_tasks.pop(root_id, None))
+
+    async def _summarize(self, summary, messages: List[CachedMessage]):
+        """
+        Rolls messages into a summary, a block at a time so each request stays small.
+        The summary is saved after every block, so later chains can build on it.
+
+        :param summary: The summary of the messages before these, None if there aren't any
+        :param messages: The messages to add to the summary, starting on a block boundary
+        """
+        for block_start in range(0, len(messages), self.summary_block_size):
+            block = messages[block_start:block_start + self.summary_block_size]
+            summary = await self._summarize_batch(summary, block)
+            if not summary:
+                return
+
+            self.summaries[block[-1].message_id] = summary
+            self.summaries.move_to_end(block[-1].message_id)
+            while len(self.summaries) > self.max_cached_summaries:
+                self.summaries.popitem(last=False)
+
+    async def _summarize_batch(self, summary, messages: List[CachedMessage]):
+        """
+        Asks the summary model to add messages to a summary.
+
+        :param summary: The summary so far, None if there isn't one
+        :param messages: The messages to add
+        :return: The new summary, None if the request failed
+        """
+        transcript = "\n".join(f"{msg.author or 'Assistant'}: {msg.message}" for msg in messages)
+        prompt = [
+            {
+                "role": "system",
+                "content": "Summarize this conversation between users and an assistant for the assistant to use "
+                           "later. Keep names, facts, requests and decisions. Write only the summary."
+            },
+            {
+                "role": "user",
+                "content": f"Summary so far:\n{summary or 'None'}\n\nNew messages:\n{transcript}"
+            }
+        ]
+
+        try:
+            async with self.request_semaphore:
+                response = await self.client.chat.completions.create(
+                    model=self.summary_model_name,
+                    messages=prompt,
+                    max_tokens=self.summary_max_tokens,
+                    temperature=self.temperature
+                )
+        except openai.OpenAIError as e:
+            logging.error(f"Failed to summarize older messages: {e}")
+            return None
+
+        self._record_usage(response.usage)
+        return response.choices[0].message.content
+
+    def _record_usage(self, usage):
+        """
+        Adds a response's prompt token usage to the prompt caching counters, and logs how much of it was cached.
+
+        :param usage: The token usage of the response, None if it wasn't reported
+        """
+        if not usage:
+            return
+
+        prompt_tokens_details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(prompt_tokens_details, "cached_tokens", None) or 0
+        self.prompt_tokens += usage.prompt_tokens
+        self.cached_prompt_tokens += cached_tokens
+
+        cached_ratio = cached_tokens / usage.prompt_tokens if usage.prompt_tokens else 0.0
+        logging.info(
+            f"Prompt used {usage.prompt_tokens} tokens, {cached_tokens} cached ({cached_ratio:.0%}). "
+            f"{self.get_prompt_cache_stats()['cached_ratio']:.0%} of all prompt tokens have been cached"
+        )
+
+    def get_prompt_cache_stats(self) -> dict:
+        """
+        Gets the prompt caching counters for monitoring.
+
+        :return: A dictionary of prompt token counts and the ratio that were cached
+        """
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "cached_ratio": self.cached_prompt_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        }
+
+    async def run_model(self, message_list: [], allow_tools=True, on_text=None) -> openai.ChatCompletion.Message:
         """
         Runs the GPT model, returns the best message choice for later processing
 
         :param message_list: List of messages ready for gpt consumption
+        :param allow_tools: Whether the model can call tools, False to make it answer with text
+        :param on_text: Async function called with each piece of text as the response streams in (optional).
+                        If not given, the response isn't streamed
         :return: Chat completion message with model response
         """
+        # Tools are still passed when they aren't allowed, since the message list can have earlier tool calls in it
+        extra_args = {} if allow_tools or not self.tool_definitions else {"tool_choice": "none"}
+
         # Making the requests
-        response = self.client.chat.completions.create(
+        async with self.request_semaphore:
+            if on_text:
+                return await self._run_model_streaming(message_list, on_text, extra_args)
+
+            response = await self.client.chat.completions.create(
+                model=self.model_name,
+                messages=message_list,
+                tools=self.tool_definitions,
+                **extra_args
+            )
+        self._record_usage(response.usage)
+        return response.choices[0].message
+
+    async def _run_model_streaming(self, message_list: [], on_text, extra_args: dict) -> ChatCompletionMessage:
+        """
+        Runs the GPT model with a streamed response, passing text along as it arrives
+
+        :param message_list: List of messages ready for gpt consumption
+        :param on_text: Async function called with each piece of text as it arrives
+        :param extra_args: Any extra arguments for the request
+        :return: Chat completion message with the full model response, put back together from the stream
+        """
+        stream = await self.client.chat.completions.create(
             model=self.model_name,
             messages=message_list,
-            tools=self.tool_definitions
+            tools=self.tool_definitions,
+            stream=True,
+            stream_options={"include_usage": True},
+            **extra_args
         )
-        return response.choices[0].message
 
-    async def run_model_with_funcs(self, message_list: []) -> (openai.ChatCompletion.Message, [Image.Image]):
+        # Tool calls arrive in pieces too, keyed by their index in the response
+        content_parts = []
+        tool_calls = {}
+        async for chunk in stream:
+            # The usage comes in a last chunk without any choices
+            if chunk.usage:
+                self._record_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+
+            if delta.content:
+                content_parts.append(delta.content)
+                await on_text(delta.content)
+
+            for tool_delta in delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(tool_delta.index, {
+                    "id": "",
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""}
+                })
+                if tool_delta.id:
+                    tool_call["id"] = tool_delta.id
+                if tool_delta.function:
+                    tool_call["function"]["name"] += tool_delta.function.name or ""
+                    tool_call["function"]["arguments"] += tool_delta.function.arguments or ""
+
+        return ChatCompletionMessage.model_validate({
+            "role": "assistant",
+            "content": "".join(content_parts) or None,
+            "tool_calls": [tool_calls[index] for index in sorted(tool_calls)] or None
+        })
+
+    async def run_model_with_funcs(self, message_list: [], on_text=None) -> (openai.ChatCompletion.Message,
+                                                                            [Image.Image]):
         """
         Runs the GPT model with function/tool handling
+        The tool calls in each response are run concurrently, and the model can keep calling tools for up to
+        max_tool_rounds rounds before it has to answer
 
         :param message_list: List of messages ready for gpt consumption
-        :return: A tuple of the final chat completion message, a list of images for the bot to attach
+        :param on_text: Async function called with each piece of text as the response streams in (optional).
+                        Text the model writes before calling tools is kept, separated from the next round's text
+        :return: A tuple of the final chat completion message, a list of images for the bot to attach.
+                 When streaming, its content is all the text that was streamed, so it matches what was shown
         """
-        message = await self.run_model(message_list)
+        # Every round streams into the same reply, so the text is tracked to keep the returned message matching it
+        streamed_parts = []
+
+        async def on_round_text(text):
+            streamed_parts.append(text)
+            await on_text(text)
+
+        round_on_text = on_round_text if on_text else None
+        message = await self.run_model(message_list, on_text=round_on_text)
+
+        # Tracking any images we need to attach, in the order the tools were called
+        image_attachments: [Image.Image] = []
 
         # Doing any necessary tool calls
-        if message.tool_calls:
+        tool_round = 0
+        while message.tool_calls:
             # Keep track of the previous tool_call request
             message_list.append(message.model_dump())
 
-            # Tracking any images we need to attach
-            image_attachments: [Image.Image] = []
+            # Breaking any text written before the tool calls off from the text that comes after them
+            if streamed_parts and not streamed_parts[-1].endswith("\n\n"):
+                await on_round_text("\n\n")
 
-            for tool in message.tool_calls:
-                args = json.loads(tool.function.arguments)
-                func = self.tool_function_references.get(tool.function.name)
+            results = await asyncio.gather(*(self._run_tool(tool) for tool in message.tool_calls))
+            for tool, (gpt_message, image) in zip(message.tool_calls, results):
+                if image:
+                    image_attachments.append(image)
 
-                # If the function exists in the references
-                if func:
-                    gpt_message, image = await func(**args)
+                # Adding the message to our message list
+                message_list.append({
+                    "role": "tool",
+                    "tool_call_id": tool.id,
+                    "content": gpt_message
+                })
 
-                    if image:
-                        image_attachments.append(image)
+            # Making another call after all tools have run, only allowing more tools if we haven't hit the limit
+            tool_round += 1
+            message = await self.run_model(
+                message_list, allow_tools=tool_round < self.max_tool_rounds, on_text=round_on_text
+            )
 
-                    # Adding the message to our message list
-                    message_list.append({
-                        "role": "tool",
-                        "tool_call_id": tool.id,
-                        "content": gpt_message
-                    })
-                else:
-                    logging.error(f"function '{tool.function.name}' not found in tool references")
+        if tool_round and streamed_parts:
+            message.content = "".join(streamed_parts).strip() or None
+        return message, image_attachments
 
-            # Making another call after all tools have run
-            post_tool_message = await self.run_model(message_list)
-            return post_tool_message, image_attachments
-        else:
-            return message, []
+    async def _run_tool(self, tool):
+        """
+        Runs a tool call from the model
 
-    async def process_with_history(self, message_chain: List[CachedMessage]):
+        :param tool: The tool call
+        :return: A tuple of the message for the model, and an image for the bot to attach (None if there isn't one)
+        """
+        func = self.tool_function_references.get(tool.function.name) if self.tool_function_references else None
+        if not func:
+            logging.error(f"function '{tool.function.name}' not found in tool references")
+            return f"The tool '{tool.function.name}' doesn't exist.", None
+
+        try:
+            args = json.loads(tool.function.arguments)
+            return await asyncio.wait_for(func(**args), self.tool_timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Tool '{tool.function.name}' timed out after {self.tool_timeout}s")
+            return f"The tool '{tool.function.name}' timed out.", None
+        except Exception as e:
+            logging.error(f"Tool '{tool.function.name}' failed: {e}")
+            return f"The tool '{tool.function.name}' failed.", None
+
+    async def process_with_history(self, message_chain: List[CachedMessage], on_text=None):
         """
         Processes a message with cache history, the process_text could be merged into this
 
         :param message_chain: The full message chain for a string of messages from the message cache
+        :param on_text: Async function called with each piece of text as the response streams in (optional)
         :return: Chat completion message with the model's response, a list of images for the bot to attach
         """
         message_list = self.generate_gpt_messages_list(message_chain)
-        response, images = await self.run_model_with_funcs(message_list)
-
-        return response, images
+        return await self._run_with_timeout(message_list, on_text)
 
-    async def process_text(self, text):
+    async def process_text(self, text, on_text=None):
         """
         Processes only text through the AI model
 
         :param text: A single string of text to process
+        :param on_text: Async function called with each piece of text as the response streams in (optional)
         :return: Chat completion message with the model's response, a list of images for the bot to attach
         """
         message_list = self.get_system_prompts()
@@ -388,8 +1003,33 @@ class ChatLLMManager:
                 "content": text
              }
         )
-        response, images = await self.run_model_with_funcs(message_list)
-        return response, images
+        message_list.append(self.get_metadata_prompt())
+        return await self._run_with_timeout(message_list, on_text)
+
+    async def _run_with_timeout(self, message_list: [], on_text=None):
+        """
+        Runs the model with tools, giving up once the response timeout is reached
+
+        :param message_list: List of messages ready for gpt consumption
+        :param on_text: Async function called with each piece of text as the response streams in (optional)
+        :return: Chat completion message with the model's response (None if it failed or timed out),
+                 a list of images for the bot to attach
+        """
+        try:
+            return await asyncio.wait_for(self.run_model_with_funcs(message_list, on_text), self.response_timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"GPT response timed out after {self.response_timeout}s")
+        except openai.OpenAIError as e:
+            logging.error(f"GPT request failed: {e}")
+        return None, []
+
+    async def close(self):
+        """
+        Cancels any summaries being made, and closes the API client and its connections
+        """
+        for task in list(self._summary_tasks.values()):
+            task.cancel()
+        await self.client.close()
 
     def set_system_prompt(self, system_prompt: str):
         """
@@ -399,6 +1039,7 @@ class ChatLLMManager:
         """
         if system_prompt:
             self.system_prompt = system_prompt
+            self.refresh_static_prompts()
         else:
             logging.warning("Failed to set system prompt: A new system prompt was not provided.")
 
@@ -421,6 +1062,7 @@ class ChatLLMManager:
         Updates the get_memories function used by the manager.
         """
         self.get_memories = get_memories
+        self.refresh_static_prompts()
         logging.info("Updated get_memories function in ChatLLMManager.")
 
     def set_get_metadata(self, get_metadata):
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# A cache entry: the audio bytes, and where the speech starts/ends in the audio (in seconds)
+CacheEntry = Tuple[bytes, float, Optional[float]]
+
+
+class TTSCache:
+    def __init__(self, cache_path, max_memory_bytes=16 * 1024 * 1024, max_disk_bytes=256 * 1024 * 1024):
+        """
+        Content-addressed cache for synthesized speech, so repeated phrases aren't re-synthesized (or re-billed).
+        Recently used audio is kept in memory, and everything is kept on disk up to a size limit.
+        Both tiers evict the least recently used audio first. Disk recency is tracked with file mtimes,
+        so it carries over between restarts.
+
+        :param cache_path: The directory the on-disk tier is stored in
+        :param max_memory_bytes: The max total size of audio kept in memory
+        :param max_disk_bytes: The max total size of audio kept on disk
+        """
+        self.cache_path = cache_path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        self._load_disk_index()
+
+    @staticmethod
+    def make_key(text, voice_name, speaking_rate, encoding):
+        """
+        Makes the cache key for a synthesis request.
+
+        :param text: The text being synthesized
+        :param voice_name: The name of the voice
+        :param speaking_rate: The speaking rate of the voice
+        :param encoding: The name of the audio encoding
+        :return: The cache key
+        """
+        normalized_text = " ".join(text.split())
+        key_data = json.dumps([normalized_text, voice_name, round(speaking_rate, 3), encoding])
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _format_file_name(key, start_offset, end_offset):
+        """
+        Builds the file name for a cache entry. The speech offsets are kept in the name so entries don't need
+        to be re-analyzed after a restart.
+
+        :return: The file name
+        """
+        end_ms = -1 if end_offset is None else round(end_offset * 1000)
+        return f"{key}.{round(start_offset * 1000)}.{end_ms}.audio"
+
+    @staticmethod
+    def _parse_file_name(file_name):
+        """
+        Reads the key and speech offsets back out of a cache file name.
+
+        :return: The key, start offset and end offset, or None if the name isn't a cache entry
+        """
+        parts = file_name.split(".")
+        if len(parts) != 4 or parts[3] != "audio":
+            return None
+        try:
+            start_ms, end_ms = int(parts[1]), int(parts[2])
+        except ValueError:
+            return None
+        return parts[0], start_ms / 1000, None if end_ms < 0 else end_ms / 1000
+
+    def _load_disk_index(self):
+        """
+        Rebuilds the on-disk index from the cache directory, oldest files first.
+        """
+        entries = []
+        for file_name in os.listdir(self.cache_path):
+            if self._parse_file_name(file_name) is None:
+                continue
+            file_stat = os.stat(os.path.join(self.cache_path, file_name))
+            entries.append((file_stat.st_mtime, file_name, file_stat.st_size))
+
+        for _, file_name, size in sorted(entries):
+            key = self._parse_file_name(file_name)[0]
+            self._disk[key] = (file_name, size)
+            self._disk_bytes += size
+
+        self._evict_disk()
+        logging.info(f"Loaded {len(self._disk)} TTS cache entries ({self._disk_bytes} bytes) from disk")
+
+    def _store_in_memory(self, key, entry: CacheEntry):
+        """
+        Adds an entry to the in-memory tier, evicting the least recently used entries if it's full.
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+
+        self._memory[key] = entry
+        self._memory_bytes += len(entry[0])
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted_entry = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted_entry[0])
+
+    def _evict_disk(self):
+        """
+        Deletes the least recently used files until the on-disk tier is within its size limit.
+        """
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            _, (file_name, size) = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_path, file_name))
+            except OSError as e:
+                logging.error(f"Failed to remove TTS cache file {file_name}: {e}")
+
+    def get(self, key) -> Optional[CacheEntry]:
+        """
+        Gets cached audio. Disk reads are blocking, so this should be run in a worker thread.
+
+        :param key: The cache key from make_key
+        :return: The audio bytes and speech start/end offsets, or None if the audio isn't cached
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+
+            if key in self._disk:
+                file_name, _ = self._disk[key]
+                file_path = os.path.join(self.cache_path, file_name)
+                try:
+                    with open(file_path, "rb") as f:
+                        audio_content = f.read()
+                    os.utime(file_path)
+                except OSError as e:
+                    logging.error(f"Failed to read TTS cache file {file_name}: {e}")
+                    self._disk_bytes -= self._disk.pop(key)[1]
+                    self.misses += 1
+                    return None
+
+                self._disk.move_to_end(key)
+                _, start_offset, end_offset = self._parse_file_name(file_name)
+                entry = (audio_content, start_offset, end_offset)
+                self._store_in_memory(key, entry)
+                self.disk_hits += 1
+                return entry
+
+            self.misses += 1
+            return None
+
+    def put(self, key, audio_content: bytes, start_offset=0.0, end_offset=None, persist=True):
+        """
+        Adds audio to the cache. Disk writes are blocking, so this should be run in a worker thread.
+
+        :param key: The cache key from make_key
+        :param audio_content: The audio bytes
+        :param start_offset: Where the speech starts in the audio (in seconds)
+        :param end_offset: Where the speech ends in the audio (in seconds), None if it runs to the end
+        :param persist: Whether to also write the audio to the on-disk tier, rather than only keeping it in memory
+        """
+        with self._lock:
+            self._store_in_memory(key, (audio_content, start_offset, end_offset))
+            if not persist or key in self._disk:
+                return
+
+            file_name = self._format_file_name(key, start_offset, end_offset)
+            try:
+                with open(os.path.join(self.cache_path, file_name), "wb") as f:
+                    f.write(audio_content)
+            except OSError as e:
+                logging.error(f"Failed to write TTS cache file {file_name}: {e}")
+                return
+
+            self._disk[key] = (file_name, len(audio_content))
+            self._disk_bytes += len(audio_content)
+            self._evict_disk()
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The fraction of lookups that were served from the cache.
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def get_stats(self) -> dict:
+        """
+        Gets the cache counters and sizes for monitoring.
+
+        :return: A dictionary of cache stats
+        """
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_bytes
+        }
@@ -1,76 +1,420 @@
 from google.cloud import texttospeech
+from pydub.audio_segment import AudioSegment
 from shared.constants import GOOGLE_TTS_VOICE_INFO
+import asyncio
+import io
 import os
+import re
+import time
 import logging
+from typing import Dict, List, Optional, Set, Tuple
 
-from shared.file_utils import get_random_file_id
+from shared.audio_utils import get_audible_bounds, trim_ogg_opus
+from shared.TTSCache import TTSCache
+from shared.tts_engines import TTSEngine, GoogleTTSEngine
+
+# Splits text after sentence-ending punctuation
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"(?<=[.!?…])\s+")
+
+
+class SynthesizedSpeech:
+    def __init__(self, audio_content: bytes, start_offset=0.0, end_offset=None, audio_format=None):
+        """
+        The result of a TTS synthesis. The audio is kept in memory and played without being written to disk.
+
+        :param audio_content: The synthesized audio bytes, in the format of the engine that made it
+        :param start_offset: Where the speech starts in the audio (in seconds), after any leading silence
+        :param end_offset: Where the speech ends in the audio (in seconds), None if there is no trailing silence
+        :param audio_format: The container of the audio, None if it isn't known
+        """
+        self.audio_content = audio_content
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.audio_format = audio_format
+
+    def __repr__(self):
+        return (
+            f"SynthesizedSpeech(size={len(self.audio_content)} bytes, "
+            f"start_offset={self.start_offset}, "
+            f"end_offset={self.end_offset})"
+        )
 
 
 class TTSManager:
-    def __init__(self, output_path, voice_info: dict = GOOGLE_TTS_VOICE_INFO, speaking_rate=0.9):
+    def __init__(self, output_path, voice_info: dict = GOOGLE_TTS_VOICE_INFO, speaking_rate=0.9,
+                 request_timeout=10.0, max_concurrent_requests=4, cache_path=None, max_chunk_length=250,
+                 batch_break_ms=500, audio_encoding=texttospeech.AudioEncoding.OGG_OPUS,
+                 engine: Optional[TTSEngine] = None, local_engine: Optional[TTSEngine] = None,
+                 local_system_message_length=80, outage_failure_threshold=3, outage_cooldown=60.0):
         """
-        Class for handling TTS interactions with Google's api.
-        Environment variable named "GOOGLE_APPLICATION_CREDENTIALS" must be set for api to work
+        Class for handling TTS synthesis. Requests go to the main engine (Google's api by default), and are routed
+        to the local engine, if one is given, for short system messages or while the main engine is down.
 
-        :param output_path: The path that the output mp3 files will be stored
+        :param output_path: The directory TTS files are kept in, only written to by the cache
         :param voice_info: A dictionary containing the languages, and the code and voice name for each desired language
         :param speaking_rate: The speaking rate the voice should have
+        :param request_timeout: The max time (in seconds) to wait on a synthesis request
+        :param max_concurrent_requests: The max number of synthesis requests that can run at once
+        :param cache_path: The directory for cached speech, defaults to a "cache" folder in the output path
+        :param max_chunk_length: Text longer than this is synthesized in sentence chunks, each up to this long
+        :param batch_break_ms: The pause (in milliseconds) between messages synthesized in one batch
+        :param audio_encoding: The encoding to request from Google, either OGG_OPUS or MP3
+        :param engine: The main engine, defaults to Google's api using the settings above
+        :param local_engine: An offline engine for system messages and outages (optional)
+        :param local_system_message_length: System messages up to this long are synthesized by the local engine
+        :param outage_failure_threshold: The number of failures in a row before the main engine is treated as down
+        :param outage_cooldown: How long (in seconds) to use the local engine before trying the main engine again
         """
+        self.engine = engine or GoogleTTSEngine(voice_info, speaking_rate, request_timeout, audio_encoding)
+        self.local_engine = local_engine
+        self.request_semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self.max_chunk_length = max_chunk_length
+        self.batch_break_ms = batch_break_ms
+        self.output_path = output_path
 
-        # Making sure we have the environment variable set
-        if os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", None) is None:
-            raise EnvironmentError("No value set for 'GOOGLE_APPLICATION_CREDENTIALS'")
+        # Routing rules for the local engine
+        self.local_system_message_length = local_system_message_length
+        self.outage_failure_threshold = outage_failure_threshold
+        self.outage_cooldown = outage_cooldown
+        self._engine_failures = 0
+        self._engine_down_until = 0.0
 
-        self.client = texttospeech.TextToSpeechClient()
-        self.output_path = output_path
-        self.voice_info = voice_info
-        self.audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3,
-            speaking_rate=speaking_rate
-        )
+        # Caching synthesized speech so repeated phrases don't need another request
+        self.cache = TTSCache(cache_path or os.path.join(output_path, "cache"))
+        self._cache_tasks: Set[asyncio.Task] = set()
+
+        # Rendered "<name> says" clips per (user id, voice key, engine name), with the display name they were made for
+        self._name_clips: Dict[Tuple[int, Optional[str], str], Tuple[str, asyncio.Task]] = {}
+
+    async def warm_up(self):
+        """
+        Gets the engines ready ahead of time, so the first message isn't slowed down by connection setup.
+        """
+        await self.engine.warm_up()
+        if self.local_engine:
+            await self.local_engine.warm_up()
+
+    def is_engine_down(self):
+        """
+        Whether the main engine is being treated as down after failing too many times in a row.
+        """
+        return time.monotonic() < self._engine_down_until
+
+    def _route(self, text, system_message=False) -> TTSEngine:
+        """
+        Picks the engine for a request.
+
+        :param text: The text being synthesized
+        :param system_message: Whether the text is a bot system message, rather than something a user wrote
+        :return: The engine to use
+        """
+        if self.local_engine:
+            if self.is_engine_down():
+                return self.local_engine
+            if system_message and len(text) <= self.local_system_message_length:
+                return self.local_engine
+        return self.engine
+
+    def _record_engine_result(self, succeeded):
+        """
+        Keeps track of failures in a row from the main engine, marking it as down once there are too many.
+
+        :param succeeded: Whether the request succeeded
+        """
+        if succeeded:
+            self._engine_failures = 0
+            return
+
+        self._engine_failures += 1
+        if self._engine_failures >= self.outage_failure_threshold and self.local_engine:
+            self._engine_down_until = time.monotonic() + self.outage_cooldown
+            logging.warning(
+                f"The {self.engine.name} TTS engine failed {self._engine_failures} times in a row, "
+                f"using the {self.local_engine.name} engine for the next {self.outage_cooldown:.0f}s"
+            )
+
+    def _cache_new_audio(self, cache_key, audio_content, audio_format, persist):
+        """
+        Finds where the speech starts/ends in newly synthesized audio, and adds it to the cache.
+        Blocking, so it's run in a worker thread.
+
+        :param cache_key: The cache key for the audio
+        :param audio_content: The audio bytes
+        :param audio_format: The container of the audio
+        :param persist: Whether to write the audio to the on-disk tier, rather than only keeping it in memory
+        """
+        start_offset, end_offset = self._find_speech_bounds(audio_content, audio_format)
+        self.cache.put(cache_key, audio_content, start_offset, end_offset, persist=persist)
 
-        # Set default voice config from the first option
-        default = self.voice_info[next(iter(self.voice_info))]
-        self.default_voice_config = texttospeech.VoiceSelectionParams(
-            language_code=default['language_code'],
-            name=default['voice_name']
+    def _schedule_cache_write(self, cache_key, audio_content, audio_format, persist):
+        """
+        Caches newly synthesized audio in the background, so the silence detection and disk write
+        happen after the audio has been handed off for playback.
+
+        :param cache_key: The cache key for the audio
+        :param audio_content: The audio bytes
+        :param audio_format: The container of the audio
+        :param persist: Whether to write the audio to the on-disk tier, rather than only keeping it in memory
+        """
+        cache_task = asyncio.create_task(
+            asyncio.to_thread(self._cache_new_audio, cache_key, audio_content, audio_format, persist)
         )
+        self._cache_tasks.add(cache_task)
+        cache_task.add_done_callback(self._cache_tasks.discard)
 
-    def process(self, text, voice_key=None):
+    @staticmethod
+    def _find_speech_bounds(audio_content, audio_format):
+        """
+        Finds where the speech starts/ends in synthesized audio.
+
+        :param audio_content: The audio bytes
+        :param audio_format: The container of the audio
+        :return: The start and end offsets of the speech in seconds
+        """
+        # Trimming is only an optimization, so the untrimmed audio is still usable if this fails
+        try:
+            sound = AudioSegment.from_file(io.BytesIO(audio_content), format=audio_format)
+            return get_audible_bounds(sound)
+        except Exception as e:
+            logging.warning(f"Failed to detect silence in TTS audio: {e}")
+            return 0.0, None
+
+    async def process(self, text, voice_key=None, system_message=False):
         """
         Synthesize speech based on the input text and optional voice key.
-        Saves the file in the output path location with a random file id.
+        The audio is returned in memory. System messages are likely to be said again, so they're also persisted
+        to disk by the cache, while everything else is only kept in memory.
 
         :param text: The text to synthesize
         :param voice_key: The key from GOOGLE_TTS_VOICE_INFO for the desired voice (optional)
-        :return: The file path of the synthesized text
-        """
-        # Generating a random filename
-        new_file_id = get_random_file_id(self.output_path)
-        new_file_path = os.path.join(self.output_path, f"{new_file_id}.mp3")
-
-        # If a voice key is provided and it's valid
-        voice = self.voice_info.get(voice_key)
-        if voice_key and voice:
-            voice_config = texttospeech.VoiceSelectionParams(
-                language_code=voice['language_code'],
-                name=voice['voice_name']
+        :param system_message: Whether the text is a bot system message, which may be routed to the local engine
+        :return: The SynthesizedSpeech for the text, None if synthesis failed
+        """
+        return await self._synthesize(self._route(text, system_message), text, voice_key, persist=system_message)
+
+    async def process_batch(self, messages: List[Tuple[str, Optional[str]]]):
+        """
+        Synthesize several messages with one SSML request, each in its own voice with a pause between them.
+        If the engine doesn't take SSML or the request fails (e.g. a voice doesn't support SSML), the messages are
+        synthesized separately and their audio is joined, so the batch still plays as one clip. Engines whose audio
+        can't be joined read all the messages out in one plain text request instead.
+
+        :param messages: The (text, voice key) pairs to synthesize, in order
+        :return: The SynthesizedSpeech for all the messages, None if synthesis failed
+        """
+        if len(messages) == 1:
+            return await self.process(*messages[0])
+
+        engine = self._route("")
+        if engine.supports_ssml:
+            ssml = engine.build_batch_ssml(messages, self.batch_break_ms)
+            speech = await self._synthesize(engine, ssml, messages[0][1], ssml=True, allow_fallback=False)
+            if speech:
+                logging.info(f"Synthesized a batch of {len(messages)} TTS messages in one request")
+                return speech
+            logging.warning(f"SSML batch synthesis failed, synthesizing {len(messages)} messages separately")
+
+        if engine.can_concatenate:
+            results = await asyncio.gather(
+                *(self._synthesize(engine, text, voice_key, allow_fallback=False) for text, voice_key in messages)
             )
-        else:
-            voice_config = self.default_voice_config
+            results = [result for result in results if result]
+            if results:
+                return SynthesizedSpeech(
+                    b"".join(result.audio_content for result in results),
+                    results[0].start_offset,
+                    audio_format=results[0].audio_format
+                )
+
+        return await self._synthesize(self._route(""), "\n".join(text for text, _ in messages), messages[0][1])
 
+    async def _synthesize(self, engine: TTSEngine, text, voice_key=None, ssml=False, allow_fallback=True,
+                          persist=False):
+        """
+        Synthesizes speech with an engine, using the cache when possible. If the main engine fails,
+        the request is retried with the local engine.
+        New audio is returned as soon as it's synthesized, without its silence offsets. They're measured
+        in the background when it's cached, so only cache hits have them.
+
+        :param engine: The engine to synthesize with
+        :param text: The text or SSML to synthesize
+        :param voice_key: The key from GOOGLE_TTS_VOICE_INFO for the desired voice (optional)
+        :param ssml: Whether the text is SSML
+        :param allow_fallback: Whether the local engine can be used if the main engine fails
+        :param persist: Whether new audio is likely to be reused, and should be written to the on-disk cache
+        :return: The SynthesizedSpeech, None if synthesis failed
+        """
         try:
-            # Making the synthesis request
-            synthesis_input = texttospeech.SynthesisInput(text=text)
-            response = self.client.synthesize_speech(
-                input=synthesis_input, voice=voice_config, audio_config=self.audio_config
-            )
+            # Checking the cache before going to the engine
+            cache_key = engine.get_cache_key(text, voice_key, ssml)
+            cached_audio = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached_audio:
+                audio_content, start_offset, end_offset = cached_audio
+                logging.info(f"Using cached TTS audio ({self.cache.hit_rate:.0%} cache hit rate)")
+                return SynthesizedSpeech(audio_content, start_offset, end_offset, engine.audio_format)
+
+            async with self.request_semaphore:
+                audio_content = await engine.synthesize(text, voice_key, ssml)
+            if engine is self.engine:
+                self._record_engine_result(True)
+        except Exception as e:
+            logging.error(f"The {engine.name} TTS engine failed: {e}")
+            if engine is not self.engine:
+                return None
+
+            self._record_engine_result(False)
+            if not (allow_fallback and self.local_engine and not ssml):
+                return None
+            logging.info(f"Retrying TTS with the {self.local_engine.name} engine")
+            return await self._synthesize(self.local_engine, text, voice_key, persist=persist)
 
-            # Saving the audio content
-            with open(new_file_path, "wb") as f:
-                f.write(response.audio_content)
+        self._schedule_cache_write(cache_key, audio_content, engine.audio_format, persist)
+        return SynthesizedSpeech(audio_content, audio_format=engine.audio_format)
 
-            return new_file_path
+    @staticmethod
+    def trim_speech(speech: SynthesizedSpeech, trim_start=True, trim_end=True) -> bytes:
+        """
+        Cuts the leading and/or trailing silence out of synthesized audio, so clips can be joined without gaps.
+        Newly synthesized speech doesn't have its silence offsets yet, so they're measured here.
+        Ogg Opus is cut at packet boundaries instead of being re-encoded, so it can still be passed through to Discord.
+        Blocking, so it's run in a worker thread.
+
+        :param speech: The speech to trim
+        :param trim_start: Whether to cut the leading silence
+        :param trim_end: Whether to cut the trailing silence
+        :return: The trimmed audio bytes in the same format, or the untrimmed audio if it can't be trimmed
+        """
+        if not speech.audio_format:
+            return speech.audio_content
+
+        try:
+            sound = None
+            if speech.start_offset or speech.end_offset is not None:
+                start_offset, end_offset = speech.start_offset, speech.end_offset
+            else:
+                sound = AudioSegment.from_file(io.BytesIO(speech.audio_content), format=speech.audio_format)
+                start_offset, end_offset = get_audible_bounds(sound)
+            start_offset = start_offset if trim_start else 0.0
+            end_offset = end_offset if trim_end else None
+            if not start_offset and end_offset is None:
+                return speech.audio_content
+
+            if speech.audio_format == "ogg":
+                return trim_ogg_opus(speech.audio_content, start_offset, end_offset)
+
+            if sound is None:
+                sound = AudioSegment.from_file(io.BytesIO(speech.audio_content), format=speech.audio_format)
+            sound = sound[int(start_offset * 1000):len(sound) if end_offset is None else int(end_offset * 1000)]
+            buffer = io.BytesIO()
+            sound.export(buffer, format=speech.audio_format)
+            return buffer.getvalue()
         except Exception as e:
-            logging.error(e)
-            return None
+            logging.warning(f"Failed to trim silence from TTS audio: {e}")
+            return speech.audio_content
+
+    @staticmethod
+    def split_into_chunks(text, max_chunk_length):
+        """
+        Splits long text into chunks at sentence boundaries. The first sentence is kept on its own so it can
+        start playing as soon as possible, and the rest are grouped into chunks of up to max_chunk_length.
+
+        :param text: The text to split
+        :param max_chunk_length: The max length of a chunk. A single sentence longer than this is kept whole
+        :return: The list of chunks, just the text itself if it's short enough
+        """
+        text = text.strip()
+        if len(text) <= max_chunk_length:
+            return [text]
+
+        first_sentence, *sentences = SENTENCE_BOUNDARY_PATTERN.split(text)
+        chunks = [first_sentence]
+        current_chunk = ""
+        for sentence in sentences:
+            if current_chunk and len(current_chunk) + len(sentence) + 1 > max_chunk_length:
+                chunks.append(current_chunk)
+                current_chunk = sentence
+            else:
+                current_chunk = f"{current_chunk} {sentence}" if current_chunk else sentence
+        if current_chunk:
+            chunks.append(current_chunk)
+        return chunks
+
+    @staticmethod
+    def format_name_announcement(display_name):
+        """
+        Gets the text that announces who is speaking.
+
+        :param display_name: The speaker's display name
+        :return: The announcement text
+        """
+        return f"{display_name} says:"
+
+    def _get_name_clip(self, engine: TTSEngine, user_id, display_name, voice_key=None) -> asyncio.Future:
+        """
+        Gets the rendered "<name> says" clip for a user and voice, rendering it if there isn't one for their
+        current display name yet. A clip made for an old display name is replaced.
+
+        :param engine: The engine the clip needs to come from, so it can be joined with the message audio
+        :param user_id: The speaker's user id
+        :param display_name: The speaker's current display name
+        :param voice_key: The key from GOOGLE_TTS_VOICE_INFO for the voice (optional)
+        :return: A future for the clip's SynthesizedSpeech. Cancelling it doesn't cancel the shared render
+        """
+        clip_key = (user_id, voice_key, engine.name)
+        rendered_name, clip_task = self._name_clips.get(clip_key, (None, None))
+        is_failed = clip_task is not None and clip_task.done() and (clip_task.cancelled() or clip_task.result() is None)
+        if rendered_name != display_name or is_failed:
+            if rendered_name is not None and rendered_name != display_name:
+                logging.info(f"Display name for user {user_id} changed to {display_name}, re-rendering their name clip")
+            clip_task = asyncio.create_task(
+                self._synthesize(
+                    engine, self.format_name_announcement(display_name), voice_key, allow_fallback=False, persist=True
+                )
+            )
+            self._name_clips[clip_key] = (display_name, clip_task)
+        return asyncio.shield(clip_task)
+
+    def invalidate_name_clips(self, user_id):
+        """
+        Drops every rendered "<name> says" clip for a user, e.g. when their display name changes.
+
+        :param user_id: The user's id
+        """
+        for clip_key in [key for key in self._name_clips if key[0] == user_id]:
+            del self._name_clips[clip_key]
+            logging.info(f"Dropped TTS name clip for user {user_id}")
+
+    def process_chunked(self, text, voice_key=None, system_message=False, speaker_id=None,
+                        speaker_name=None) -> List[asyncio.Future]:
+        """
+        Starts synthesizing speech for the input text, split into sentence chunks if it's long.
+        All chunks are synthesized concurrently (bounded by max_concurrent_requests), and the earliest
+        chunks get the first requests. Every chunk uses the same engine so their audio can be joined.
+        If a speaker is given, their pre-rendered "<name> says" clip is put in front of the message.
+
+        :param text: The text to synthesize
+        :param voice_key: The key from GOOGLE_TTS_VOICE_INFO for the desired voice (optional)
+        :param system_message: Whether the text is a bot system message, which may be routed to the local engine
+        :param speaker_id: The user id of the speaker to announce (optional)
+        :param speaker_name: The display name of the speaker to announce (optional)
+        :return: The synthesis tasks in playback order, each resulting in a SynthesizedSpeech or None
+        """
+        engine = self._route(text, system_message)
+        if not engine.can_concatenate:
+            # The name can't be joined on as its own clip, so it's read out as part of the message
+            if speaker_name:
+                text = f"{self.format_name_announcement(speaker_name)} {text}"
+            return [asyncio.create_task(self._synthesize(engine, text, voice_key, persist=system_message))]
+
+        name_clips = []
+        if speaker_name:
+            name_clips.append(self._get_name_clip(engine, speaker_id, speaker_name, voice_key))
+
+        chunks = self.split_into_chunks(text, self.max_chunk_length)
+        allow_fallback = len(chunks) == 1 and not name_clips
+        return name_clips + [
+            asyncio.create_task(
+                self._synthesize(engine, chunk, voice_key, allow_fallback=allow_fallback, persist=system_message)
+            )
+            for chunk in chunks
+        ]
@@ -1,11 +1,22 @@
 import asyncio
+import io
 import logging
 import random
 import os
 from enum import Enum
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 import discord
-from shared.TTSManager import TTSManager
+from shared.TTSManager import TTSManager, SynthesizedSpeech
+from shared.audio_sources import (
+    TrackedAudioSource, GainAudioSource, BufferedAudioSource, InterruptibleAudioSource, ChunkedAudioStream,
+    OggOpusAudioSource
+)
+
+# The number of times an interrupted audio will be resumed before it is dropped
+MAX_RESUME_ATTEMPTS = 3
+
+# How often (in seconds) to check that the voice client is still playing our audio while waiting for it to finish
+PLAYBACK_CHECK_INTERVAL = 5.0
 
 
 class AudioState(Enum):
@@ -18,16 +29,22 @@ class AudioState(Enum):
 
 
 class AudioQueueItem:
-    def __init__(self, audio_file_path, duration, voice_channel, high_priority, audio_name, added_by):
+    def __init__(self, audio_file_path, duration, voice_channel, high_priority, audio_name, added_by, preempt=False,
+                 start_offset=0.0, end_offset=None, audio_content=None, speech_tasks=None):
         """
         Initializes an AudioQueueItem.
 
-        :param audio_file_path: Path to the audio file
+        :param audio_file_path: Path to the audio file, None for audio that is only kept in memory
         :param duration: Duration of the audio in seconds
         :param voice_channel: The Discord voice channel object
         :param high_priority: Whether the audio is high priority
         :param audio_name: Name of the audio (optional)
         :param added_by: Who added the audio (optional)
+        :param preempt: Whether the audio should interrupt the currently playing audio instead of waiting
+        :param start_offset: Where playback should start (in seconds), e.g. to skip leading silence
+        :param end_offset: Where playback should end (in seconds), e.g. to skip trailing silence. None plays to the end
+        :param audio_content: The encoded audio bytes, for audio that is played from memory instead of a file
+        :param speech_tasks: Tasks synthesizing the audio in the background, in playback order, for audio that isn't ready yet
         """
         self.audio_file_path = audio_file_path
         self.duration = duration
@@ -35,6 +52,31 @@ class AudioQueueItem:
         self.high_priority = high_priority
         self.audio_name = audio_name
         self.added_by = added_by
+        self.preempt = preempt
+
+        # Where playback should start from (in seconds), updated when the audio is seeked or interrupted
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.resume_attempts = 0
+        self.audio_content = audio_content
+        self.speech_tasks: List[asyncio.Task] = speech_tasks or []
+
+        # Speech synthesized in chunks is streamed into FFmpeg while the later chunks are still being synthesized
+        self.audio_stream: Optional[ChunkedAudioStream] = None
+        self.stream_task: Optional[asyncio.Task] = None
+
+        # The (text, voice key) pairs of a TTS batch still taking messages, synthesized together once it's needed
+        self.tts_batch: List[Tuple[str, Optional[str]]] = []
+
+    @property
+    def audio(self):
+        """
+        The audio to play, either the in-memory audio bytes, the stream of audio still being synthesized,
+        or the path to the audio file.
+        """
+        if self.audio_content is not None:
+            return self.audio_content
+        return self.audio_stream or self.audio_file_path
 
     def __repr__(self):
         """
@@ -44,11 +86,17 @@ class AudioQueueItem:
         """
         return (
             f"AudioQueueItem(audio_file_path={self.audio_file_path}, "
+            f"in_memory={self.audio_content is not None}, "
+            f"pending={bool(self.speech_tasks)}, "
+            f"streaming={self.audio_stream is not None}, "
             f"duration={self.duration}, "
             f"high_priority={self.high_priority}, "
             f"voice_channel={self.voice_channel}, "
             f"audio_name={self.audio_name}, "
-            f"added_by={self.added_by})"
+            f"added_by={self.added_by}, "
+            f"preempt={self.preempt}, "
+            f"start_offset={self.start_offset}, "
+            f"end_offset={self.end_offset})"
         )
 
 
@@ -57,7 +105,11 @@ class VCAudioManager:
                  tts_manager: TTSManager,
                  bot_leave_messages: List = None,
                  disconnect_func=None,
-                 leave_timeout_length=300):
+                 leave_timeout_length=300,
+                 read_ahead_seconds=5.0,
+                 tts_batch_threshold=3,
+                 tts_batch_max_messages=5,
+                 tts_batch_max_length=200):
         """
         Audio manager that maintains the queue and plays audio in the VC.
 
@@ -65,17 +117,43 @@ class VCAudioManager:
         :param bot_leave_messages: A list of leave messages for the bot to randomly choose from
         :param disconnect_func: An extra function to call when the bot disconnects
         :param leave_timeout_length: The amount of time the bot should wait before disconnecting
+        :param read_ahead_seconds: How many seconds of audio to buffer ahead of playback
+        :param tts_batch_threshold: The number of TTS jobs that need to be waiting before short messages are batched
+        :param tts_batch_max_messages: The max number of messages synthesized together in one batch
+        :param tts_batch_max_length: The max length of a message that can be batched
         """
         self.leave_timeout_length = leave_timeout_length
+        self.read_ahead_seconds = read_ahead_seconds
         self.queue: List[AudioQueueItem] = []
         self.current_audio_item: Optional[AudioQueueItem] = None
         self.current_state = AudioState.STOPPED
         self._current_voice_channel: Optional[discord.VoiceClient] = None
+        self._current_source: Optional[TrackedAudioSource] = None
+        self._current_gain_source: Optional[GainAudioSource] = None
+        self._current_interruptible: Optional[InterruptibleAudioSource] = None
+        self._skip_requested = False
+
+        # Total number of times playback had to wait on FFmpeg because the read-ahead buffer ran dry
+        self.buffer_underruns = 0
 
         self.disconnect_func = disconnect_func
         self.tts_manager = tts_manager
         self.bot_leave_messages = bot_leave_messages or ["Bot is leaving the voice channel"]
 
+        # TTS jobs that preempt are handed over one at a time in arrival order, each waiting on the one before it
+        self._last_pending_preempt_task: Optional[asyncio.Task] = None
+
+        # TTS jobs that haven't finished playing. Once there's a backlog, short messages are batched together
+        self._pending_tts_items: Set[AudioQueueItem] = set()
+        self._open_tts_batch: Optional[AudioQueueItem] = None
+        self.tts_batch_threshold = tts_batch_threshold
+        self.tts_batch_max_messages = tts_batch_max_messages
+        self.tts_batch_max_length = tts_batch_max_length
+
+        # Pre-synthesized leave messages (message -> speech), so disconnects don't wait on TTS
+        self.leave_audio_bank: Dict[str, SynthesizedSpeech] = {}
+        self._leave_audio_bank_task: Optional[asyncio.Task] = None
+
         self.processing_task: Optional[asyncio.Task] = None
         self.idle_task: Optional[asyncio.Task] = None
         self.lock = asyncio.Lock()
@@ -83,16 +161,21 @@ class VCAudioManager:
 
     def set_volume(self, volume: float):
         """
-        Sets the playback volume for audio.
+        Sets the playback volume for audio. Also ramps the volume of any audio currently playing.
         :param volume: Volume as a float (0.0 to 2.0, where 1.0 is normal)
         """
         if 0.0 <= volume <= 2.0:
             self.volume = volume
+            if self._current_gain_source:
+                self._current_gain_source.volume = volume
+            elif self._current_source and self._current_source.is_opus():
+                logging.info("Current audio is passed through as Opus, the volume will apply from the next audio")
             logging.info(f"Set playback volume to {volume}")
         else:
             logging.warning("Volume must be between 0.0 and 2.0")
 
-    async def add_to_queue(self, audio_file_path, voice_channel, duration=0, high_priority=True, audio_name="System audio", added_by="System"):
+    async def add_to_queue(self, audio_file_path, voice_channel, duration=0, high_priority=True, audio_name="System audio", added_by="System", preempt=False,
+                           start_offset=0.0, end_offset=None):
         """
         Adds an audio to the queue, positions it in the list based on priority.
 
@@ -100,12 +183,227 @@ class VCAudioManager:
         :param duration: The duration of the audio in seconds
         :param voice_channel: The voice channel to play the audio in
         :param high_priority: Whether the audio is high priority
+        :param preempt: Whether to play the audio over the current audio immediately, resuming it afterwards
+        :param start_offset: Where playback should start (in seconds)
+        :param end_offset: Where playback should end (in seconds), None plays to the end
+        """
+        new_item = AudioQueueItem(
+            audio_file_path, duration, voice_channel, high_priority, audio_name, added_by, preempt,
+            start_offset=start_offset,
+            end_offset=end_offset
+        )
+        await self._add_item_to_queue(new_item)
+
+    async def add_speech_to_queue(self, speech: SynthesizedSpeech, voice_channel, high_priority=True, audio_name="System audio",
+                                  added_by="System", preempt=False):
+        """
+        Adds synthesized speech to the queue. The audio is played straight from memory, so no file is written for it.
+
+        :param speech: The synthesized speech to play
+        :param voice_channel: The voice channel to play the audio in
+        :param high_priority: Whether the audio is high priority
+        :param preempt: Whether to play the audio over the current audio immediately, resuming it afterwards
+        """
+        new_item = AudioQueueItem(
+            None, 0, voice_channel, high_priority, audio_name, added_by, preempt,
+            start_offset=speech.start_offset,
+            end_offset=speech.end_offset,
+            audio_content=speech.audio_content
+        )
+        await self._add_item_to_queue(new_item)
+
+    async def add_tts_to_queue(self, text, voice_channel, voice_key=None, high_priority=True, audio_name="System audio",
+                               added_by="System", preempt=False, speaker_id=None, speaker_name=None):
+        """
+        Adds a TTS job to the queue without waiting for its audio. The speech is synthesized in the background,
+        concurrently with other jobs (bounded by the TTS manager), and the player only waits on it once it
+        reaches the front of the queue. Jobs still play in the order they were added.
+        Long text is synthesized in sentence chunks, so playback can start as soon as the first chunk is ready.
+        Once enough jobs are waiting, short messages are batched into a single synthesis request and queue item.
+        When a speaker is given, their pre-rendered "<name> says" clip plays right before the message.
+
+        :param text: The text to synthesize
+        :param voice_channel: The voice channel to play the audio in
+        :param voice_key: The key from GOOGLE_TTS_VOICE_INFO for the desired voice (optional)
+        :param high_priority: Whether the audio is high priority
+        :param preempt: Whether to play the audio over the current audio once it's ready, resuming it afterwards
+        :param speaker_id: The user id of the speaker to announce (optional)
+        :param speaker_name: The display name of the speaker to announce (optional)
+        """
+        # Batched messages are read out in one request, so the announcement goes in with the text
+        if speaker_name and self._should_batch_tts(text):
+            text = f"{self.tts_manager.format_name_announcement(speaker_name)} {text}"
+            speaker_name = None
+
+        if self._add_to_tts_batch(text, voice_key, voice_channel, high_priority, added_by, preempt):
+            return
+
+        if self._should_batch_tts(text):
+            # Starting a new batch, its synthesis waits until it's needed so more messages can join it
+            new_item = AudioQueueItem(None, 0, voice_channel, high_priority, audio_name, added_by, preempt)
+            new_item.tts_batch.append((text, voice_key))
+            self._open_tts_batch = new_item
+        else:
+            new_item = AudioQueueItem(
+                None, 0, voice_channel, high_priority, audio_name, added_by, preempt,
+                speech_tasks=self.tts_manager.process_chunked(
+                    text,
+                    voice_key,
+                    speaker_id=speaker_id,
+                    speaker_name=speaker_name
+                )
+            )
+        self._pending_tts_items.add(new_item)
+
+        # Preempting needs the audio, so the job is only handed over once it (and every job before it) is ready
+        if preempt:
+            if self.idle_task and not self.idle_task.done():
+                self.idle_task.cancel()
+            self._last_pending_preempt_task = asyncio.create_task(
+                self._add_when_ready(new_item, self._last_pending_preempt_task)
+            )
+        else:
+            await self._add_item_to_queue(new_item)
+
+    def _should_batch_tts(self, text):
+        """
+        Checks if a TTS message should be batched, which is when it's short and there's a backlog of TTS jobs.
+
+        :param text: The text of the message
+        :return: True if the message should be batched
+        """
+        return len(text) <= self.tts_batch_max_length and len(self._pending_tts_items) > self.tts_batch_threshold
+
+    def _add_to_tts_batch(self, text, voice_key, voice_channel, high_priority, added_by, preempt):
+        """
+        Adds a TTS message to the open batch, if it can join it.
+
+        :return: True if the message was added to the batch, False otherwise
+        """
+        batch = self._open_tts_batch
+        if not batch or not self._should_batch_tts(text):
+            return False
+        if (batch.voice_channel, batch.high_priority, batch.preempt) != (voice_channel, high_priority, preempt):
+            return False
+
+        batch.tts_batch.append((text, voice_key))
+        batch.audio_name = f"{len(batch.tts_batch)} batched TTS messages"
+        if added_by not in batch.added_by.split(", "):
+            batch.added_by = f"{batch.added_by}, {added_by}"
+        logging.info(f"Added TTS message by {added_by} to a batch of {len(batch.tts_batch)} messages")
+
+        if len(batch.tts_batch) >= self.tts_batch_max_messages:
+            self._seal_tts_batch(batch)
+        return True
+
+    def _seal_tts_batch(self, item: AudioQueueItem):
+        """
+        Stops a TTS batch from taking more messages, and starts synthesizing it.
+
+        :param item: The batch item
+        """
+        if self._open_tts_batch is item:
+            self._open_tts_batch = None
+        item.speech_tasks = [asyncio.create_task(self.tts_manager.process_batch(item.tts_batch))]
+        item.tts_batch = []
+
+    async def _add_when_ready(self, item: AudioQueueItem, previous_task: Optional[asyncio.Task]):
+        """
+        Waits for a pending TTS job's audio, and for the job added before it, then adds it to the queue.
+
+        :param item: The pending item
+        :param previous_task: The task handing over the previous pending item, if any
+        """
+        if previous_task:
+            await asyncio.wait([previous_task])
+        if await self._wait_for_speech(item):
+            await self._add_item_to_queue(item)
+
+    @staticmethod
+    async def _get_speech_result(speech_task: asyncio.Task) -> Optional[SynthesizedSpeech]:
+        """
+        Waits for a synthesis task. Waiting this way means a cancelled synthesis doesn't cancel the caller.
+
+        :param speech_task: The synthesis task
+        :return: The synthesized speech, None if synthesis failed or was cancelled
+        """
+        await asyncio.wait([speech_task])
+        return None if speech_task.cancelled() else speech_task.result()
+
+    async def _wait_for_speech(self, item: AudioQueueItem):
+        """
+        Waits for a pending item's audio to be synthesized, and fills in the item with it.
+        For speech synthesized in chunks, only the first chunk is waited on and the rest are streamed in after it.
+
+        :param item: The item to wait on
+        :return: True if the item's audio is ready, False if synthesis failed or was cancelled
+        """
+        if item.tts_batch:
+            self._seal_tts_batch(item)
+
+        if not item.speech_tasks or item.audio_stream:
+            return True
+
+        first_task, *chunk_tasks = item.speech_tasks
+        speech = await self._get_speech_result(first_task)
+        if not speech:
+            logging.error(f"TTS synthesis failed for audio {item.audio_name} added by {item.added_by}, skipping it")
+            self._discard_item_audio(item)
+            return False
+
+        if not chunk_tasks:
+            item.speech_tasks = []
+            item.audio_content = speech.audio_content
+            item.start_offset = speech.start_offset
+            item.end_offset = speech.end_offset
+            return True
+
+        # The chunks are fed through one FFmpeg process with the silence around them cut out, so there are no gaps
+        first_chunk = await asyncio.to_thread(self.tts_manager.trim_speech, speech)
+        item.speech_tasks = chunk_tasks
+        item.audio_stream = ChunkedAudioStream()
+        item.audio_stream.write_chunk(first_chunk)
+        item.stream_task = asyncio.create_task(self._stream_speech_chunks(item, first_chunk))
+        return True
+
+    async def _stream_speech_chunks(self, item: AudioQueueItem, first_chunk: bytes):
+        """
+        Feeds the remaining chunks of an item's speech into its audio stream, in order, as they are synthesized.
+
+        :param item: The item being streamed
+        :param first_chunk: The audio of the first chunk, which has already been written to the stream
+        """
+        audio_chunks = [first_chunk]
+        try:
+            for chunk_idx, chunk_task in enumerate(item.speech_tasks, start=2):
+                speech = await self._get_speech_result(chunk_task)
+                if speech:
+                    chunk = await asyncio.to_thread(self.tts_manager.trim_speech, speech)
+                    item.audio_stream.write_chunk(chunk)
+                    audio_chunks.append(chunk)
+                else:
+                    logging.error(f"TTS synthesis failed for chunk {chunk_idx} of audio {item.audio_name}, skipping it")
+        finally:
+            item.audio_stream.finish()
+
+        # Keeping the full audio once it's all here, so the item can be seeked or resumed like any other
+        item.audio_content = b"".join(audio_chunks)
+        item.audio_stream = None
+        item.speech_tasks = []
+
+    async def _add_item_to_queue(self, new_item: AudioQueueItem):
+        """
+        Adds an item to the queue, positions it in the list based on priority, and makes sure the playback loop is running.
+
+        :param new_item: The item to add
         """
-        new_item = AudioQueueItem(audio_file_path, duration, voice_channel, high_priority, audio_name, added_by)
+        # Preempting audio skips the queue entirely if it can be played right now
+        if new_item.preempt and self._preempt_current(new_item):
+            return
 
         async with self.lock:
             # Finding the first low-priority item, otherwise defaulting to appending
-            if high_priority:
+            if new_item.high_priority:
                 insert_idx = next(
                     (idx for idx, item in enumerate(self.queue) if not item.high_priority),
                     len(self.queue)
@@ -114,6 +412,9 @@ class VCAudioManager:
             else:
                 self.queue.append(new_item)
 
+        # Making sure the leave messages are ready by the time we disconnect
+        self._schedule_leave_audio_bank_build()
+
         # Cancel idle timer if running, since new audio is queued
         if self.idle_task and not self.idle_task.done():
             self.idle_task.cancel()
@@ -122,16 +423,128 @@ class VCAudioManager:
         if not self.processing_task or self.processing_task.done():
             self.processing_task = asyncio.create_task(self._playback_loop())
 
+    def _discard_item_audio(self, item: AudioQueueItem):
+        """
+        Releases everything behind an item's audio: stops any synthesis still running for it,
+        ends its audio stream, and deletes its audio file.
+
+        :param item: The item to discard the audio of
+        """
+        self._pending_tts_items.discard(item)
+        if self._open_tts_batch is item:
+            self._open_tts_batch = None
+        for speech_task in item.speech_tasks:
+            speech_task.cancel()
+        if item.stream_task:
+            item.stream_task.cancel()
+        if item.audio_stream:
+            item.audio_stream.finish()
+        self.safe_delete_audio_file(item.audio_file_path)
+
     def safe_delete_audio_file(self, audio_file_path):
         """
-        Safely deletes the audio file and logs the result.
+        Safely deletes the audio file and logs the result. Audio that is only kept in memory has no file to delete.
         """
+        if audio_file_path is None:
+            return
+
         try:
             os.remove(audio_file_path)
             logging.info(f"Deleted audio file: {audio_file_path}")
         except Exception as e:
             logging.error(f"Failed to delete audio file: {e}")
 
+    def _can_passthrough(self, audio):
+        """
+        Checks if audio can skip FFmpeg and be sent to Discord as Opus packets.
+        That needs in-memory Ogg audio, and the volume at 100% since there's no gain stage for Opus.
+
+        :param audio: The audio to check
+        :return: True if the audio can be passed through
+        """
+        return self.volume == 1.0 and isinstance(audio, (bytes, bytearray)) and audio.startswith(b"OggS")
+
+    def _create_audio_source(self, audio, start_offset=0.0, end_offset=None, passthrough=False):
+        """
+        Creates a buffered FFmpeg source for an audio file or in-memory audio. When an offset is given, FFmpeg seeks
+        on the input side so large files start playing without decoding everything before the offset.
+        In-memory and streamed audio is piped into FFmpeg's stdin, so it never touches the disk.
+
+        :param audio: The path to the audio file, the encoded audio bytes, or a ChunkedAudioStream
+        :param start_offset: The position (in seconds) to start playing from
+        :param end_offset: The position (in seconds) to stop playing at, None plays to the end
+        :param passthrough: Whether to pass Ogg Opus audio straight through. Falls back to FFmpeg if the audio can't be
+        :return: The buffered PCM audio source, or an Opus source if the audio is passed through
+        """
+        if passthrough:
+            try:
+                return OggOpusAudioSource(audio, start_offset, end_offset)
+            except ValueError as e:
+                logging.info(f"Can't pass audio through as Opus, decoding it instead: {e}")
+
+        input_options = []
+        if start_offset > 0:
+            input_options.append(f"-ss {start_offset:.3f}")
+        if end_offset is not None:
+            input_options.append(f"-to {end_offset:.3f}")
+        before_options = " ".join(input_options) or None
+
+        if isinstance(audio, (bytes, bytearray)):
+            audio = io.BytesIO(audio)
+        source = discord.FFmpegPCMAudio(
+            audio,
+            pipe=not isinstance(audio, str),
+            before_options=before_options,
+            options="-loglevel quiet"
+        )
+        return BufferedAudioSource(source, buffer_seconds=self.read_ahead_seconds)
+
+    def _preempt_current(self, item: AudioQueueItem):
+        """
+        Plays an audio over the currently playing audio. The current audio is held at its current frame
+        while the new audio plays, and carries on from there afterwards without restarting FFmpeg.
+
+        :param item: The audio to play
+        :return: True if the audio is being played, False if it should be queued instead
+        """
+        # Only audio that isn't preempting itself can be preempted, and only in the same voice channel
+        if not self._current_interruptible or not self.current_audio_item or self.current_audio_item.preempt:
+            return False
+
+        # Interruptions are PCM, so they can't be mixed into audio that's being passed through as Opus
+        if self._current_interruptible.is_opus():
+            return False
+        if not self._current_voice_channel.is_playing() or self._current_voice_channel.channel != item.voice_channel:
+            return False
+
+        try:
+            source = GainAudioSource(
+                self._create_audio_source(item.audio, item.start_offset, item.end_offset),
+                volume=self.volume
+            )
+        except Exception as e:
+            logging.error(f"Failed to create source for preempting audio: {e}")
+            return False
+
+        loop = asyncio.get_running_loop()
+
+        def on_finished():
+            logging.info(f"Finished preempting audio {item.audio_name}, resuming {self.get_current_audio_name()}")
+            self._discard_item_audio(item)
+
+        self._current_interruptible.interrupt(source, on_finished=lambda: loop.call_soon_threadsafe(on_finished))
+        logging.info(f"Preempting {self.current_audio_item.audio_name} to play {item.audio_name}")
+        return True
+
+    def _collect_buffer_underruns(self):
+        """
+        Adds the underruns from the current audio's read-ahead buffer to the running total.
+        """
+        underruns = getattr(self._current_source.source, "underruns", 0)
+        if underruns:
+            logging.warning(f"Read-ahead buffer ran dry {underruns} times while playing {self.current_audio_item.audio_name}")
+        self.buffer_underruns += underruns
+
     async def _playback_loop(self):
         """
         The loop used to join the voice channel and play audio from the queue.
@@ -144,13 +557,17 @@ class VCAudioManager:
                 self.current_audio_item = self.queue.pop(0)
 
             try:
+                # Audio synthesized in the background is only waited on once it reaches the front of the queue
+                if not await self._wait_for_speech(self.current_audio_item):
+                    continue
+
                 # Ensure the bot is in the guild
                 bot_member = self.current_audio_item.voice_channel.guild.me
                 if bot_member is None:
                     logging.error(
                         f"Bot is not a member of guild: {self.current_audio_item.voice_channel.guild.name}"
                     )
-                    self.safe_delete_audio_file(self.current_audio_item.audio_file_path)
+                    self._discard_item_audio(self.current_audio_item)
                     continue  # Skip to next item
                 
                 # Check permissions for bot to connect and speak in the voice channel
@@ -161,7 +578,7 @@ class VCAudioManager:
                         f"({self.current_audio_item.voice_channel.name}) "
                         f"in guild ({self.current_audio_item.voice_channel.guild.name})"
                     )
-                    self.safe_delete_audio_file(self.current_audio_item.audio_file_path)
+                    self._discard_item_audio(self.current_audio_item)
                     continue  # Skip to next item
                 
                 # Connect or move to the correct voice channel
@@ -175,7 +592,7 @@ class VCAudioManager:
                     except Exception as e:
                         logging.error(f"Failed to connect to voice channel: {e}")
                         self._current_voice_channel = None
-                        self.safe_delete_audio_file(self.current_audio_item.audio_file_path)
+                        self._discard_item_audio(self.current_audio_item)
                         continue  # Skip to next item
                 elif self._current_voice_channel.channel != self.current_audio_item.voice_channel:
                     try:
@@ -186,41 +603,84 @@ class VCAudioManager:
                         logging.info(f"Moved to voice channel {self._current_voice_channel.channel.name}")
                     except Exception as e:
                         logging.error(f"Failed to move to voice channel: {e}")
-                        self.safe_delete_audio_file(self.current_audio_item.audio_file_path)
+                        self._discard_item_audio(self.current_audio_item)
                         continue  # Skip to next item
 
-                # Play the audio. Make sure nothing else is playing first
-                if self._current_voice_channel.is_playing():
+                # Play the audio. Make sure nothing else is playing (or paused) first
+                if self._current_voice_channel.is_playing() or self._current_voice_channel.is_paused():
                     logging.warning("Audio is already playing, stopping current playback before playing new audio.")
                     self._current_voice_channel.stop()
                     await asyncio.sleep(0.2)  # Small delay to ensure stop completes
 
                 try:
-                    source = discord.FFmpegPCMAudio(
-                        self.current_audio_item.audio_file_path,
-                        options="-loglevel quiet"
+                    source = self._create_audio_source(
+                        self.current_audio_item.audio,
+                        self.current_audio_item.start_offset,
+                        self.current_audio_item.end_offset,
+                        passthrough=self._can_passthrough(self.current_audio_item.audio)
+                    )
+                    self._current_source = TrackedAudioSource(source, start_offset=self.current_audio_item.start_offset)
+
+                    # Opus packets go straight to Discord, so they skip the gain stage
+                    if source.is_opus():
+                        self._current_gain_source = None
+                        self._current_interruptible = InterruptibleAudioSource(self._current_source)
+                    else:
+                        self._current_gain_source = GainAudioSource(self._current_source, volume=self.volume)
+                        self._current_interruptible = InterruptibleAudioSource(self._current_gain_source)
+
+                    # The player calls this from its own thread once the audio stops for any reason
+                    loop = asyncio.get_running_loop()
+                    playback_finished = asyncio.Event()
+                    self._skip_requested = False
+                    self._current_voice_channel.play(
+                        self._current_interruptible,
+                        after=lambda _: loop.call_soon_threadsafe(playback_finished.set)
                     )
-                    volume_source = discord.PCMVolumeTransformer(source, volume=self.volume)
-                    self._current_voice_channel.play(volume_source)
                 except Exception as e:
                     logging.error(f"Error while trying to play audio: {e}")
-                    self.safe_delete_audio_file(self.current_audio_item.audio_file_path)
+                    self._discard_item_audio(self.current_audio_item)
                     continue  # Skip to next item
 
                 self.current_state = AudioState.PLAYING
                 logging.info(f"Playing audio: {self.current_audio_item.audio_name}")
 
                 # Wait for the audio to finish playing
-                while self._current_voice_channel.is_playing() or self._current_voice_channel.is_paused():
-                    await asyncio.sleep(0.5)
+                await self._wait_for_playback(playback_finished, self._current_interruptible)
+                self.current_state = AudioState.STOPPED
+                self._collect_buffer_underruns()
+
+                # If playback was cut off (disconnect, voice move, etc.), requeue the audio at the position it stopped at
+                if not self._current_source.finished and not self._skip_requested:
+                    if self.current_audio_item.audio_stream:
+                        # The stream has already been partly read, so there's nothing to resume from yet
+                        logging.error(f"Audio {self.current_audio_item.audio_name} was interrupted while streaming, dropping it")
+                    elif self.current_audio_item.resume_attempts < MAX_RESUME_ATTEMPTS:
+                        self.current_audio_item.resume_attempts += 1
+                        self.current_audio_item.start_offset = self._current_source.position
+                        logging.warning(
+                            f"Playback of {self.current_audio_item.audio_name} was interrupted, "
+                            f"resuming at {self.current_audio_item.start_offset:.2f}s"
+                        )
+                        async with self.lock:
+                            self.queue.insert(0, self.current_audio_item)
+                        self._current_source = None
+                        self._current_gain_source = None
+                        self._current_interruptible = None
+                        self.current_audio_item = None
+                        continue
+                    else:
+                        logging.error(f"Audio {self.current_audio_item.audio_name} was interrupted too many times, dropping it")
 
                 # After audio finishes, update state
                 logging.info(f"Finished playing audio: {self.current_audio_item.audio_name}")
-                self.current_state = AudioState.STOPPED
-                
+
                 # Delete audio file after playback
-                self.safe_delete_audio_file(self.current_audio_item.audio_file_path)
+                self._discard_item_audio(self.current_audio_item)
 
+                self._current_source = None
+                self._current_gain_source = None
+                self._current_interruptible = None
                 self.current_audio_item = None
 
                 # Add a delay between audios
@@ -229,15 +689,35 @@ class VCAudioManager:
             except discord.DiscordException as e:
                 logging.error(f"Discord Exception: {e}")
                 if self.current_audio_item:
-                    self.safe_delete_audio_file(self.current_audio_item.audio_file_path)
+                    self._discard_item_audio(self.current_audio_item)
             except Exception as e:
                 logging.error(f"Error: {e}")
                 if self.current_audio_item:
-                    self.safe_delete_audio_file(self.current_audio_item.audio_file_path)
+                    self._discard_item_audio(self.current_audio_item)
 
         # After all queue items are played, start idle timer
         self.idle_task = asyncio.create_task(self._idle_timer())
 
+    async def _wait_for_playback(self, playback_finished: asyncio.Event, source: discord.AudioSource):
+        """
+        Waits for the voice client to finish playing a source. If the player's after callback is lost
+        (e.g. the player was replaced or the voice client went away), stops waiting once the voice client
+        is no longer playing the source, so the queue can't stall.
+
+        :param playback_finished: The event set by the player's after callback
+        :param source: The source that was passed to the voice client
+        """
+        while True:
+            try:
+                await asyncio.wait_for(playback_finished.wait(), timeout=PLAYBACK_CHECK_INTERVAL)
+                return
+            except asyncio.TimeoutError:
+                voice_client = self._current_voice_channel
+                if voice_client is None or voice_client.source is not source or \
+                        not (voice_client.is_playing() or voice_client.is_paused()):
+                    logging.warning("Lost track of the audio player, no longer waiting for it to finish")
+                    return
+
     async def _idle_timer(self):
         """
         Waits for leave_timeout_length after the last audio finishes.
@@ -258,6 +738,9 @@ class VCAudioManager:
         :return: True if the bot is in a voice channel and the bot has been disconnected, False otherwise
         """
         if self._current_voice_channel and not self._current_voice_channel.is_playing():
+            # Paused audio is stopped for good, instead of being resumed by rejoining the channel
+            self._skip_requested = True
+
             # Calling the async disconnect
             await self._disconnect()
             return True
@@ -273,18 +756,40 @@ class VCAudioManager:
             if self.disconnect_func:
                 self.disconnect_func()
 
-            # Announce bot is disconnecting
-            leave_audio_path = self.tts_manager.process(random.choice(self.bot_leave_messages))
-            source = discord.FFmpegPCMAudio(
-                leave_audio_path,
-                options="-loglevel quiet"
-            )
-            volume_source = discord.PCMVolumeTransformer(source, volume=self.volume)
-            self._current_voice_channel.play(volume_source)
+            # Announce bot is disconnecting, preferring a pre-synthesized leave message
+            banked_messages = [message for message in self.bot_leave_messages if message in self.leave_audio_bank]
+            if banked_messages:
+                leave_speech = self.leave_audio_bank[random.choice(banked_messages)]
+            else:
+                logging.warning("No leave messages in the audio bank yet, synthesizing one now")
+                leave_speech = await self.tts_manager.process(
+                    random.choice(self.bot_leave_messages),
+                    system_message=True
+                )
 
-            # Wait for the leave message to finish playing. It needs a longer audio sleep time than usual.
-            while self._current_voice_channel.is_playing():
-                await asyncio.sleep(2)
+            if leave_speech:
+                try:
+                    source = self._create_audio_source(
+                        leave_speech.audio_content,
+                        leave_speech.start_offset,
+                        leave_speech.end_offset
+                    )
+                    volume_source = GainAudioSource(source, volume=self.volume)
+
+                    # Wait for the leave message to finish playing
+                    # A paused player doesn't count as playing, so play() would replace it without stopping it
+                    if self._current_voice_channel.is_playing() or self._current_voice_channel.is_paused():
+                        self._current_voice_channel.stop()
+
+                    loop = asyncio.get_running_loop()
+                    playback_finished = asyncio.Event()
+                    self._current_voice_channel.play(
+                        volume_source,
+                        after=lambda _: loop.call_soon_threadsafe(playback_finished.set)
+                    )
+                    await self._wait_for_playback(playback_finished, volume_source)
+                except Exception as e:
+                    logging.error(f"Failed to play leave message: {e}")
 
             # Disconnect from the server
             logging.info(f"Disconnecting from voice channel {self._current_voice_channel.channel.name}")
@@ -294,19 +799,67 @@ class VCAudioManager:
     def set_bot_leave_messages(self, leave_messages: list):
         """
         Updates the bot leave messages if the provided list is not empty.
+        Audio for any new messages is synthesized in the background and kept in the leave audio bank.
 
         :param leave_messages: List of leave messages (strings)
         """
         if leave_messages and all(isinstance(m, str) for m in leave_messages):
             self.bot_leave_messages = leave_messages
+            self._schedule_leave_audio_bank_build()
         else:
             logging.warning("The leave messages list is either empty or not all strings")
 
+    def _schedule_leave_audio_bank_build(self):
+        """
+        Starts a background build of the leave audio bank if it is out of date and one isn't already running.
+        If there is no running event loop yet (e.g. during bot init), the build happens when audio is first queued.
+        """
+        if self._leave_audio_bank_task and not self._leave_audio_bank_task.done():
+            return
+
+        is_stale = set(self.bot_leave_messages) != set(self.leave_audio_bank.keys())
+        if not is_stale:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._leave_audio_bank_task = loop.create_task(self._build_leave_audio_bank())
+
+    async def _build_leave_audio_bank(self):
+        """
+        Synthesizes audio for every leave message not already in the bank, and removes audio for
+        messages that are no longer in use. Runs until the bank matches the current leave messages.
+        """
+        while missing_messages := [m for m in self.bot_leave_messages if m not in self.leave_audio_bank]:
+            results = await asyncio.gather(*(
+                self.tts_manager.process(message, system_message=True) for message in missing_messages
+            ))
+            for message, leave_speech in zip(missing_messages, results):
+                if leave_speech:
+                    self.leave_audio_bank[message] = leave_speech
+            if not all(results):
+                logging.error("Failed to synthesize some leave messages, they will be retried later")
+                break
+
+        # Removing audio for leave messages that have been replaced
+        for message in [m for m in self.leave_audio_bank if m not in self.bot_leave_messages]:
+            del self.leave_audio_bank[message]
+
+        logging.info(f"Leave audio bank ready with {len(self.leave_audio_bank)} messages")
+
     def skip_current(self):
         """
-        Skips the currently playing audio, if any.
+        Skips the currently playing audio, if any. If the current audio has been preempted,
+        only the preempting audio is skipped.
         """
+        if self._current_interruptible and self._current_interruptible.skip_interruption():
+            logging.info("Skipped preempting audio playback")
+            return True
+
         if self._current_voice_channel and self._current_voice_channel.is_playing():
+            self._skip_requested = True
             self._current_voice_channel.stop()
             self.current_state = AudioState.STOPPED
             logging.info("Skipped current audio playback")
@@ -335,6 +888,62 @@ class VCAudioManager:
             return True
         return False
     
+    def seek_current(self, position: float):
+        """
+        Seeks the currently playing or paused audio to a position. A new FFmpeg source is started at the
+        offset and swapped in without stopping the player, so the audio file is not re-read from the beginning.
+
+        :param position: The position (in seconds) to seek to
+        :return: True if the audio was seeked, False otherwise
+        """
+        if not self.current_audio_item or not self._current_source:
+            return False
+
+        if self.current_audio_item.audio_stream:
+            logging.warning(f"Can't seek {self.current_audio_item.audio_name} while it's still being synthesized")
+            return False
+
+        duration = self.current_audio_item.duration
+        if position < 0 or (duration and position >= duration):
+            logging.warning(f"Seek position {position}s is outside of the audio duration ({duration}s)")
+            return False
+
+        try:
+            new_source = self._create_audio_source(
+                self.current_audio_item.audio,
+                position,
+                self.current_audio_item.end_offset,
+                passthrough=self._current_source.is_opus()
+            )
+        except Exception as e:
+            logging.error(f"Failed to seek current audio: {e}")
+            return False
+
+        # Cleaning up the old source off the event loop, since it waits on its read-ahead thread
+        old_source = self._current_source.swap_source(new_source, position)
+        asyncio.get_running_loop().run_in_executor(None, old_source.cleanup)
+        self.current_audio_item.start_offset = position
+        logging.info(f"Seeked {self.current_audio_item.audio_name} to {position:.2f}s")
+        return True
+
+    def replay_current(self):
+        """
+        Restarts the currently playing or paused audio from the beginning.
+
+        :return: True if the audio was restarted, False otherwise
+        """
+        return self.seek_current(0.0)
+
+    def get_current_position(self):
+        """
+        Returns the playback position of the current audio, if any.
+
+        :return: The position in seconds, or None if no audio is playing
+        """
+        if self.current_audio_item and self._current_source:
+            return self._current_source.position
+        return None
+
     def get_current_audio_name(self):
         """
         Returns the name of the currently playing audio, if any.
@@ -354,11 +963,16 @@ class VCAudioManager:
         logging.info("Skipping all audio in the queue and stopping current playback.")
         while self.queue:
             item = self.queue.pop(0)
-            self.safe_delete_audio_file(item.audio_file_path)
+            self._discard_item_audio(item)
 
         # Tracking if the queue is empty after clearing
         is_queue_empty = len(self.queue) == 0
 
+        # Clearing out any preempting audio first so the current audio is stopped as well
+        if self._current_interruptible:
+            while self._current_interruptible.skip_interruption():
+                pass
+
         # Skip the currently playing audio
         skipped = self.skip_current()
         return is_queue_empty and skipped
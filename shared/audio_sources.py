@@ -0,0 +1,512 @@
+import io
+import math
+import queue
+import threading
+from collections import deque
+
+import discord
+import numpy as np
+
+# Discord consumes one 20ms frame of audio per read
+FRAME_LENGTH_SECONDS = discord.opus.Encoder.FRAME_LENGTH / 1000
+
+# The int16 PCM sample range, used for converting to and from floats
+PCM_SAMPLE_MAX = 32767
+
+
+class TrackedAudioSource(discord.AudioSource):
+    def __init__(self, source: discord.AudioSource, start_offset: float = 0.0):
+        """
+        Wraps an audio source and counts the frames sent, so the playback position can be tracked.
+        The wrapped source can be swapped out mid-playback, which is how seeking is handled.
+
+        :param source: The audio source to wrap
+        :param start_offset: The position (in seconds) in the audio that the source starts at
+        """
+        self.source = source
+        self.start_offset = start_offset
+        self.frames_sent = 0
+        self.finished = False
+        self._lock = threading.Lock()
+
+    @property
+    def position(self) -> float:
+        """
+        The current playback position in seconds, based on the number of frames sent.
+
+        :return: The playback position in seconds
+        """
+        return self.start_offset + self.frames_sent * FRAME_LENGTH_SECONDS
+
+    def read(self) -> bytes:
+        """
+        Reads a frame from the wrapped source, keeping count of the frames read.
+
+        :return: A frame of audio, or empty bytes if the source has finished
+        """
+        with self._lock:
+            data = self.source.read()
+            if data:
+                self.frames_sent += 1
+            else:
+                self.finished = True
+            return data
+
+    def swap_source(self, source: discord.AudioSource, start_offset: float) -> discord.AudioSource:
+        """
+        Replaces the wrapped source without interrupting the player. The old source is handed back for the caller
+        to clean up, since that can block (e.g. waiting on a read-ahead thread).
+
+        :param source: The new audio source to read from
+        :param start_offset: The position (in seconds) in the audio that the new source starts at
+        :return: The old source
+        """
+        with self._lock:
+            old_source = self.source
+            self.source = source
+            self.start_offset = start_offset
+            self.frames_sent = 0
+            self.finished = False
+        return old_source
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+
+class GainAudioSource(discord.AudioSource):
+    def __init__(self, original: discord.AudioSource, volume: float = 1.0, ramp_frames: int = 5,
+                 soft_clip_threshold: float = 0.8):
+        """
+        Applies a gain to 16-bit PCM audio using NumPy. A drop-in replacement for discord.PCMVolumeTransformer
+        that doesn't rely on audioop. Volume changes are ramped over a few frames so they can be applied to
+        live audio without clicks, and loud peaks are soft clipped instead of wrapping/hard clipping.
+
+        :param original: The PCM audio source to apply the gain to
+        :param volume: The initial volume (1.0 = 100%)
+        :param ramp_frames: The number of 20ms frames a volume change is spread over
+        :param soft_clip_threshold: The level (0.0 to 1.0 of full scale) above which peaks are compressed when the
+                                    gain is above unity. Below unity nothing can clip, so nothing is compressed
+        """
+        if original.is_opus():
+            raise discord.ClientException("AudioSource must not be Opus encoded.")
+
+        self.original = original
+        self.ramp_frames = max(ramp_frames, 1)
+        self.soft_clip_threshold = soft_clip_threshold
+        self._gain = max(volume, 0.0)
+        self._target_gain = self._gain
+        self._ramp_step = 0.0
+        self._knee_widths = {}
+
+    @property
+    def volume(self) -> float:
+        """
+        The volume the source is set to, or ramping towards.
+        """
+        return self._target_gain
+
+    @volume.setter
+    def volume(self, value: float):
+        self._target_gain = max(value, 0.0)
+        self._ramp_step = (self._target_gain - self._gain) / self.ramp_frames
+
+    def _next_frame_gains(self):
+        """
+        Moves the gain one frame along its ramp.
+
+        :return: The gain at the start and end of the frame
+        """
+        start_gain = self._gain
+        if self._ramp_step and start_gain != self._target_gain:
+            end_gain = start_gain + self._ramp_step
+            # Stopping at the target instead of overshooting it
+            if (self._ramp_step > 0) == (end_gain >= self._target_gain):
+                end_gain = self._target_gain
+                self._ramp_step = 0.0
+            self._gain = end_gain
+        return start_gain, self._gain
+
+    def _get_knee_width(self, gain):
+        """
+        Finds the knee width that puts the loudest sample possible at a gain exactly on full scale.
+        The knee narrows as the gain rises and widens towards no compression as the gain falls to unity,
+        so turning the volume up never makes the audio quieter.
+
+        :param gain: The gain, above unity
+        :return: The knee width
+        """
+        if gain in self._knee_widths:
+            return self._knee_widths[gain]
+
+        # width * tanh(overshoot / width) rises towards the overshoot as the width grows, so it's found by bisection
+        headroom = 1.0 - self.soft_clip_threshold
+        overshoot = gain - self.soft_clip_threshold
+        low = headroom
+        high = headroom * 2
+        while high * math.tanh(overshoot / high) < headroom and high < 1e6:
+            high *= 2
+        for _ in range(40):
+            width = (low + high) / 2
+            if width * math.tanh(overshoot / width) < headroom:
+                low = width
+            else:
+                high = width
+
+        if len(self._knee_widths) > 256:
+            self._knee_widths.clear()
+        self._knee_widths[gain] = low
+        return low
+
+    def _soft_clip(self, samples: np.ndarray, gain) -> np.ndarray:
+        """
+        Compresses samples above the threshold with a tanh curve so the loudest possible sample at the gain
+        reaches, but never passes, full scale.
+
+        :param samples: Float samples on the int16 scale, after the gain
+        :param gain: The highest gain applied to the samples, above unity
+        :return: The soft clipped samples
+        """
+        threshold = self.soft_clip_threshold * PCM_SAMPLE_MAX
+
+        # Only the few samples above the threshold are compressed, gathered by index
+        flat_samples = samples.reshape(-1)
+        over_idx = np.flatnonzero(np.abs(flat_samples) > threshold)
+        if not len(over_idx):
+            return samples
+
+        over = flat_samples[over_idx]
+        width = self._get_knee_width(gain) * PCM_SAMPLE_MAX
+        compressed = threshold + width * np.tanh((np.abs(over) - threshold) / width)
+        flat_samples[over_idx] = np.copysign(np.minimum(compressed, PCM_SAMPLE_MAX), over)
+        return samples
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        if not data:
+            return data
+
+        start_gain, end_gain = self._next_frame_gains()
+
+        # Unity gain is passed straight through
+        if start_gain == end_gain == 1.0:
+            return data
+
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        if start_gain == end_gain:
+            samples *= start_gain
+        else:
+            # Working on (samples, channels) so a ramp applies equally to both stereo channels
+            samples = samples.reshape(-1, discord.opus.Encoder.CHANNELS)
+            samples *= np.linspace(start_gain, end_gain, len(samples), dtype=np.float32)[:, np.newaxis]
+
+        # Samples can only pass full scale when the gain is above unity, so the knee is skipped otherwise
+        peak_gain = max(start_gain, end_gain)
+        if peak_gain > 1.0:
+            samples = self._soft_clip(samples, peak_gain)
+
+        # Rounding instead of truncating towards zero, which would bias every sample towards silence
+        np.rint(samples, out=samples)
+        return samples.astype(np.int16).tobytes()
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+class BufferedAudioSource(discord.AudioSource):
+    def __init__(self, original: discord.AudioSource, buffer_seconds: float = 5.0):
+        """
+        Reads ahead from an audio source on a dedicated thread into a preallocated ring buffer.
+        Keeps playback smooth when the source (e.g. an FFmpeg pipe) is briefly starved of CPU.
+
+        :param original: The PCM audio source to read ahead from
+        :param buffer_seconds: How many seconds of audio to read ahead
+        """
+        if original.is_opus():
+            raise discord.ClientException("AudioSource must not be Opus encoded.")
+
+        self.original = original
+        self.frame_size = discord.opus.Encoder.FRAME_SIZE
+        self.capacity = max(int(buffer_seconds / FRAME_LENGTH_SECONDS), 1)
+        self._buffer = bytearray(self.capacity * self.frame_size)
+        self._read_idx = 0
+        self._write_idx = 0
+        self._frames_buffered = 0
+
+        self._condition = threading.Condition()
+        self._eof = False
+        self._closed = False
+
+        # Counters for monitoring, underruns are reads that had to wait on the source
+        self.frames_read = 0
+        self.underruns = 0
+
+        self._thread = threading.Thread(target=self._fill_loop, name="audio-read-ahead", daemon=True)
+        self._thread.start()
+
+    @property
+    def frames_buffered(self) -> int:
+        """
+        The number of frames currently waiting in the buffer.
+        """
+        return self._frames_buffered
+
+    def _fill_loop(self):
+        """
+        Keeps the ring buffer topped up until the source ends or the buffer is closed.
+        """
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._frames_buffered < self.capacity or self._closed)
+                if self._closed:
+                    return
+
+            # Reading outside the lock so the player can keep draining the buffer
+            try:
+                data = self.original.read()
+            except Exception:
+                data = b""
+
+            with self._condition:
+                if len(data) != self.frame_size:
+                    self._eof = True
+                    self._condition.notify_all()
+                    return
+
+                start = self._write_idx * self.frame_size
+                self._buffer[start:start + self.frame_size] = data
+                self._write_idx = (self._write_idx + 1) % self.capacity
+                self._frames_buffered += 1
+                self._condition.notify_all()
+
+    def read(self) -> bytes:
+        with self._condition:
+            stalled = not self._frames_buffered and not self._eof
+            self._condition.wait_for(lambda: self._frames_buffered or self._eof or self._closed)
+            if not self._frames_buffered:
+                return b""
+
+            # Waiting before the first frame is startup, not an underrun
+            if stalled and self.frames_read:
+                self.underruns += 1
+
+            start = self._read_idx * self.frame_size
+            data = bytes(self._buffer[start:start + self.frame_size])
+            self._read_idx = (self._read_idx + 1) % self.capacity
+            self._frames_buffered -= 1
+            self.frames_read += 1
+            self._condition.notify_all()
+            return data
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        # Stopping the original source also unblocks the read-ahead thread if it's waiting on it
+        self.original.cleanup()
+        self._thread.join(timeout=1)
+
+
+class InterruptibleAudioSource(discord.AudioSource):
+    def __init__(self, main: discord.AudioSource):
+        """
+        Plays a main source that can be interrupted by other sources. While interrupted, the main source
+        is simply not read from, so it picks up at the exact frame it left off without being restarted.
+
+        :param main: The main audio source
+        """
+        self.main = main
+        self._interruptions = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def is_interrupted(self) -> bool:
+        """
+        Whether an interrupting source is queued or playing.
+        """
+        return bool(self._interruptions)
+
+    def interrupt(self, source: discord.AudioSource, on_finished=None):
+        """
+        Queues a source to play over the main source. Interruptions play in the order they are added.
+
+        :param source: The audio source to play
+        :param on_finished: Called (from the player thread) once the source has finished or been skipped
+        """
+        with self._lock:
+            self._interruptions.append((source, on_finished))
+
+    def skip_interruption(self) -> bool:
+        """
+        Stops the interrupting source that is currently playing.
+
+        :return: True if an interruption was skipped, False otherwise
+        """
+        with self._lock:
+            if not self._interruptions:
+                return False
+            interruption = self._interruptions.popleft()
+        self._finish_interruption(interruption)
+        return True
+
+    @staticmethod
+    def _finish_interruption(interruption):
+        """
+        Cleans up an interrupting source and runs its finished callback.
+
+        :param interruption: The (source, on_finished) pair to finish
+        """
+        source, on_finished = interruption
+        source.cleanup()
+        if on_finished:
+            on_finished()
+
+    def read(self) -> bytes:
+        while True:
+            with self._lock:
+                interruption = self._interruptions[0] if self._interruptions else None
+            if interruption is None:
+                return self.main.read()
+
+            data = interruption[0].read()
+            if data:
+                return data
+
+            # The interruption finished, moving on to the next one or back to the main source
+            with self._lock:
+                # It may have already been skipped from another thread
+                is_current = bool(self._interruptions) and self._interruptions[0] is interruption
+                if is_current:
+                    self._interruptions.popleft()
+            if is_current:
+                self._finish_interruption(interruption)
+
+    def is_opus(self) -> bool:
+        return self.main.is_opus()
+
+    def cleanup(self):
+        with self._lock:
+            interruptions = list(self._interruptions)
+            self._interruptions.clear()
+        for interruption in interruptions:
+            self._finish_interruption(interruption)
+        self.main.cleanup()
+
+
+class ChunkedAudioStream:
+    def __init__(self):
+        """
+        A file-like stream of encoded audio that is written in chunks and read by FFmpeg through a pipe.
+        Reads block until the next chunk is written, so FFmpeg can start decoding the first chunk while later
+        ones are still being produced, and decodes them all as one continuous stream without gaps.
+        """
+        self._chunks = queue.Queue()
+        self._current = memoryview(b"")
+        self._finished = False
+
+    def write_chunk(self, data: bytes):
+        """
+        Adds a chunk of audio to the end of the stream.
+
+        :param data: The encoded audio bytes
+        """
+        self._chunks.put(data)
+
+    def finish(self):
+        """
+        Marks the end of the stream, once the chunks already written have been read.
+        """
+        self._chunks.put(None)
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Reads up to size bytes, blocking until a chunk is available.
+
+        :param size: The max number of bytes to read, -1 reads the rest of the current chunk
+        :return: The audio bytes, or empty bytes once the stream is finished
+        """
+        while not self._current:
+            if self._finished:
+                return b""
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._finished = True
+                return b""
+            self._current = memoryview(chunk)
+
+        if size < 0:
+            size = len(self._current)
+        data = bytes(self._current[:size])
+        self._current = self._current[size:]
+        return data
+
+
+class OggOpusAudioSource(discord.AudioSource):
+    # Opus header packets, which come before the audio and aren't sent to Discord
+    HEADER_PACKET_PREFIXES = (b"OpusHead", b"OpusTags")
+
+    def __init__(self, audio_content: bytes, start_offset: float = 0.0, end_offset: float = None):
+        """
+        Plays Ogg Opus audio by passing its packets straight through to Discord, without FFmpeg decoding
+        and re-encoding it. Only works for audio made of 20ms packets, which is what Discord sends.
+
+        :param audio_content: The Ogg Opus audio bytes
+        :param start_offset: The position (in seconds) to start playing from
+        :param end_offset: The position (in seconds) to stop playing at, None plays to the end
+        :raises ValueError: If the audio can't be passed through
+        """
+        try:
+            packets = [
+                packet for packet in discord.oggparse.OggStream(io.BytesIO(audio_content)).iter_packets()
+                if not packet.startswith(self.HEADER_PACKET_PREFIXES)
+            ]
+        except discord.oggparse.OggError as e:
+            raise ValueError(f"Audio is not valid Ogg: {e}") from e
+        if not packets or not all(self.get_packet_duration(packet) == FRAME_LENGTH_SECONDS for packet in packets):
+            raise ValueError("Audio is not made of 20ms Opus packets")
+
+        start_idx = round(start_offset / FRAME_LENGTH_SECONDS)
+        end_idx = None if end_offset is None else round(end_offset / FRAME_LENGTH_SECONDS)
+        self._packets = iter(packets[start_idx:end_idx])
+
+    @staticmethod
+    def get_packet_duration(packet: bytes) -> float:
+        """
+        Reads the duration of an Opus packet from its TOC byte (RFC 6716, section 3.1).
+
+        :param packet: The Opus packet
+        :return: The duration of the packet in seconds
+        """
+        if not packet:
+            return 0.0
+        config = packet[0] >> 3
+        if config < 12:
+            frame_ms = (10, 20, 40, 60)[config % 4]
+        elif config < 16:
+            frame_ms = (10, 20)[config % 2]
+        else:
+            frame_ms = (2.5, 5, 10, 20)[config % 4]
+
+        frame_count_code = packet[0] & 0b11
+        if frame_count_code == 0:
+            frame_count = 1
+        elif frame_count_code < 3:
+            frame_count = 2
+        else:
+            frame_count = packet[1] & 0b111111 if len(packet) > 1 else 0
+        return frame_ms * frame_count / 1000
+
+    def read(self) -> bytes:
+        return next(self._packets, b"")
+
+    def is_opus(self) -> bool:
+        return True
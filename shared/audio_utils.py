@@ -0,0 +1,172 @@
+import io
+import struct
+
+import discord
+import numpy as np
+from pydub.audio_segment import AudioSegment
+
+from shared.audio_sources import OggOpusAudioSource
+
+# Opus granule positions always count samples at 48kHz (RFC 7845, section 4)
+OPUS_GRANULE_RATE = 48000
+
+# The most audio packets put in one Ogg page when rewriting an Ogg Opus stream, about a second of audio
+OGG_PACKETS_PER_PAGE = 50
+
+# Ogg page flags (RFC 3533, section 6)
+OGG_BOS_FLAG = 0x02
+OGG_EOS_FLAG = 0x04
+
+
+def _build_ogg_crc_table():
+    """
+    Builds the lookup table for Ogg's CRC-32, which uses the 0x04C11DB7 polynomial without bit reflection,
+    unlike zlib's CRC-32.
+
+    :return: The table of 256 CRCs
+    """
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+OGG_CRC_TABLE = _build_ogg_crc_table()
+
+
+def find_audible_bounds(samples: np.ndarray, sample_rate, threshold_dbfs=-50.0, window_ms=10,
+                        lead_padding_ms=30, tail_padding_ms=100):
+    """
+    Finds where the audible part of some audio starts and ends, so leading/trailing silence can be skipped.
+    Looks at the RMS level of short windows and keeps a little padding so soft onsets/decays aren't cut.
+
+    :param samples: Mono samples as floats, where 1.0 is full scale
+    :param sample_rate: The sample rate of the samples
+    :param threshold_dbfs: The level a window must be above to count as audible
+    :param window_ms: The length of each window in milliseconds
+    :param lead_padding_ms: How much silence to keep before the audible part
+    :param tail_padding_ms: How much silence to keep after the audible part
+    :return: The start and end of the audible audio in seconds. End is None if nothing is trimmed from the end
+    """
+    window = max(int(sample_rate * window_ms / 1000), 1)
+    window_count = len(samples) // window
+    if window_count == 0:
+        return 0.0, None
+
+    windows = samples[:window_count * window].reshape(window_count, window)
+    rms = np.sqrt(np.mean(np.square(windows), axis=1))
+    audible_windows = np.flatnonzero(rms > 10 ** (threshold_dbfs / 20))
+
+    # Leaving completely silent audio alone
+    if audible_windows.size == 0:
+        return 0.0, None
+
+    start_sample = max(audible_windows[0] * window - int(sample_rate * lead_padding_ms / 1000), 0)
+    end_sample = (audible_windows[-1] + 1) * window + int(sample_rate * tail_padding_ms / 1000)
+
+    start = float(start_sample / sample_rate)
+    end = float(end_sample / sample_rate) if end_sample < len(samples) else None
+    return start, end
+
+
+def get_audible_bounds(sound: AudioSegment, **kwargs):
+    """
+    Finds where the audible part of a pydub AudioSegment starts and ends.
+
+    :param sound: The sound to check
+    :param kwargs: Extra options passed to find_audible_bounds
+    :return: The start and end of the audible audio in seconds. End is None if nothing is trimmed from the end
+    """
+    samples = np.array(sound.get_array_of_samples(), dtype=np.float32)
+    samples = samples.reshape(-1, sound.channels).mean(axis=1)
+    samples /= float(1 << (8 * sound.sample_width - 1))
+    return find_audible_bounds(samples, sound.frame_rate, **kwargs)
+
+
+def _ogg_crc(data: bytes):
+    """
+    Computes the CRC-32 of an Ogg page.
+
+    :param data: The page, with its CRC field zeroed
+    :return: The CRC
+    """
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ OGG_CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def _build_ogg_page(packets, flag, granule_position, serial, page_number):
+    """
+    Builds an Ogg page holding whole packets.
+
+    :param packets: The packets in the page
+    :param flag: The page's header type flags
+    :param granule_position: The granule position at the end of the page
+    :param serial: The stream's serial number
+    :param page_number: The page's sequence number
+    :return: The page bytes
+    """
+    segment_table = bytearray()
+    for packet in packets:
+        segment_table += b"\xff" * (len(packet) // 255) + bytes([len(packet) % 255])
+    header = b"OggS" + struct.pack(
+        "<BBqIIIB", 0, flag, granule_position, serial, page_number, 0, len(segment_table)
+    )
+    page = bytearray(header + segment_table + b"".join(packets))
+    struct.pack_into("<I", page, 22, _ogg_crc(page))
+    return bytes(page)
+
+
+def trim_ogg_opus(audio_content: bytes, start_offset=0.0, end_offset=None):
+    """
+    Cuts Ogg Opus audio down to the packets between two offsets, without decoding or re-encoding it,
+    so the result can still be passed straight through to Discord. The cut is rounded to packet boundaries.
+
+    :param audio_content: The Ogg Opus audio bytes, a single stream
+    :param start_offset: Where to start (in seconds)
+    :param end_offset: Where to stop (in seconds), None keeps everything to the end
+    :return: The trimmed Ogg Opus audio bytes
+    :raises ValueError: If the audio isn't an Ogg Opus stream
+    """
+    try:
+        packets = list(discord.oggparse.OggStream(io.BytesIO(audio_content)).iter_packets())
+    except discord.oggparse.OggError as e:
+        raise ValueError(f"Audio is not valid Ogg: {e}") from e
+    if len(packets) < 2 or not packets[0].startswith(b"OpusHead") or not packets[1].startswith(b"OpusTags"):
+        raise ValueError("Audio is not an Ogg Opus stream")
+
+    # Keeping the packets that start within the offsets
+    head_packet, tags_packet, *audio_packets = packets
+    kept_packets = []
+    position = 0.0
+    for packet in audio_packets:
+        if end_offset is not None and position >= end_offset:
+            break
+        if position >= start_offset - 1e-6:
+            kept_packets.append(packet)
+        position += OggOpusAudioSource.get_packet_duration(packet)
+
+    if not kept_packets:
+        return audio_content
+
+    # The pre-skip in the header still applies, so granule positions carry on counting from it
+    serial = struct.unpack_from("<I", audio_content, 14)[0]
+    granule_position = struct.unpack_from("<H", head_packet, 10)[0]
+    pages = [
+        _build_ogg_page([head_packet], OGG_BOS_FLAG, 0, serial, 0),
+        _build_ogg_page([tags_packet], 0, 0, serial, 1)
+    ]
+    for page_idx in range(0, len(kept_packets), OGG_PACKETS_PER_PAGE):
+        page_packets = kept_packets[page_idx:page_idx + OGG_PACKETS_PER_PAGE]
+        granule_position += round(
+            sum(OggOpusAudioSource.get_packet_duration(packet) for packet in page_packets) * OPUS_GRANULE_RATE
+        )
+        is_last_page = page_idx + OGG_PACKETS_PER_PAGE >= len(kept_packets)
+        pages.append(_build_ogg_page(
+            page_packets, OGG_EOS_FLAG if is_last_page else 0, granule_position, serial, len(pages)
+        ))
+    return b"".join(pages)
@@ -5,17 +5,17 @@ database management, TTS, audio management, and GPT integration already set up.
 
 import os
 import logging
-import io
 from abc import ABC, abstractmethod
 from distutils.util import strtobool
 from discord.ext import commands, tasks
-from discord import File
 import json
 
 from shared.ChatLLMManager import ConversationCache, ChatLLMManager
+from shared.streaming_reply import StreamingReply
 from shared.data_manager import DataManager
 from shared.cred_utils import save_google_service_file
 from shared.TTSManager import TTSManager
+from shared.tts_engines import get_default_local_engine
 from shared.VCAudioManager import VCAudioManager
 
 class BaseBot(commands.Bot, ABC):
@@ -37,6 +37,7 @@ class BaseBot(commands.Bot, ABC):
                  gpt_function_references=None,
                  gpt_tool_definitions=None,
                  gpt_get_memories=None,
+                 conversation_store_path=os.path.join("conversation_cache", "messages.jsonl"),
                  **kwargs):
         super().__init__(**kwargs)
 
@@ -54,12 +55,14 @@ class BaseBot(commands.Bot, ABC):
         os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'google-services.json'
 
         # Setting up the TTS manager and VC Audio Manager
+        self.tts_manager = None
+        self.audio_manager = None
         if audio_file_directory:
-            self.tts_manager = TTSManager(audio_file_directory)
+            self.tts_manager = TTSManager(audio_file_directory, local_engine=get_default_local_engine())
             self.audio_manager = VCAudioManager(self.tts_manager)
 
         # Conversation cache for message caching
-        self.conversation_cache = ConversationCache()
+        self.conversation_cache = ConversationCache(store_path=conversation_store_path)
 
         # Getting GPT config info
         gpt_system_prompt = self.db_manager.get_item_by_key(
@@ -157,6 +160,17 @@ class BaseBot(commands.Bot, ABC):
         await self.tree.sync()
         logging.info("Synced commands and added all cogs")
 
+        # Opening the TTS connection early so the first audio isn't slowed down
+        if self.tts_manager:
+            await self.tts_manager.warm_up()
+
+    async def close(self):
+        """
+        Called by discord.py on shutdown. Closes the GPT client's connections before the bot closes.
+        """
+        await self.llm_manager.close()
+        await super().close()
+
     def add_command_cogs(self, cogs):
         """
         Adds command cogs to the bot after initialization.
@@ -208,27 +222,18 @@ class BaseBot(commands.Bot, ABC):
                 await self.conversation_cache.add_message(message)
                 message_chain = self.conversation_cache.get_message_chain(message)
 
-                # Executing the model
-                gpt_message, images = await self.llm_manager.process_with_history(message_chain)
-
-                # Converting images to discord files
-                discord_file_images = []
-                for idx, image in enumerate(images):
-                    buffer = io.BytesIO()
-                    image.save(buffer, format="PNG")
-                    buffer.seek(0)
-                    discord_file_images.append(
-                        File(buffer, filename=f"image_{idx}.png")
-                    )
-
-                # Sending the message if things are valid
-                if gpt_message and gpt_message.content:
-                    reply_message = await message.reply(
-                        content=gpt_message.content[:2000],
-                        files=discord_file_images[:10]
-                    )
+                # Executing the model, streaming its response into a reply as it's written
+                reply = StreamingReply(message)
+                gpt_message, images = await self.llm_manager.process_with_history(message_chain, on_text=reply.write)
+                reply_messages = await reply.finish(images)
+
+                # Caching the reply if things are valid
+                if reply_messages:
+                    if not (gpt_message and gpt_message.content):
+                        logging.warning("GPT response was cut off, keeping the part that was already sent.")
                     logging.info(f"AI response sent to {message.author.name} in channel {message.channel.name}")
-                    await self.conversation_cache.add_message(reply_message)
+                    for reply_message in reply_messages:
+                        await self.conversation_cache.add_message(reply_message)
                 else:
                     logging.error("GPT message was None or missing content. Sending fallback error message.")
                     await message.reply("`Sorry, something went wrong with your request. Please try again later.`")
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+
+class ConversationStore:
+    def __init__(self, store_path, max_messages=50000):
+        """
+        Append-only on-disk store of cached conversation messages, so reply chains survive restarts without
+        re-downloading them from Discord. Each message is one JSON line, keyed by its message id.
+        The file is read lazily the first time it's used. It's compacted when it's read if it has grown past
+        the limit (or has a line cut off by a crash), and while running once it has twice as many lines as the limit.
+
+        :param store_path: The path of the store file
+        :param max_messages: The max number of messages to keep, oldest are dropped first
+        """
+        self.store_path = store_path
+        self.max_messages = max_messages
+
+        self._records: Optional["OrderedDict[int, dict]"] = None
+        self._line_count = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.store_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _load(self):
+        """
+        Reads the store file into memory, compacting it if needed. Must be called with the lock held.
+        """
+        self._records = OrderedDict()
+        if not os.path.exists(self.store_path):
+            return
+
+        line_count = 0
+        bad_lines = 0
+        with open(self.store_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line_count += 1
+                try:
+                    record = json.loads(line)
+                    self._records[record["message_id"]] = record
+                except (ValueError, KeyError):
+                    bad_lines += 1
+        while len(self._records) > self.max_messages:
+            self._records.popitem(last=False)
+
+        if bad_lines:
+            logging.warning(f"Skipped {bad_lines} unreadable lines in the conversation store")
+        self._line_count = line_count
+        if bad_lines or line_count > len(self._records):
+            self._compact()
+        logging.info(f"Loaded {len(self._records)} messages from the conversation store")
+
+    def _compact(self):
+        """
+        Rewrites the store file with only the messages kept in memory. Must be called with the lock held.
+        """
+        temp_path = f"{self.store_path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                for record in self._records.values():
+                    f.write(json.dumps(record) + "\n")
+            os.replace(temp_path, self.store_path)
+            self._line_count = len(self._records)
+        except OSError as e:
+            logging.error(f"Failed to compact the conversation store: {e}")
+
+    def get_chain(self, message_id) -> List[dict]:
+        """
+        Gets a stored message and the messages above it in its reply chain.
+
+        :param message_id: The id of the message
+        :return: The message records, from the message up to the first stored message it replied to.
+                 Empty if the message isn't stored
+        """
+        with self._lock:
+            if self._records is None:
+                self._load()
+
+            chain = []
+            seen_ids = set()
+            while message_id in self._records and message_id not in seen_ids:
+                seen_ids.add(message_id)
+                record = self._records[message_id]
+                chain.append(record)
+                message_id = record.get("parent_id")
+            return chain
+
+    def append(self, records: List[dict]):
+        """
+        Appends messages to the store.
+
+        :param records: The message records to store
+        """
+        with self._lock:
+            if self._records is None:
+                self._load()
+
+            try:
+                with open(self.store_path, "a", encoding="utf-8") as f:
+                    for record in records:
+                        f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                logging.error(f"Failed to write to the conversation store: {e}")
+                return
+
+            self._line_count += len(records)
+            for record in records:
+                self._records[record["message_id"]] = record
+            while len(self._records) > self.max_messages:
+                self._records.popitem(last=False)
+            if self._line_count > 2 * self.max_messages:
+                self._compact()
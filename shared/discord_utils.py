@@ -1,30 +1,85 @@
+import asyncio
 import logging
+import time
+from typing import Container, Dict
 
-from discord import Message, Guild, Member, Interaction
+from discord import Message, Guild, Member, Interaction, Object, RateLimited
 
 from shared.errors import NotInVoiceChannelError
 
-async def get_message_history(message: Message):
+async def get_message_history(message: Message, max_depth=50, known_message_ids: Container[int] = (),
+                              history_batch_size=101, request_interval=0.5):
     """
     Building a list of the response chain of messages
+    Parents are taken from the client's message cache when possible. Otherwise the channel history around the
+    parent is downloaded, which usually includes several more messages further up the chain
 
     :param message: The initial child message to check the history for
-    :return: The chain of messages
+    :param max_depth: The max number of messages to go up the chain
+    :param known_message_ids: Ids of messages the caller already has (e.g. from the ConversationCache).
+                              The chain stops before the first one of these it reaches
+    :param history_batch_size: The number of messages to download per history request, at most 101
+    :param request_interval: The min time (in seconds) between requests to Discord
+    :return: The chain of messages, oldest first, not including the initial message
     """
+    chain = []
+    downloaded_messages: Dict[int, Message] = {}
+    last_request_time = None
+    current_message = message
+
     try:
-        if message and message.reference:
-            logging.info(f"Downloading message history for message: {message.id}")
-            parent_message = await message.channel.fetch_message(message.reference.message_id)
-            chain = await get_message_history(parent_message)
+        while current_message.reference and len(chain) < max_depth:
+            parent_id = current_message.reference.message_id
+            if parent_id is None or parent_id in known_message_ids:
+                break
+
+            # Checking the client's cache and the messages we've already downloaded before asking Discord
+            parent_message = current_message.reference.cached_message or downloaded_messages.get(parent_id)
+            if parent_message is None:
+                # Spacing out requests so a long chain doesn't burst into Discord's rate limits
+                if last_request_time is not None:
+                    await asyncio.sleep(max(0.0, last_request_time + request_interval - time.monotonic()))
+                last_request_time = time.monotonic()
+
+                logging.info(f"Downloading message history around message: {parent_id}")
+                downloaded_messages.update(
+                    await _download_history_around(current_message.channel, parent_id, history_batch_size)
+                )
+                parent_message = downloaded_messages.get(parent_id)
+                if parent_message is None:
+                    parent_message = await current_message.channel.fetch_message(parent_id)
 
-            # Continuing after we get all the messages
             chain.append(parent_message)
-            return chain
-        else:
-            return []  # Base case
+            current_message = parent_message
     except Exception as e:
-        logging.error(e)
-        return []  # Returning the base case if we have an issue
+        logging.error(f"Failed to download message history for message {message.id}: {e}")
+
+    # Returning whatever part of the chain we got, oldest first
+    chain.reverse()
+    return chain
+
+
+async def _download_history_around(channel, message_id, limit):
+    """
+    Downloads the channel history around a message, waiting out a rate limit once if we hit one
+
+    :param channel: The channel to download from
+    :param message_id: The id of the message to center the history on
+    :param limit: The number of messages to download, at most 101
+    :return: A dictionary of message ids to the downloaded messages
+    """
+    for attempt in range(2):
+        try:
+            return {
+                history_message.id: history_message
+                async for history_message in channel.history(limit=limit, around=Object(id=message_id))
+            }
+        except RateLimited as e:
+            if attempt:
+                raise
+            logging.warning(f"Rate limited while downloading message history, retrying in {e.retry_after:.1f}s")
+            await asyncio.sleep(e.retry_after)
+
 
 def find_member_by_display_name(guild: Guild, display_name: str):
     """
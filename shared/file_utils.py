@@ -17,7 +17,12 @@ def get_random_file_id(directory_path):
         match = re.match(r"^(\d+)(?:_normalized)?\.", filename)
         if match:
             current_file_ids.add(int(match.group(1)))
-    available_ids = set(range(1, 10000)) - current_file_ids
-    final_id = random.choice(tuple(available_ids))
+    # Trying random ids first, which almost always finds a free one without building the full id range
+    for _ in range(100):
+        final_id = random.randint(1, 9999)
+        if final_id not in current_file_ids:
+            break
+    else:
+        final_id = random.choice(tuple(set(range(1, 10000)) - current_file_ids))
     logging.info("Found randomized available file id: %d", final_id)
     return final_id
@@ -5,14 +5,25 @@ from discord import Interaction, Member
 from shared.track_downloader.song_downloader import SongDownloader
 from shared.track_downloader.playlist_downloader import PlaylistDownloader
 from shared.track_downloader.models import PlaylistRequest, SongRequest
-from shared.VCAudioManager import VCAudioManager
+from shared.VCAudioManager import AudioState, VCAudioManager
 from shared.discord_utils import is_in_voice_channel
 
 class MusicService:
-    def __init__(self, song_downloader: SongDownloader, playlist_downloader: PlaylistDownloader, audio_manager: VCAudioManager):
+    def __init__(self, song_downloader: SongDownloader, playlist_downloader: PlaylistDownloader, audio_manager: VCAudioManager,
+                 announce_queued_songs=False):
+        """
+        Downloads requested songs and playlists and queues them for playback.
+
+        :param song_downloader: The SongDownloader for single songs
+        :param playlist_downloader: The PlaylistDownloader for playlists
+        :param audio_manager: The VCAudioManager that plays the songs
+        :param announce_queued_songs: Whether to announce a requested song over the current song when it's queued.
+                                      Off by default
+        """
         self.song_downloader = song_downloader
         self.playlist_downloader = playlist_downloader
         self.audio_manager = audio_manager
+        self.announce_queued_songs = announce_queued_songs
 
     async def download_and_queue_song_from_url(
             self,
@@ -32,16 +43,21 @@ class MusicService:
         logging.info(f"Downloaded song: {song_request.title}")
 
         # Add the downloaded song to the audio manager's queue
+        was_playing = self.audio_manager.current_state == AudioState.PLAYING
         await self.audio_manager.add_to_queue(
             song_request.file_path,
             user.voice.channel,
             duration=song_request.content_duration,
+            start_offset=song_request.audio_start,
+            end_offset=song_request.audio_end,
             high_priority=True,
             audio_name=song_request.title,
             added_by=user.display_name
         )
         logging.info(f"Added song to queue: {song_request.title}")
 
+        if was_playing:
+            await self._announce_queued_song(song_request, user)
         return song_request
 
     async def download_and_queue_song_from_query(
@@ -62,18 +78,44 @@ class MusicService:
         logging.info(f"Downloaded song from query '{search_query}': {song_request.title}")
 
         # Add the downloaded song to the audio manager's queue
+        was_playing = self.audio_manager.current_state == AudioState.PLAYING
         await self.audio_manager.add_to_queue(
             song_request.file_path,
             user.voice.channel,
             duration=song_request.content_duration,
+            start_offset=song_request.audio_start,
+            end_offset=song_request.audio_end,
             high_priority=True,
             audio_name=song_request.title,
             added_by=user.display_name
         )
         logging.info(f"Added song to queue: {song_request.title}")
 
+        if was_playing:
+            await self._announce_queued_song(song_request, user)
         return song_request
 
+    async def _announce_queued_song(self, song_request: SongRequest, user: Member):
+        """
+        Announces a queued song over the song that's playing, which carries on from the same spot afterwards.
+
+        :param song_request: The queued song
+        :param user: The Discord Member who requested the song
+        """
+        if not self.announce_queued_songs or not self.audio_manager.tts_manager:
+            return
+
+        speech = await self.audio_manager.tts_manager.process(
+            f"{user.display_name} queued {song_request.title}"
+        )
+        if speech:
+            await self.audio_manager.add_speech_to_queue(
+                speech,
+                user.voice.channel,
+                audio_name="Song queued announcement",
+                preempt=True
+            )
+
     async def download_and_queue_playlist(
             self,
             playlist_request: PlaylistRequest,
@@ -101,6 +143,8 @@ class MusicService:
                 download_result.file_path,
                 user.voice.channel,
                 duration=download_result.content_duration,
+                start_offset=download_result.audio_start,
+                end_offset=download_result.audio_end,
                 audio_name=download_result.title,
                 added_by=user.display_name,
                 high_priority=False
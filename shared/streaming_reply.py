@@ -0,0 +1,147 @@
+import io
+import logging
+import time
+from typing import List, Optional
+
+import discord
+from discord import Message
+from PIL import Image
+
+# Discord's max message length, and the max number of files on one message
+MAX_MESSAGE_LENGTH = 2000
+MAX_ATTACHMENTS = 10
+
+
+class StreamingReply:
+    def __init__(self, message: Message, edit_interval=1.2, max_length=MAX_MESSAGE_LENGTH):
+        """
+        Writes a reply to a message as its text streams in. The reply is posted as soon as there's text,
+        then edited with the new text at most once per edit interval, which keeps it under Discord's edit rate limit.
+        Text past the max length continues in follow-up messages, each replying to the one before it.
+
+        :param message: The message to reply to
+        :param edit_interval: The min time (in seconds) between edits
+        :param max_length: The max length of each message
+        """
+        self.message = message
+        self.edit_interval = edit_interval
+        self.max_length = max_length
+
+        self.text = ""
+        self.sent_messages: List[Message] = []
+
+        # Where the text of the current (last) message starts, the message, and the text it's showing
+        self._current_start = 0
+        self._current_message: Optional[Message] = None
+        self._current_content = ""
+        self._last_update_time = 0.0
+
+    async def write(self, text):
+        """
+        Adds text to the reply, updating the message if the edit interval has passed.
+
+        :param text: The text to add
+        """
+        self.text += text
+        if time.monotonic() - self._last_update_time >= self.edit_interval:
+            await self._update()
+
+    async def finish(self, images: List[Image.Image] = None) -> List[Message]:
+        """
+        Shows the rest of the text, and attaches any images to the last message.
+
+        :param images: The images to attach (optional)
+        :return: The messages sent for the reply, in order
+        """
+        await self._update()
+
+        files = []
+        for idx, image in enumerate((images or [])[:MAX_ATTACHMENTS]):
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            buffer.seek(0)
+            files.append(discord.File(buffer, filename=f"image_{idx}.png"))
+
+        if files:
+            try:
+                if self._current_message:
+                    self._replace_current(await self._current_message.edit(attachments=files))
+                else:
+                    self._add_message(await self.message.reply(files=files))
+            except discord.HTTPException as e:
+                logging.error(f"Failed to attach images to reply: {e}")
+
+        return self.sent_messages
+
+    async def _update(self):
+        """
+        Updates the reply with the text written so far, moving on to a new message when the current one is full.
+        """
+        self._last_update_time = time.monotonic()
+        try:
+            pending_text = self.text[self._current_start:]
+            while len(pending_text) > self.max_length:
+                split_index = self._find_split_index(pending_text)
+                await self._show(pending_text[:split_index])
+
+                # Starting the next message after the split, without any whitespace it starts with
+                next_text = pending_text[split_index:]
+                self._current_start += split_index + len(next_text) - len(next_text.lstrip())
+                self._current_message = None
+                self._current_content = ""
+                pending_text = self.text[self._current_start:]
+
+            await self._show(pending_text)
+        except discord.HTTPException as e:
+            logging.error(f"Failed to update streamed reply: {e}")
+
+    def _find_split_index(self, text):
+        """
+        Finds where to split text that's too long for one message, preferring a line break, then a space.
+
+        :param text: The text to split
+        :return: The index to split at
+        """
+        for separator in ("\n", " "):
+            split_index = text.rfind(separator, 0, self.max_length)
+            if split_index > 0:
+                return split_index
+        return self.max_length
+
+    async def _show(self, content):
+        """
+        Shows content in the current message, sending it if it hasn't been sent yet.
+
+        :param content: The content to show
+        """
+        content = content.rstrip()
+        if not content or content == self._current_content:
+            return
+
+        if self._current_message is None:
+            if self.sent_messages:
+                # Follow-ups don't ping the author again
+                self._add_message(await self.sent_messages[-1].reply(content=content, mention_author=False))
+            else:
+                self._add_message(await self.message.reply(content=content))
+        else:
+            self._replace_current(await self._current_message.edit(content=content))
+        self._current_content = content
+
+    def _add_message(self, message: Message):
+        """
+        Tracks a newly sent message as the current message.
+
+        :param message: The sent message
+        """
+        self.sent_messages.append(message)
+        self._current_message = message
+
+    def _replace_current(self, message: Message):
+        """
+        Swaps the current message for its edited version, so the latest content is kept.
+
+        :param message: The edited message
+        """
+        self.sent_messages[-1] = message
+        self._current_message = message
@@ -0,0 +1,66 @@
+import logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# The tokens each chat message adds for its role and formatting, and the tokens a low detail image costs
+MESSAGE_OVERHEAD_TOKENS = 4
+LOW_DETAIL_IMAGE_TOKENS = 85
+
+# The encoding used for models tiktoken doesn't know
+DEFAULT_ENCODING = "o200k_base"
+
+
+class TokenCounter:
+    def __init__(self, model_name):
+        """
+        Counts the tokens in chat messages for a model. Uses tiktoken when it's installed,
+        otherwise estimates about four characters per token.
+
+        :param model_name: The name of the model the messages are for
+        """
+        self.encoding = None
+        if tiktoken is None:
+            logging.info("tiktoken isn't installed, estimating token counts from text length")
+            return
+
+        try:
+            self.encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+        except Exception as e:
+            logging.warning(f"Failed to load the tiktoken encoding, estimating token counts instead: {e}")
+
+    def count_text(self, text) -> int:
+        """
+        Counts the tokens in some text.
+
+        :param text: The text to count
+        :return: The number of tokens
+        """
+        if not text:
+            return 0
+        if self.encoding:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def count_message(self, message: dict) -> int:
+        """
+        Counts the tokens in a chat message, with either string content or a list of text and image parts.
+
+        :param message: The chat message
+        :return: The number of tokens
+        """
+        content = message.get("content")
+        if isinstance(content, str) or content is None:
+            return MESSAGE_OVERHEAD_TOKENS + self.count_text(content)
+
+        tokens = MESSAGE_OVERHEAD_TOKENS
+        for part in content:
+            if part.get("type") == "image_url":
+                tokens += LOW_DETAIL_IMAGE_TOKENS
+            else:
+                tokens += self.count_text(part.get("text"))
+        return tokens
@@ -4,6 +4,7 @@ from pathlib import Path
 
 from pydub.audio_segment import AudioSegment
 from shared.track_downloader.errors import AudioProcessingError
+from shared.audio_utils import get_audible_bounds
 
 
 def match_target_amplitude(sound: AudioSegment, target_dbfs):
@@ -19,10 +20,11 @@ def match_target_amplitude(sound: AudioSegment, target_dbfs):
 
 def normalize_audio_track(audio_path):
     """
-    Normalizes the audio track so that it isn't too loud or quiet
+    Normalizes the audio track so that it isn't too loud or quiet.
+    Also finds the leading/trailing silence so playback can skip it without re-encoding.
 
     :param audio_path: The audio path to normalize
-    :return: The new path of the normalized audio file
+    :return: The new path of the normalized audio file, and the start/end (in seconds) of the audible audio
     """
     try:
         audio_path = Path(audio_path)
@@ -37,11 +39,12 @@ def normalize_audio_track(audio_path):
         sound = AudioSegment.from_file(audio_path)
         normalized_sound = match_target_amplitude(sound, -15.0)
         normalized_sound.export(new_path, format='mp4')
+        audio_start, audio_end = get_audible_bounds(normalized_sound)
 
         # Delete the old audio
         os.remove(audio_path)
         logging.info(f"Deleted {audio_path} after normalization, new filename is {new_path}")
-        return new_path
+        return new_path, audio_start, audio_end
     except Exception as e:
         logging.warning(e)
         raise AudioProcessingError("Failed to normalize audio") from e
@@ -326,6 +326,10 @@ class SongRequest:
         # The file path to the downloaded song, if downloaded
         self.file_path = None
 
+        # Where the audible part of the downloaded song starts/ends, so silence can be skipped during playback
+        self.audio_start = 0.0
+        self.audio_end = None
+
         # Verifying/Sanitizing the link, updating the source
         self.source = LinkValidator.validate_url(song_url)
         LinkValidator.sanitize_url(song_url)
@@ -245,7 +245,7 @@ class SongDownloader:
             # Normalizing the audio
             if song_request.content_duration <= NORMALIZE_DURATION_THRESHOLD:
                 logging.info(f"Normalizing audio for track: {song_request.title}")
-                new_file_path = normalize_audio_track(new_file_path)
+                new_file_path, song_request.audio_start, song_request.audio_end = normalize_audio_track(new_file_path)
 
             # Setting the file path in the song request
             song_request.file_path = new_file_path
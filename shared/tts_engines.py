@@ -0,0 +1,298 @@
+import asyncio
+import html
+import io
+import logging
+import os
+import shutil
+import wave
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+import discord
+import numpy as np
+from google.cloud import texttospeech
+
+from shared.audio_sources import PCM_SAMPLE_MAX
+from shared.constants import GOOGLE_TTS_VOICE_INFO
+from shared.TTSCache import TTSCache
+
+# The containers each supported Google audio encoding is decoded as
+GOOGLE_AUDIO_ENCODING_FORMATS = {
+    texttospeech.AudioEncoding.OGG_OPUS: "ogg",
+    texttospeech.AudioEncoding.MP3: "mp3"
+}
+
+
+class TTSEngine(ABC):
+    # A short name for the engine, used in logs and cache keys
+    name = "engine"
+
+    # The container of the audio the engine produces, as understood by FFmpeg/pydub
+    audio_format = "wav"
+
+    # Whether the engine accepts SSML input
+    supports_ssml = False
+
+    # Whether clips from the engine can be joined by appending their bytes (true for MP3 and Ogg, not WAV)
+    can_concatenate = False
+
+    async def warm_up(self):
+        """
+        Gets the engine ready ahead of the first request, if it needs it.
+        """
+        pass
+
+    @abstractmethod
+    def get_cache_key(self, text, voice_key=None, ssml=False) -> str:
+        """
+        Makes the cache key for a synthesis request, covering every setting that changes the audio.
+
+        :param text: The text (or SSML) being synthesized
+        :param voice_key: The key for the desired voice (optional)
+        :param ssml: Whether the text is SSML
+        :return: The cache key
+        """
+        pass
+
+    @abstractmethod
+    async def synthesize(self, text, voice_key=None, ssml=False) -> bytes:
+        """
+        Synthesizes speech.
+
+        :param text: The text (or SSML) to synthesize
+        :param voice_key: The key for the desired voice (optional)
+        :param ssml: Whether the text is SSML
+        :return: The encoded audio bytes
+        :raises Exception: If synthesis fails
+        """
+        pass
+
+    def build_batch_ssml(self, messages: List[Tuple[str, Optional[str]]], break_ms) -> str:
+        """
+        Builds the SSML for a batch of messages, for engines that support SSML.
+
+        :param messages: The (text, voice key) pairs to include, in order
+        :param break_ms: The pause (in milliseconds) between messages
+        :return: The SSML string
+        """
+        raise NotImplementedError(f"The {self.name} engine doesn't support SSML")
+
+
+class GoogleTTSEngine(TTSEngine):
+    name = "google"
+    supports_ssml = True
+    can_concatenate = True
+
+    def __init__(self, voice_info: dict = GOOGLE_TTS_VOICE_INFO, speaking_rate=0.9, request_timeout=10.0,
+                 audio_encoding=texttospeech.AudioEncoding.OGG_OPUS):
+        """
+        TTS engine using Google's api.
+        Environment variable named "GOOGLE_APPLICATION_CREDENTIALS" must be set for api to work
+
+        :param voice_info: A dictionary containing the languages, and the code and voice name for each desired language
+        :param speaking_rate: The speaking rate the voice should have
+        :param request_timeout: The max time (in seconds) to wait on a synthesis request
+        :param audio_encoding: The encoding to request, either OGG_OPUS (which Discord can play without transcoding) or MP3
+        """
+        # Making sure we have the environment variable set
+        if os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", None) is None:
+            raise EnvironmentError("No value set for 'GOOGLE_APPLICATION_CREDENTIALS'")
+        if audio_encoding not in GOOGLE_AUDIO_ENCODING_FORMATS:
+            raise ValueError(f"Unsupported TTS audio encoding: {audio_encoding}")
+
+        # The async client binds to the running event loop, so it's created on first use
+        self.client: Optional[texttospeech.TextToSpeechAsyncClient] = None
+        self.request_timeout = request_timeout
+        self.voice_info = voice_info
+        self.audio_format = GOOGLE_AUDIO_ENCODING_FORMATS[audio_encoding]
+        self.audio_config = texttospeech.AudioConfig(
+            audio_encoding=audio_encoding,
+            speaking_rate=speaking_rate
+        )
+
+        # Opus is requested at Discord's sample rate so its packets can be sent as they are
+        if audio_encoding == texttospeech.AudioEncoding.OGG_OPUS:
+            self.audio_config.sample_rate_hertz = discord.opus.Encoder.SAMPLING_RATE
+
+        # Set default voice config from the first option
+        default = self.voice_info[next(iter(self.voice_info))]
+        self.default_voice_config = texttospeech.VoiceSelectionParams(
+            language_code=default['language_code'],
+            name=default['voice_name']
+        )
+
+    def _get_client(self):
+        """
+        Gets the async TTS client, creating it in the running event loop if needed.
+
+        :return: The async TTS client
+        """
+        if self.client is None:
+            self.client = texttospeech.TextToSpeechAsyncClient()
+        return self.client
+
+    def get_voice_config(self, voice_key=None):
+        """
+        Gets the voice config for a voice key, falling back to the default voice.
+
+        :param voice_key: The key from GOOGLE_TTS_VOICE_INFO for the desired voice (optional)
+        :return: The voice config
+        """
+        voice = self.voice_info.get(voice_key)
+        if voice_key and voice:
+            return texttospeech.VoiceSelectionParams(
+                language_code=voice['language_code'],
+                name=voice['voice_name']
+            )
+        return self.default_voice_config
+
+    async def warm_up(self):
+        """
+        Opens the gRPC channel ahead of time with a cheap voice listing, so the first message isn't
+        slowed down by connection setup.
+        """
+        try:
+            await self._get_client().list_voices(language_code="en-US", timeout=self.request_timeout)
+            logging.info("Google TTS client warmed up")
+        except Exception as e:
+            logging.warning(f"Failed to warm up Google TTS client: {e}")
+
+    def get_cache_key(self, text, voice_key=None, ssml=False):
+        return TTSCache.make_key(
+            text,
+            self.get_voice_config(voice_key).name,
+            self.audio_config.speaking_rate,
+            texttospeech.AudioEncoding(self.audio_config.audio_encoding).name
+        )
+
+    async def synthesize(self, text, voice_key=None, ssml=False):
+        response = await self._get_client().synthesize_speech(
+            input=texttospeech.SynthesisInput(ssml=text) if ssml else texttospeech.SynthesisInput(text=text),
+            voice=self.get_voice_config(voice_key),
+            audio_config=self.audio_config,
+            timeout=self.request_timeout
+        )
+        return response.audio_content
+
+    def build_batch_ssml(self, messages: List[Tuple[str, Optional[str]]], break_ms):
+        """
+        Builds the SSML for a batch of messages, switching voices per message with a break between each one.
+
+        :param messages: The (text, voice key) pairs to include, in order
+        :param break_ms: The pause (in milliseconds) between messages
+        :return: The SSML string
+        """
+        parts = []
+        for text, voice_key in messages:
+            voice_name = self.get_voice_config(voice_key).name
+            parts.append(f'<voice name="{voice_name}">{html.escape(text)}</voice>')
+        pause = f'<break time="{break_ms}ms"/>'
+        return f"<speak>{pause.join(parts)}</speak>"
+
+
+class EspeakTTSEngine(TTSEngine):
+    name = "espeak"
+
+    def __init__(self, command=None, voice="en-us", words_per_minute=165, request_timeout=10.0):
+        """
+        Offline TTS engine that runs espeak-ng (or espeak) as a subprocess. Robotic, but has no network latency.
+
+        :param command: The espeak executable, found on the PATH if not given
+        :param voice: The espeak voice to use. Voice keys are ignored, since they're Google voices
+        :param words_per_minute: The speaking rate
+        :param request_timeout: The max time (in seconds) to wait on espeak
+        """
+        self.command = command or self.find_command()
+        if self.command is None:
+            raise EnvironmentError("espeak-ng or espeak must be installed to use the espeak TTS engine")
+        self.voice = voice
+        self.words_per_minute = words_per_minute
+        self.request_timeout = request_timeout
+
+    @staticmethod
+    def find_command():
+        """
+        Finds espeak on the PATH.
+
+        :return: The path to the espeak executable, None if it isn't installed
+        """
+        return shutil.which("espeak-ng") or shutil.which("espeak")
+
+    def get_cache_key(self, text, voice_key=None, ssml=False):
+        return TTSCache.make_key(text, f"{self.name}:{self.voice}", self.words_per_minute, self.audio_format)
+
+    async def synthesize(self, text, voice_key=None, ssml=False):
+        # Passing the text through stdin so it's never read as command line options
+        process = await asyncio.create_subprocess_exec(
+            self.command, "-v", self.voice, "-s", str(self.words_per_minute), "--stdout",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            audio_content, _ = await asyncio.wait_for(process.communicate(text.encode("utf-8")), self.request_timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            raise
+        if process.returncode != 0 or not audio_content:
+            raise RuntimeError(f"espeak exited with code {process.returncode}")
+        return audio_content
+
+
+class ToneTTSEngine(TTSEngine):
+    name = "tone"
+
+    def __init__(self, latency=0.0, seconds_per_character=0.06, silence_padding=0.25, sample_rate=24000):
+        """
+        Offline TTS engine that makes a tone as long as the text would take to say, surrounded by silence.
+        For testing and benchmarking the playback pipeline without any real speech synthesis.
+
+        :param latency: How long (in seconds) each request takes, to simulate a network engine
+        :param seconds_per_character: How long the tone is per character of text
+        :param silence_padding: The silence (in seconds) before and after the tone
+        :param sample_rate: The sample rate of the audio
+        """
+        self.latency = latency
+        self.seconds_per_character = seconds_per_character
+        self.silence_padding = silence_padding
+        self.sample_rate = sample_rate
+
+    def get_cache_key(self, text, voice_key=None, ssml=False):
+        return TTSCache.make_key(text, self.name, self.seconds_per_character, self.audio_format)
+
+    def _generate(self, text):
+        """
+        Generates the tone audio for some text.
+
+        :param text: The text to make a tone for
+        :return: The WAV audio bytes
+        """
+        tone_samples = int(max(len(text), 1) * self.seconds_per_character * self.sample_rate)
+        padding_samples = int(self.silence_padding * self.sample_rate)
+        tone = 0.3 * np.sin(2 * np.pi * 440 * np.arange(tone_samples) / self.sample_rate)
+        samples = np.concatenate([np.zeros(padding_samples), tone, np.zeros(padding_samples)])
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(self.sample_rate)
+            wav_file.writeframes((samples * PCM_SAMPLE_MAX).astype(np.int16).tobytes())
+        return buffer.getvalue()
+
+    async def synthesize(self, text, voice_key=None, ssml=False):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._generate(text)
+
+
+def get_default_local_engine() -> Optional[TTSEngine]:
+    """
+    Gets the offline engine to fall back on, if one is installed.
+
+    :return: An espeak engine, or None if espeak isn't installed
+    """
+    if EspeakTTSEngine.find_command():
+        return EspeakTTSEngine()
+    logging.info("espeak isn't installed, TTS will have no offline engine")
+    return None
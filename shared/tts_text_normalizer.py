@@ -0,0 +1,156 @@
+import re
+from typing import Dict, Optional
+
+import discord
+
+# The markdown the normalizer rewrites, each captured by a group named after it. The captured part is what the
+# token's replacement is made from. Every pattern starts with a plain character so the scan can jump between
+# the characters tokens start with instead of trying each pattern at every position of the text.
+# The order matters where tokens overlap (code blocks before inline code)
+MARKDOWN_PATTERNS = [
+    r"`(?P<code_block>``.*?```)",
+    r"`(?P<inline_code>[^`]+)`",
+    r"\|(?P<spoiler>\|.+?\|\|)",
+    r"\*(?P<bold_italics>\*{0,2})(?!\d)",
+    r"_(?P<underline>_)",
+    r"~(?P<strikethrough>~)",
+    r"#(?<![^\n]#)(?P<heading>#{0,2} )",
+    r">(?<![^\n]>)(?P<block_quote>>{0,2} )",
+    r"-(?<![^\n]-)(?P<subtext># )"
+]
+MARKDOWN_PATTERN = re.compile("|".join(MARKDOWN_PATTERNS), re.DOTALL)
+
+# The characters headings, block quotes and subtext start with, which only count at the start of a line
+LINE_MARKDOWN_CHARS = ("#", ">", "-")
+
+# Mentions and custom emoji, which all start with "<"
+MENTION_PATTERN = re.compile(
+    r"<(?:@!?(?P<user_mention>\d+)|@&(?P<role_mention>\d+)|#(?P<channel_mention>\d+)|a?:(?P<custom_emoji>\w+):\d+)>"
+)
+
+# How mentions are said, and what's said for ids that can't be resolved
+MENTION_FORMATS = {"user_mention": "@ {}", "role_mention": "@ {}", "channel_mention": "channel {}"}
+UNKNOWN_MENTIONS = {"user_mention": "@ someone", "role_mention": "@ a role", "channel_mention": "a channel"}
+
+# Any URL in the message, including ones inside code or other tokens whose text is passed through as it is
+URL_PATTERN = re.compile(r"https?://", re.IGNORECASE)
+
+
+def _may_have_markdown(text):
+    """
+    Checks if text has any of the characters markdown tokens start with. Plain substring checks are much
+    faster than a regex character class here, since each one is a single C-level search.
+
+    :param text: The text to check
+    :return: True if the text might have markdown in it
+    """
+    return (
+        "*" in text or "_" in text or "`" in text or "~" in text or "|" in text
+        or text.startswith(LINE_MARKDOWN_CHARS) or "\n#" in text or "\n>" in text or "\n-" in text
+    )
+
+
+class NormalizedText:
+    def __init__(self, text, contains_url=False):
+        """
+        The result of normalizing a message for TTS.
+
+        :param text: The text to synthesize. It's also what the TTS cache key is made from, so messages that
+                     only differ by formatting or ids share cached audio
+        :param contains_url: Whether the message had a URL in it
+        """
+        self.text = text
+        self.contains_url = contains_url
+
+    def __repr__(self):
+        return f"NormalizedText(text={self.text!r}, contains_url={self.contains_url})"
+
+
+class TTSTextNormalizer:
+    def __init__(self, code_block_replacement="code block", spoiler_replacement="spoiler"):
+        """
+        Turns Discord message content into text that reads well aloud.
+        Mentions and custom emoji are resolved to names, markdown is stripped, and code blocks and spoilers
+        are replaced with a short description. URLs are left as they are and flagged with contains_url,
+        since the caller skips those messages.
+
+        :param code_block_replacement: What to say in place of a code block
+        :param spoiler_replacement: What to say in place of a spoiler, so it isn't read out
+        """
+        # What each markdown token is replaced with, by the name of its group in MARKDOWN_PATTERNS.
+        # None means the token is replaced with the text it captured
+        self.replacements: Dict[str, Optional[str]] = {
+            "code_block": f" {code_block_replacement} ",
+            "inline_code": None,
+            "spoiler": f" {spoiler_replacement} ",
+            "bold_italics": "",
+            "underline": "",
+            "strikethrough": "",
+            "heading": "",
+            "block_quote": "",
+            "subtext": ""
+        }
+
+    def _replace_markdown(self, match):
+        """
+        Gives the replacement for a markdown token.
+
+        :param match: The MARKDOWN_PATTERN match
+        :return: The text to say in its place
+        """
+        token = match.lastgroup
+        replacement = self.replacements[token]
+        return match.group(token) if replacement is None else replacement
+
+    def normalize(self, text, user_names: Optional[Dict[int, str]] = None, role_names: Optional[Dict[int, str]] = None,
+                  channel_names: Optional[Dict[int, str]] = None) -> NormalizedText:
+        """
+        Normalizes text for TTS.
+
+        :param text: The message content
+        :param user_names: User ids to the names to say for them (optional)
+        :param role_names: Role ids to the names to say for them (optional)
+        :param channel_names: Channel ids to the names to say for them (optional)
+        :return: The NormalizedText
+        """
+        # Checking the raw content, since the text of inline code is passed through without being scanned
+        contains_url = "://" in text and URL_PATTERN.search(text) is not None
+
+        # Markdown goes first, so the names mentions are replaced with keep any markdown characters they have.
+        # Each pass only runs when the message has a character its tokens start with
+        if _may_have_markdown(text):
+            text = MARKDOWN_PATTERN.sub(self._replace_markdown, text)
+
+        if "<" in text:
+            mention_names = {
+                "user_mention": user_names or {},
+                "role_mention": role_names or {},
+                "channel_mention": channel_names or {}
+            }
+
+            def replace_mention(match):
+                token = match.lastgroup
+                if token == "custom_emoji":
+                    return match.group(token)
+                name = mention_names[token].get(int(match.group(token)))
+                return UNKNOWN_MENTIONS[token] if name is None else MENTION_FORMATS[token].format(name)
+
+            text = MENTION_PATTERN.sub(replace_mention, text)
+
+        # Whitespace left around removed tokens isn't collapsed here, since it's not said and the cache key
+        # is already made from the text with its whitespace collapsed
+        return NormalizedText(text.strip(), contains_url)
+
+    def normalize_message(self, message: discord.Message) -> NormalizedText:
+        """
+        Normalizes a Discord message for TTS, resolving its mentions from the message itself.
+
+        :param message: The message
+        :return: The NormalizedText
+        """
+        return self.normalize(
+            message.content,
+            user_names={user.id: user.display_name for user in message.mentions},
+            role_names={role.id: role.name for role in message.role_mentions},
+            channel_names={channel.id: channel.name for channel in message.channel_mentions}
+        )
@@ -0,0 +1,17 @@
+from shared.tts_text_normalizer import TTSTextNormalizer
+
+
+def test_url_in_inline_code_is_detected():
+    normalized = TTSTextNormalizer().normalize("check `https://example.com/x` out")
+    assert normalized.contains_url
+
+
+def test_url_in_masked_link_text_is_detected():
+    normalized = TTSTextNormalizer().normalize("[https://example.com](https://example.com/x)")
+    assert normalized.contains_url
+
+
+def test_plain_text_has_no_url():
+    normalized = TTSTextNormalizer().normalize("**hello** `there` <@123>", user_names={123: "Derek"})
+    assert not normalized.contains_url
+    assert normalized.text == "hello there @ Derek"
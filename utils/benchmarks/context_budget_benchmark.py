@@ -0,0 +1,133 @@
+"""
+Harness showing the prompt size ChatLLMManager sends for every mention in long reply chains, with the context
+budget against sending the whole chain. Summaries come from a stand-in client that answers after a delay,
+so no API key is needed and the background summaries race the next mention like they do in a live chat.
+Run from the repository root with: python -m utils.benchmarks.context_budget_benchmark
+"""
+import argparse
+import asyncio
+import random
+from types import SimpleNamespace
+
+from shared.ChatLLMManager import CachedMessage, ChatLLMManager
+
+WORDS = ["the", "game", "was", "honestly", "great", "did", "you", "see", "that", "last", "night", "and", "then",
+         "we", "should", "play", "again", "tomorrow", "if", "everyone", "is", "free", "remember", "what", "said"]
+
+
+class SummaryClient:
+    def __init__(self, delay, summary_words):
+        """
+        Stands in for the API client, answering summary requests with the start of the text after a delay.
+
+        :param delay: The time (in seconds) each request takes
+        :param summary_words: The number of words in each summary
+        """
+        self.delay = delay
+        self.summary_words = summary_words
+        self.request_count = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, messages, **kwargs):
+        self.request_count += 1
+        await asyncio.sleep(self.delay)
+        summary = " ".join(messages[-1]["content"].split()[:self.summary_words])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=summary))], usage=None)
+
+    async def close(self):
+        pass
+
+
+def make_chain(length, seed=0):
+    """
+    Makes a reply chain alternating between users and the bot, with an image on some user messages.
+
+    :param length: The number of messages
+    :param seed: The random seed, so runs are comparable
+    :return: The cached messages, oldest first
+    """
+    rng = random.Random(seed)
+    chain = []
+    for idx in range(length):
+        is_bot = idx % 2 == 1
+        chain.append(CachedMessage(
+            message_id=1000 + idx,
+            author=None if is_bot else f"User {rng.randint(1, 5)}",
+            content=" ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 120 if is_bot else 40))),
+            image_url=f"https://example.com/{idx}.png" if not is_bot and rng.random() < 0.2 else None,
+            parent_id=1000 + idx - 1 if idx else None
+        ))
+    return chain
+
+
+def count_prompt(manager, message_list):
+    """
+    Counts the tokens and images in a prompt.
+
+    :param manager: The manager whose token counter to use
+    :param message_list: The prompt messages
+    :return: The number of tokens, and the number of images
+    """
+    tokens = sum(manager.token_counter.count_message(message) for message in message_list)
+    images = sum(
+        1 for message in message_list if isinstance(message["content"], list)
+        for part in message["content"] if part["type"] == "image_url"
+    )
+    return tokens, images
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--length", type=int, default=200, help="The number of messages in the chain")
+    parser.add_argument("--budget", type=int, default=4000, help="The context token budget")
+    parser.add_argument("--summary-delay", type=float, default=0.05, help="How long each summary request takes")
+    parser.add_argument("--reply-interval", type=float, default=0.02, help="The time between mentions")
+    args = parser.parse_args()
+
+    client = SummaryClient(args.summary_delay, summary_words=250)
+    manager = ChatLLMManager(api_key="unused", system_prompt="You are a helpful Discord bot.",
+                             context_token_budget=args.budget, summary_max_tokens=400)
+    await manager.client.close()
+    manager.client = client
+
+    chain = make_chain(args.length)
+    print(f"{'messages':>8} | {'full prompt':>11} | {'budgeted':>8} | {'sent as is':>10} | {'summarized':>10} | "
+          f"{'left out':>8} | {'images':>6}")
+    max_tokens = 0
+    left_out_mentions = 0
+    for length in range(1, args.length + 1):
+        message_chain = chain[:length]
+        full_tokens, _ = count_prompt(manager, manager.get_system_prompts() + [
+            manager.format_cached_message(msg, include_image=True) for msg in message_chain
+        ] + [manager.get_metadata_prompt()])
+        message_list = manager.generate_gpt_messages_list(message_chain)
+        tokens, images = count_prompt(manager, message_list)
+        max_tokens = max(max_tokens, tokens)
+
+        # Summaries end on block boundaries, the one sent is the latest made before the first message sent as is
+        sent_as_is = sum(1 for message in message_list if message["role"] != "system")
+        first_sent_idx = length - sent_as_is
+        has_summary = any(message["content"].startswith("Summary") for message in message_list
+                          if message["role"] == "system")
+        summarized = max(
+            (count for count in range(manager.summary_block_size, first_sent_idx + 1, manager.summary_block_size)
+             if chain[count - 1].message_id in manager.summaries),
+            default=0
+        ) if has_summary else 0
+        left_out = first_sent_idx - summarized
+        left_out_mentions += left_out > 0
+
+        if length % 20 == 0 or length == args.length:
+            print(f"{length:>8} | {full_tokens:>11} | {tokens:>8} | {sent_as_is:>10} | {summarized:>10} | "
+                  f"{left_out:>8} | {images:>6}")
+
+        # Giving background summaries the time between mentions to run
+        await asyncio.sleep(args.reply_interval)
+
+    await manager.close()
+    print(f"Largest budgeted prompt: {max_tokens} tokens (budget {args.budget}), "
+          f"{client.request_count} summary requests, {left_out_mentions} mentions left messages out")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+"""
+Benchmark of AI chat mentions handled per second by the tree-structured ConversationCache, against the old
+cache that kept a list per chain (copying it on forks) and picked new chain ids out of a million-id set.
+Run from the repository root with: python -m utils.benchmarks.conversation_cache_benchmark
+"""
+import argparse
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from shared.ChatLLMManager import CachedMessage, ConversationCache
+
+BOT_USER_ID = 1
+
+
+class LegacyConversationCache(ConversationCache):
+    def __init__(self):
+        """
+        The old chain-list ConversationCache, for comparison. Downloading history isn't needed here,
+        since the benchmark only replies to messages that are already cached.
+        """
+        super().__init__()
+        self.message_chains = {}
+        self.message_to_chain = {}
+
+    async def _new_chain_id(self):
+        current_ids = self.message_chains.keys()
+        available_ids = set(range(1, 999999)) - current_ids
+        return random.choice(tuple(available_ids))
+
+    async def add_message(self, message):
+        if message.id in self.message_to_chain:
+            return None
+
+        chain_id = self.message_to_chain.get(message.reference.message_id) if message.reference else None
+        if chain_id:
+            chain = self.message_chains[chain_id]
+            chain_message_ids = [chain_msg.message_id for chain_msg in chain]
+            if message.reference.message_id in chain_message_ids[:-1]:
+                chain = chain[:chain_message_ids.index(message.reference.message_id) + 1]
+                chain_id = await self._new_chain_id()
+                self.message_chains[chain_id] = chain
+        else:
+            chain_id = await self._new_chain_id()
+            self.message_chains.setdefault(chain_id, [])
+
+        self.message_chains[chain_id].append(
+            CachedMessage(message_id=message.id,
+                          author=self.remove_author_name_if_bot(message),
+                          content=message.content,
+                          image_url=self.get_image_from_message(message))
+        )
+        self.message_to_chain[message.id] = chain_id
+
+    def get_message_chain(self, message):
+        if message.id in self.message_to_chain:
+            return self.message_chains[self.message_to_chain[message.id]]
+        return []
+
+
+def make_message(message_id, author_id, parent_id=None):
+    """
+    Makes a stand-in for a discord.Message with what the cache reads.
+
+    :param message_id: The id of the message
+    :param author_id: The id of the author
+    :param parent_id: The id of the message it replies to (optional)
+    :return: The fake message
+    """
+    return SimpleNamespace(
+        id=message_id,
+        author=SimpleNamespace(id=author_id, display_name=f"User {author_id}"),
+        content=f"Message {message_id}",
+        attachments=[],
+        reference=SimpleNamespace(message_id=parent_id) if parent_id else None
+    )
+
+
+async def run_mentions(cache, mention_count, new_thread_rate, fork_rate, seed=0):
+    """
+    Simulates AI chat mentions the way on_message handles them: cache the mention, get its chain, cache the reply.
+    Mentions start a new conversation, continue one from its latest reply, or fork one from an earlier reply.
+
+    :param cache: The cache to use
+    :param mention_count: The number of mentions
+    :param new_thread_rate: How often a mention starts a new conversation
+    :param fork_rate: How often a mention replies to an earlier bot reply instead of the latest one
+    :param seed: The random seed, so both caches see the same conversations
+    :return: The mentions handled per second, and the average chain length
+    """
+    rng = random.Random(seed)
+    bot_replies = []
+    next_id = 1000
+    total_chain_length = 0
+
+    cache.update_bot_user_id(BOT_USER_ID)
+    start = time.perf_counter()
+    for _ in range(mention_count):
+        roll = rng.random()
+        if not bot_replies or roll < new_thread_rate:
+            parent_id = None
+        elif roll < new_thread_rate + fork_rate:
+            parent_id = rng.choice(bot_replies)
+        else:
+            parent_id = bot_replies[-1]
+
+        mention = make_message(next_id, rng.randint(2, 20), parent_id)
+        await cache.add_message(mention)
+        total_chain_length += len(cache.get_message_chain(mention))
+
+        reply = make_message(next_id + 1, BOT_USER_ID, mention.id)
+        await cache.add_message(reply)
+        bot_replies.append(reply.id)
+        next_id += 2
+
+    return mention_count / (time.perf_counter() - start), total_chain_length / mention_count
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mentions", type=int, default=500, help="The number of mentions to simulate")
+    parser.add_argument("--new-thread-rate", type=float, default=0.1, help="How often a mention starts a conversation")
+    parser.add_argument("--fork-rate", type=float, default=0.2, help="How often a mention forks a conversation")
+    args = parser.parse_args()
+
+    print(f"{'cache':>8} | {'mentions/s':>12} | {'avg chain length':>16}")
+    for name, cache in {"legacy": LegacyConversationCache(), "tree": ConversationCache()}.items():
+        mentions_per_second, chain_length = await run_mentions(
+            cache, args.mentions, args.new_thread_rate, args.fork_rate
+        )
+        print(f"{name:>8} | {mentions_per_second:>12.0f} | {chain_length:>16.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
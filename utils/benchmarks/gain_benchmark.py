@@ -0,0 +1,83 @@
+"""
+Microbenchmark comparing discord.PCMVolumeTransformer (audioop) against the NumPy GainAudioSource.
+Run from the repository root with: python -m utils.benchmarks.gain_benchmark
+"""
+import time
+
+import discord
+import numpy as np
+
+from shared.audio_sources import GainAudioSource
+
+FRAME_COUNT = 15000  # 5 minutes of audio
+VOLUMES = [0.25, 1.0, 1.5]
+
+
+class MemoryAudioSource(discord.AudioSource):
+    def __init__(self, frames):
+        """
+        Audio source that replays pre-generated PCM frames.
+
+        :param frames: A list of PCM frames
+        """
+        self.frames = frames
+        self.index = 0
+
+    def read(self):
+        if self.index >= len(self.frames):
+            return b""
+        frame = self.frames[self.index]
+        self.index += 1
+        return frame
+
+
+def generate_frames(frame_count):
+    """
+    Generates random stereo PCM frames with a realistic level.
+
+    :param frame_count: The number of 20ms frames to generate
+    :return: A list of PCM frames
+    """
+    rng = np.random.default_rng(0)
+    samples_per_frame = discord.opus.Encoder.SAMPLES_PER_FRAME * discord.opus.Encoder.CHANNELS
+    return [
+        (rng.standard_normal(samples_per_frame) * 8000).clip(-32768, 32767).astype(np.int16).tobytes()
+        for _ in range(frame_count)
+    ]
+
+
+def time_source(source):
+    """
+    Reads a source to the end, timing every read.
+
+    :param source: The audio source to read
+    :return: The mean time per frame in microseconds
+    """
+    start = time.perf_counter()
+    while source.read():
+        pass
+    return (time.perf_counter() - start) / FRAME_COUNT * 1_000_000
+
+
+def main():
+    frames = generate_frames(FRAME_COUNT)
+    print(f"{'volume':>8} | {'PCMVolumeTransformer':>22} | {'GainAudioSource':>17}")
+    for volume in VOLUMES:
+        transformer_time = time_source(discord.PCMVolumeTransformer(MemoryAudioSource(frames), volume=volume))
+        gain_time = time_source(GainAudioSource(MemoryAudioSource(frames), volume=volume))
+        print(f"{volume:>8.2f} | {transformer_time:>17.1f} us/f | {gain_time:>12.1f} us/f")
+
+    # Live volume changes, ramping every 50 frames
+    gain_source = GainAudioSource(MemoryAudioSource(frames), volume=0.25)
+    start = time.perf_counter()
+    frame_idx = 0
+    while gain_source.read():
+        frame_idx += 1
+        if frame_idx % 50 == 0:
+            gain_source.volume = 1.5 if gain_source.volume < 1.0 else 0.25
+    ramp_time = (time.perf_counter() - start) / FRAME_COUNT * 1_000_000
+    print(f"GainAudioSource with live ramps every second: {ramp_time:.1f} us/f")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark comparing the CPU cost and time-to-first-packet of playing MP3 TTS audio (FFmpeg decode + Opus encode)
+against Ogg Opus TTS audio (passed straight through, or decoded by FFmpeg as the fallback).
+Run from the repository root with: python -m utils.benchmarks.tts_encoding_benchmark
+Real TTS clips can be compared instead of the generated tone with --mp3 <file> --ogg <file>.
+FFmpeg (with libmp3lame and libopus) and the Opus library need to be installed, or passed with --ffmpeg/--opus.
+"""
+import argparse
+import io
+import resource
+import subprocess
+import time
+
+import discord
+
+from shared.audio_sources import OggOpusAudioSource
+
+RUNS = 5
+
+
+def generate_audio(ffmpeg, codec_args, duration):
+    """
+    Generates a test tone with FFmpeg.
+
+    :param ffmpeg: The FFmpeg executable
+    :param codec_args: The FFmpeg output codec/format arguments
+    :param duration: The length of the tone in seconds
+    :return: The encoded audio bytes
+    """
+    return subprocess.run(
+        [ffmpeg, "-loglevel", "quiet", "-f", "lavfi", "-i", f"sine=frequency=220:duration={duration}",
+         "-ac", "2", "-ar", "48000", *codec_args, "pipe:1"],
+        check=True,
+        capture_output=True
+    ).stdout
+
+
+def read_file(file_path):
+    """
+    Reads an audio file.
+
+    :param file_path: The path to the file
+    :return: The file bytes
+    """
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+def get_cpu_time():
+    """
+    Gets the CPU time used so far by this process and its finished child processes (FFmpeg).
+
+    :return: The CPU time in seconds
+    """
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def time_playback(make_source):
+    """
+    Reads a source to the end the way the voice client does, encoding PCM to Opus when needed.
+
+    :param make_source: Creates the audio source to read
+    :return: The time to the first Opus packet and the total CPU time, both in milliseconds
+    """
+    encoder = discord.opus.Encoder()
+    cpu_start = get_cpu_time()
+    start = time.perf_counter()
+    first_packet_time = None
+
+    source = make_source()
+    while data := source.read():
+        packet = data if source.is_opus() else encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        if first_packet_time is None and packet:
+            first_packet_time = time.perf_counter() - start
+    source.cleanup()
+
+    return first_packet_time * 1000, (get_cpu_time() - cpu_start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mp3", help="An MP3 clip to benchmark, instead of a generated tone")
+    parser.add_argument("--ogg", help="An Ogg Opus clip to benchmark, instead of a generated tone")
+    parser.add_argument("--duration", type=float, default=10.0, help="The length of the generated tone in seconds")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="The FFmpeg executable to use")
+    parser.add_argument("--opus", help="The path to the Opus library, if discord.py can't find it")
+    args = parser.parse_args()
+
+    if args.opus:
+        discord.opus.load_opus(args.opus)
+    elif not discord.opus.is_loaded():
+        discord.opus._load_default()
+
+    mp3_audio = read_file(args.mp3) if args.mp3 else generate_audio(
+        args.ffmpeg, ["-c:a", "libmp3lame", "-f", "mp3"], args.duration
+    )
+    ogg_audio = read_file(args.ogg) if args.ogg else generate_audio(
+        args.ffmpeg, ["-c:a", "libopus", "-frame_duration", "20", "-f", "ogg"], args.duration
+    )
+
+    cases = {
+        "MP3 (FFmpeg + Opus encode)": lambda: discord.FFmpegPCMAudio(
+            io.BytesIO(mp3_audio), executable=args.ffmpeg, pipe=True
+        ),
+        "Ogg Opus (FFmpeg + Opus encode)": lambda: discord.FFmpegPCMAudio(
+            io.BytesIO(ogg_audio), executable=args.ffmpeg, pipe=True
+        ),
+        "Ogg Opus (passthrough)": lambda: OggOpusAudioSource(ogg_audio)
+    }
+
+    print(f"{'path':>32} | {'first packet':>12} | {'CPU':>10}")
+    for name, make_source in cases.items():
+        results = [time_playback(make_source) for _ in range(RUNS)]
+        first_packet = sum(r[0] for r in results) / RUNS
+        cpu = sum(r[1] for r in results) / RUNS
+        print(f"{name:>32} | {first_packet:>9.2f} ms | {cpu:>7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
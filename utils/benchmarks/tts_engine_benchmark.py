@@ -0,0 +1,98 @@
+"""
+Benchmark harness comparing TTS engines on the same set of messages, bypassing the TTS cache.
+Measures the latency of one request at a time, and of a burst of concurrent requests.
+Run from the repository root with: python -m utils.benchmarks.tts_engine_benchmark
+Google is only included when GOOGLE_APPLICATION_CREDENTIALS is set, and espeak only when it's installed.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from shared.tts_engines import EspeakTTSEngine, GoogleTTSEngine, ToneTTSEngine
+
+MESSAGES = [
+    "hi",
+    "Derek is leaving the voice channel",
+    "Did anyone see the game last night? That ending was unbelievable.",
+    "Okay so the plan is: we meet at eight, grab food on the way, and then head over to the venue together.",
+    "Something a bit longer, to see how the engines scale with text length. " * 4
+]
+
+
+def get_engines(tone_latency):
+    """
+    Creates every engine that can run here.
+
+    :param tone_latency: The simulated request latency for the tone engine
+    :return: A dictionary of engine names to engines
+    """
+    engines = {"tone": ToneTTSEngine(latency=tone_latency)}
+    if EspeakTTSEngine.find_command():
+        engines["espeak"] = EspeakTTSEngine()
+    if os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"):
+        engines["google"] = GoogleTTSEngine()
+    return engines
+
+
+async def time_request(engine, text):
+    """
+    Times one synthesis request.
+
+    :param engine: The engine to use
+    :param text: The text to synthesize
+    :return: The latency in milliseconds and the size of the audio in bytes
+    """
+    start = time.perf_counter()
+    audio_content = await engine.synthesize(text)
+    return (time.perf_counter() - start) * 1000, len(audio_content)
+
+
+async def benchmark_engine(engine, runs):
+    """
+    Benchmarks an engine on every message, one request at a time and then all at once.
+
+    :param engine: The engine to benchmark
+    :param runs: The number of times to synthesize each message
+    :return: The sequential latencies (ms), the total audio bytes, and the time (ms) to finish a concurrent burst
+    """
+    await engine.warm_up()
+
+    latencies = []
+    total_bytes = 0
+    for _ in range(runs):
+        for text in MESSAGES:
+            latency, size = await time_request(engine, text)
+            latencies.append(latency)
+            total_bytes += size
+
+    start = time.perf_counter()
+    await asyncio.gather(*(engine.synthesize(text) for text in MESSAGES))
+    burst_time = (time.perf_counter() - start) * 1000
+    return latencies, total_bytes, burst_time
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="The number of times to synthesize each message")
+    parser.add_argument("--tone-latency", type=float, default=0.0, help="Simulated latency (s) for the tone engine")
+    args = parser.parse_args()
+
+    print(f"{'engine':>8} | {'p50':>9} | {'p95':>9} | {'max':>9} | {'avg size':>10} | {'burst of ' + str(len(MESSAGES)):>11}")
+    for name, engine in get_engines(args.tone_latency).items():
+        try:
+            latencies, total_bytes, burst_time = await benchmark_engine(engine, args.runs)
+        except Exception as e:
+            print(f"{name:>8} | failed: {e}")
+            continue
+
+        p95 = statistics.quantiles(latencies, n=20, method="inclusive")[-1] if len(latencies) > 1 else latencies[0]
+        print(
+            f"{name:>8} | {statistics.median(latencies):>6.1f} ms | {p95:>6.1f} ms | {max(latencies):>6.1f} ms | "
+            f"{total_bytes / len(latencies) / 1024:>7.1f} KB | {burst_time:>8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
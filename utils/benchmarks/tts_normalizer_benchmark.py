@@ -0,0 +1,104 @@
+"""
+Benchmark comparing the single-pass TTSTextNormalizer against the old TTS text handling in DerekBot.on_message
+(an "https://" check, an emoji regex compiled per call, and one re.sub per mentioned user).
+Run from the repository root with: python -m utils.benchmarks.tts_normalizer_benchmark
+"""
+import argparse
+import random
+import re
+import time
+
+from shared.tts_text_normalizer import TTSTextNormalizer
+
+USER_NAMES = {100000000000000000 + i: f"User {i}" for i in range(50)}
+WORDS = ["the", "game", "was", "honestly", "great", "lol", "did", "you", "see", "that", "last", "night", "and",
+         "then", "we", "should", "play", "again", "tomorrow", "if", "everyone", "is", "free", "2*3", "won't", "it's"]
+FORMATTED_WORDS = ["**huge**", "*play*", "~~not~~", "`code`", "<:pog:123456789012345678>",
+                   "<a:dance:123456789012345679>"]
+REPEATS = 5
+
+
+def legacy_normalize(text, user_names):
+    """
+    The TTS text handling DerekBot.on_message did before the normalizer.
+
+    :param text: The message content
+    :param user_names: User ids to display names, standing in for message.mentions
+    :return: The text to synthesize, None if the message was skipped for having a URL
+    """
+    if "https://" in text:
+        return None
+    emoji_tag_pattern = re.compile(r"<a?:([a-zA-Z0-9_]+):\d+>")
+    text = emoji_tag_pattern.sub(lambda m: f"{m.group(1)}", text)
+    for user_id, display_name in user_names.items():
+        text = re.sub(f"<@!?{user_id}>", f"@ {display_name}", text)
+    return text
+
+
+def generate_messages(count, word_count, mention_count, formatted_word_rate, seed=0):
+    """
+    Generates chat messages with user mentions, and optionally markdown and custom emoji.
+
+    :param count: The number of messages
+    :param word_count: The number of words in each message
+    :param mention_count: The number of distinct users mentioned in each message
+    :param formatted_word_rate: How often a word has markdown or is a custom emoji
+    :param seed: The random seed, so runs are comparable
+    :return: A list of (content, mentioned user names) pairs
+    """
+    rng = random.Random(seed)
+    user_ids = list(USER_NAMES)
+    messages = []
+    for _ in range(count):
+        mentioned = {user_id: USER_NAMES[user_id] for user_id in rng.sample(user_ids, mention_count)}
+        words = [
+            rng.choice(FORMATTED_WORDS if rng.random() < formatted_word_rate else WORDS) for _ in range(word_count)
+        ]
+        for user_id in mentioned:
+            words.insert(rng.randrange(len(words) + 1), f"<@{user_id}>")
+        messages.append((" ".join(words), mentioned))
+    return messages
+
+
+def time_path(normalize, messages):
+    """
+    Times normalizing every message, keeping the best of a few repeats.
+
+    :param normalize: Takes the content and mentioned user names of a message
+    :param messages: The messages to normalize
+    :return: The average time per message in microseconds
+    """
+    best_time = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for content, user_names in messages:
+            normalize(content, user_names)
+        best_time = min(best_time, time.perf_counter() - start)
+    return best_time / len(messages) * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000, help="The number of messages per sample")
+    args = parser.parse_args()
+
+    normalizer = TTSTextNormalizer()
+    word_counts = {"short": 20, "medium": 80, "long": 300, "max length": 600}
+    mention_counts = {"short": 1, "medium": 3, "long": 10, "max length": 25}
+
+    print(f"{'sample':>32} | {'legacy':>10} | {'normalizer':>10} | {'speedup':>7}")
+    for formatted_word_rate in (0.0, 0.1):
+        for length, word_count in word_counts.items():
+            mention_count = mention_counts[length]
+            messages = generate_messages(args.messages, word_count, mention_count, formatted_word_rate)
+            legacy_time = time_path(legacy_normalize, messages)
+            normalizer_time = time_path(normalizer.normalize, messages)
+
+            name = f"{length}, {mention_count} @, {formatted_word_rate:.0%} md"
+            print(
+                f"{name:>32} | {legacy_time:>7.1f} us | {normalizer_time:>7.1f} us | "
+                f"{legacy_time / normalizer_time:>6.2f}x"
+            )
+
+if __name__ == "__main__":
+    main()